@@ -0,0 +1,139 @@
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# ── Turn admission ────────────────────────────────────────────────────────────
+# Caps how many agent turns run at once across all sessions. A turn can fan
+# out into several LLM calls down the agent chain, so past a point admitting
+# more only makes every session slower. Waiting turns form a priority queue
+# (lower value first, FIFO within a priority): sessions closest to revenue go
+# first. When the queue is full the least important waiter is shed — possibly
+# the newcomer — and so is anyone who waits past max_wait; shed callers get
+# Overloaded with a retry_after estimate.
+#
+# The limit adapts to the smoothed LLM latency (AIMD): above target it shrinks
+# by 10% (at most once per adjust_interval), below 80% of target it grows by
+# one while the limit is actually in use.
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Overloaded; retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight: int = 16, min_in_flight: int = 2, max_queue: int = 64,
+                 max_wait: float = 15.0, target_latency: float = 3.0,
+                 latency: Callable[[], Optional[float]] = lambda: None, adjust_interval: float = 1.0):
+        self.max_in_flight = max(1, max_in_flight)
+        self.min_in_flight = max(1, min(min_in_flight, self.max_in_flight))
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.target_latency = target_latency
+        self.latency = latency
+        self.adjust_interval = adjust_interval
+        self.limit = float(self.max_in_flight)
+        self.in_flight = 0
+        # (priority, arrival, future)
+        self._waiting: List[Tuple[int, int, asyncio.Future]] = []
+        self._arrivals = itertools.count()
+        self._adjusted = 0.0
+        self._turn_seconds: Optional[float] = None
+        self.admitted = 0
+        self.shed = 0
+
+    # ── Admission ─────────────────────────────────────────────────────────────
+    def retry_after(self) -> float:
+        """Rough time until a new turn would be admitted: queue ahead of it / throughput."""
+        turn = self._turn_seconds or self.target_latency
+        return max(1.0, round(turn * (len(self._waiting) + 1) / max(1.0, self.limit)))
+
+    def _shed_worst(self) -> None:
+        # The least important, most recent waiter
+        worst = max(self._waiting, key=lambda w: (w[0], w[1]))
+        self._waiting.remove(worst)
+        heapq.heapify(self._waiting)
+        self.shed += 1
+        worst[2].set_exception(Overloaded(self.retry_after()))
+
+    async def acquire(self, priority: int) -> None:
+        """Waits for a turn slot; raises Overloaded when shed."""
+        if self.in_flight < int(self.limit) and not self._waiting:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+
+        if len(self._waiting) >= self.max_queue:
+            if not self._waiting or max(w[0] for w in self._waiting) <= priority:
+                self.shed += 1
+                raise Overloaded(self.retry_after())
+            self._shed_worst()
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._arrivals), future)
+        heapq.heappush(self._waiting, entry)
+        try:
+            # shield: a timeout must not cancel a future _wake() already resolved
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if future.done() and future.exception() is None:
+                return  # admitted just as the wait ran out; the slot is ours
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+            self.shed += 1
+            raise Overloaded(self.retry_after())
+        except asyncio.CancelledError:
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+            elif future.done() and future.exception() is None:
+                self.release(0.0)
+            raise
+
+    def _wake(self) -> None:
+        while self._waiting and self.in_flight < int(self.limit):
+            _priority, _arrival, future = heapq.heappop(self._waiting)
+            if future.done():
+                continue
+            self.in_flight += 1
+            self.admitted += 1
+            future.set_result(None)
+
+    def release(self, turn_seconds: float) -> None:
+        self.in_flight -= 1
+        if turn_seconds > 0:
+            self._turn_seconds = turn_seconds if self._turn_seconds is None else 0.8 * self._turn_seconds + 0.2 * turn_seconds
+        self._adapt()
+        self._wake()
+
+    # ── Adaptive limit ────────────────────────────────────────────────────────
+    def _adapt(self) -> None:
+        latency = self.latency()
+        now = time.monotonic()
+        if latency is None or now - self._adjusted < self.adjust_interval:
+            return
+        if latency > self.target_latency:
+            self.limit = max(float(self.min_in_flight), self.limit * 0.9)
+            self._adjusted = now
+        elif latency < 0.8 * self.target_latency and self.in_flight + len(self._waiting) >= int(self.limit):
+            self.limit = min(float(self.max_in_flight), self.limit + 1)
+            self._adjusted = now
+
+    def metrics(self) -> Dict[str, Any]:
+        by_priority: Dict[int, int] = {}
+        for priority, _arrival, _future in self._waiting:
+            by_priority[priority] = by_priority.get(priority, 0) + 1
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiting),
+            "waiting_by_priority": by_priority,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "turn_ms_ewma": round(self._turn_seconds * 1000, 1) if self._turn_seconds is not None else None,
+        }
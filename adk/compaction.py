@@ -0,0 +1,117 @@
+import json
+from typing import List, Dict, Any, Optional
+
+# Handoff payload fields that downstream agents rely on. They are copied into
+# shared_context so they survive even after the tool message carrying them is
+# compacted away.
+PINNED_HANDOFF_KEYS = (
+    "product_id", "product_name", "asking_price",
+    "agreed_price", "reserved_qty", "invoice_id"
+)
+
+SUMMARY_MARKER = "[Conversation summary]"
+ELIDED_PREFIX = "[elided "
+
+
+def estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Cheap token estimate (~4 characters per token) — good enough for budgeting."""
+    chars = 0
+    for msg in messages:
+        chars += len(msg.get("content") or "")
+        for tc in msg.get("tool_calls") or []:
+            chars += len(tc.get("function", {}).get("arguments") or "")
+    return chars // 4
+
+
+def pin_handoff_facts(shared_context: Dict[str, Any], handoff: Dict[str, Any]) -> None:
+    for key in PINNED_HANDOFF_KEYS:
+        if key in handoff:
+            shared_context[key] = handoff[key]
+
+
+def _elide_tool_result(msg: Dict[str, Any]) -> Dict[str, Any]:
+    """Replaces a bulky tool result with a one-line digest that keeps ids and names."""
+    content = msg.get("content") or ""
+    if isinstance(content, str) and content.startswith(ELIDED_PREFIX):
+        # Already a digest from an earlier pass: re-eliding would nest prefixes,
+        # lose the ids and change the cacheable prefix every turn
+        return msg
+    name = msg.get("name", "tool")
+    try:
+        data = json.loads(content)
+    except (ValueError, TypeError):
+        data = None
+
+    if isinstance(data, list):
+        items = [
+            f"{d.get('id', '?')} {d.get('name', '')}".strip()
+            for d in data if isinstance(d, dict)
+        ]
+        digest = f"{len(data)} results: " + ", ".join(items)
+    elif isinstance(data, dict):
+        scalars = [f"{k}={v}" for k, v in data.items() if isinstance(v, (str, int, float, bool))]
+        digest = ", ".join(scalars[:6])
+    else:
+        digest = content[:120]
+
+    return {**msg, "content": f"{ELIDED_PREFIX}{name} result: {digest}]"}
+
+
+def _split_exchanges(messages: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Groups history into exchanges, each starting at a user message."""
+    exchanges: List[List[Dict[str, Any]]] = [[]]
+    for msg in messages:
+        if msg.get("role") == "user" and exchanges[-1]:
+            exchanges.append([])
+        exchanges[-1].append(msg)
+    return [ex for ex in exchanges if ex]
+
+
+def _flatten(exchanges: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    return [msg for exchange in exchanges for msg in exchange]
+
+
+def _summary_message(previous: Optional[str], dropped: List[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    lines = previous.split("\n")[1:] if previous else []
+    for exchange in dropped:
+        for msg in exchange:
+            if msg.get("role") == "user" and msg.get("content"):
+                lines.append(f"- Customer said: {msg['content'][:80]}")
+    return {"role": "system", "content": "\n".join([SUMMARY_MARKER] + lines[-20:])}
+
+
+def compact_history(
+    messages: List[Dict[str, Any]],
+    budget_tokens: int,
+    keep_exchanges: int
+) -> List[Dict[str, Any]]:
+    """
+    Returns the history unchanged while it fits budget_tokens. Otherwise the
+    last keep_exchanges exchanges stay verbatim, older tool results are
+    elided to digests and, if that is still too large, the oldest exchanges
+    are folded into a short summary message.
+    """
+    if estimate_tokens(messages) <= budget_tokens:
+        return messages
+
+    previous_summary = None
+    if messages and messages[0].get("role") == "system" and (messages[0].get("content") or "").startswith(SUMMARY_MARKER):
+        previous_summary = messages[0]["content"]
+        messages = messages[1:]
+
+    exchanges = _split_exchanges(messages)
+    split = max(0, len(exchanges) - keep_exchanges)
+    old = [
+        [_elide_tool_result(m) if m.get("role") == "tool" else m for m in ex]
+        for ex in exchanges[:split]
+    ]
+    recent = exchanges[split:]
+
+    # Compact to below the budget so the (cacheable) prefix is not rewritten every turn
+    target = int(budget_tokens * 0.75)
+    dropped: List[List[Dict[str, Any]]] = []
+    while old and estimate_tokens(_flatten(old + recent)) > target:
+        dropped.append(old.pop(0))
+
+    head = [_summary_message(previous_summary, dropped)] if (dropped or previous_summary) else []
+    return head + _flatten(old + recent)
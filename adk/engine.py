@@ -1,215 +1,695 @@
 import json
+import time
+import uuid
 import asyncio
-from config import get_llm_completion, get_llm_acompletion
+from config import (
+    get_llm_completion, get_llm_acompletion, agent_models, STREAM_RESPONSES, MAX_TOOL_CONCURRENCY,
+    MAX_TURN_ITERATIONS, TURN_TIMEOUT_SECONDS, HISTORY_TOKEN_BUDGET, HISTORY_KEEP_EXCHANGES,
+    LLM_ATTEMPT_TIMEOUT_SECONDS, tracer
+)
+from adk.tracing import annotate
 from adk.mcp_client import ToolExecutor
+from adk.compaction import compact_history, pin_handoff_facts
+from litellm import Message, cost_per_token
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional, Callable
+from typing import List, Dict, Any, Optional, Callable, Generator
+
+def _call_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """USD cost of one call from litellm's price table; 0 for models it does not know."""
+    try:
+        prompt_cost, completion_cost = cost_per_token(
+            model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens
+        )
+        return prompt_cost + completion_cost
+    except Exception:
+        return 0.0
 
 # Lazy import to avoid circular dependency — only used for cart enrichment
-def _get_catalog_lookup():
+def _get_catalog_product(product_id: str) -> Dict[str, Any]:
     try:
-        from mcp_servers.catalog_server import _PRICING
-        return _PRICING
+        from mcp_servers.catalog_server import get_product
+        return get_product(product_id) or {}
     except Exception:
         return {}
 
+class JsonLineFilter:
+    """
+    Incremental version of the "drop raw {...} JSON lines" cleanup.
+    Feed it partial text as it streams in; it returns whatever is safe to show
+    now and holds back only a line that starts with '{' until it can tell
+    whether that line is a leaked tool call. Output matches stripping every
+    line, dropping JSON lines and stripping the joined result.
+    """
+    def __init__(self):
+        self._mode = None          # None = only whitespace so far, "text" or "json"
+        self._line = ""            # held-back line while in "json" mode
+        self._pending_ws = ""      # trailing whitespace not yet known to be inner
+        self._pending_newlines = 0
+        self._started = False
+
+    def _emit(self, text: str) -> str:
+        prefix = "\n" * self._pending_newlines if self._started else ""
+        self._pending_newlines = 0
+        self._started = True
+        return prefix + text
+
+    def _end_line(self) -> str:
+        out = ""
+        if self._mode == "json":
+            line = self._line.rstrip()
+            if not line.endswith("}"):
+                out = self._emit(line)
+                self._pending_newlines += 1
+        else:
+            self._pending_newlines += 1
+        self._mode = None
+        self._line = ""
+        self._pending_ws = ""
+        return out
+
+    def feed(self, chunk: str) -> str:
+        out = []
+        for ch in chunk:
+            if ch == "\n":
+                out.append(self._end_line())
+            elif self._mode is None:
+                if ch.isspace():
+                    continue
+                if ch == "{":
+                    self._mode = "json"
+                    self._line = ch
+                else:
+                    self._mode = "text"
+                    out.append(self._emit(ch))
+            elif self._mode == "json":
+                self._line += ch
+            elif ch.isspace():
+                self._pending_ws += ch
+            else:
+                out.append(self._pending_ws + ch)
+                self._pending_ws = ""
+        return "".join(out)
+
+    def flush(self) -> str:
+        out = ""
+        if self._mode == "json":
+            line = self._line.rstrip()
+            if not line.endswith("}"):
+                out = self._emit(line)
+        self.__init__()
+        return out
+
+
+class StreamInterrupted(Exception):
+    """A streamed completion failed after part of its text was already sent to the client."""
+
+
+class TurnBudgetExceeded(Exception):
+    """Raised inside the turn loop when an agent runs out of LLM round-trips or wall-clock time."""
+    def __init__(self, agent: str, reason: str, iterations: int, elapsed: float):
+        self.agent = agent
+        self.reason = reason
+        self.iterations = iterations
+        self.elapsed = elapsed
+        super().__init__(f"{agent} exceeded the turn's {reason} budget after {iterations} LLM calls ({elapsed:.1f}s)")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "code": "turn_budget_exceeded",
+            "agent": self.agent,
+            "budget": self.reason,
+            "iterations": self.iterations,
+            "elapsed_seconds": round(self.elapsed, 2),
+            "message": "Sorry, that took longer than expected. Please try again."
+        }
+
+
+class TurnBudget:
+    """
+    LLM round-trips and wall-clock seconds for one user message. The caller
+    creates it once and passes it to every agent the message reaches, so a
+    Discovery → Negotiator → Inventory → OrderTaking chain shares one cap.
+    """
+    def __init__(self, max_iterations: int = MAX_TURN_ITERATIONS, timeout: float = TURN_TIMEOUT_SECONDS):
+        self.max_iterations = max_iterations
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout
+        self.iterations = 0
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def exhausted(self) -> Optional[str]:
+        """The budget that has run out ("iterations" or "time"), or None."""
+        if self.iterations >= self.max_iterations:
+            return "iterations"
+        if time.monotonic() >= self.deadline:
+            return "time"
+        return None
+
+
+# ── Turn-loop effects ─────────────────────────────────────────────────────────
+# Agent._turn is a generator that yields these requests; the sync (run) and
+# async (run_async) drivers perform them and send the result back in.
+class _LLMCall:
+    def __init__(self, messages: List[Dict], tools: Optional[List[Dict]], deadline: float):
+        self.messages = messages
+        self.tools = tools
+        self.deadline = deadline
+
+class _RunTools:
+    def __init__(self, tool_calls: List[Any]):
+        self.tool_calls = tool_calls
+
+class _Emit:
+    def __init__(self, event_type: str, payload: Any):
+        self.event_type = event_type
+        self.payload = payload
+
+
+# ── Deterministic workflow steps ──────────────────────────────────────────────
+# An Agent built with workflow= runs a Python generator instead of the LLM
+# loop. It yields ToolStep (the tool's JSON result is sent back) and Reply;
+# the engine turns them into the same events and history an LLM turn makes.
+class ToolStep:
+    def __init__(self, tool: str, **arguments: Any):
+        self.tool = tool
+        self.arguments = arguments
+
+class Reply:
+    def __init__(self, text: str):
+        self.text = text
+
+# Returned by a workflow that cannot handle the state; the LLM loop takes the turn
+DEFER_TO_LLM = "defer_to_llm"
+
+
 class AgentState(BaseModel):
     user_id: str
     messages: List[Dict[str, Any]]
     shared_context: Dict[str, Any] = {}
     current_agent: str = "Discovery"
+    # Bumped by the session store on every save (optimistic concurrency)
+    version: int = 0
 
 class Agent:
-    def __init__(self, name: str, instructions: str, tools: List[Callable]):
+    def __init__(
+        self,
+        name: str,
+        instructions: str,
+        tools: List[Callable],
+        stream: bool = STREAM_RESPONSES,
+        parallel_tools: bool = False,
+        max_tool_concurrency: int = MAX_TOOL_CONCURRENCY,
+        max_iterations: int = MAX_TURN_ITERATIONS,
+        turn_timeout: float = TURN_TIMEOUT_SECONDS,
+        history_token_budget: int = HISTORY_TOKEN_BUDGET,
+        keep_exchanges: int = HISTORY_KEEP_EXCHANGES,
+        model: Optional[str] = None,
+        fallback_models: Optional[List[str]] = None,
+        attempt_timeout: float = LLM_ATTEMPT_TIMEOUT_SECONDS,
+        workflow: Optional[Callable[[AgentState], Generator[Any, Any, Any]]] = None
+    ):
         self.name = name
         self.instructions = instructions
         self.tool_executor = ToolExecutor(tools) if tools else None
+        self.stream = stream
+        # When enabled the model may batch independent tool calls in one turn
+        # and the engine runs them concurrently (bounded by max_tool_concurrency)
+        self.parallel_tools = parallel_tools
+        self.max_tool_concurrency = max_tool_concurrency
+        # Budget for a run not given a shared TurnBudget: LLM round-trips and wall-clock seconds
+        self.max_iterations = max_iterations
+        self.turn_timeout = turn_timeout
+        # History compaction: older exchanges are elided once this is exceeded
+        self.history_token_budget = history_token_budget
+        self.keep_exchanges = keep_exchanges
+        # Primary model first, then fallbacks tried on error or attempt timeout
+        self.models = agent_models(name, model, fallback_models)
+        self.attempt_timeout = attempt_timeout
+        # Fixed tool procedure run without model round-trips (see ToolStep)
+        self.workflow = workflow
+
+        # Built once per agent so every request starts with the same bytes
+        self.system_message = {
+            "role": "system",
+            "content": (
+                f"{self.instructions}\n\n"
+                "STRICT SYSTEM CONSTRAINTS:\n"
+                "1. You must STRICTLY adhere to your persona. Do not hallucinate capabilities or information outside of your instructions.\n"
+                "2. Keep your conversational responses clean, professional, and concise.\n"
+                "3. CRITICAL: You have access to tools/functions. Always call them using the proper tool-calling mechanism provided by the API. NEVER output tool calls as plain text or in any text-based format inside your response. Your text response is ONLY for human reading."
+            )
+        }
+        self.usage = {
+            "calls": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0,
+            "fallbacks": 0, "latency_seconds": 0.0, "cost_usd": 0.0
+        }
+        self.model_stats: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def _context_message(state: AgentState) -> Optional[Dict[str, str]]:
+        """
+        Volatile per-session context (previous agents' handoff facts) travels in
+        its own trailing message so the static system prompt stays a
+        byte-stable prefix that provider-side prompt caching can hit.
+        """
+        if not state.shared_context:
+            return None
+        return {
+            "role": "system",
+            "content": f"Context from previous agents: {json.dumps(state.shared_context, sort_keys=True)}"
+        }
+
+    def _model_stats(self, model: str) -> Dict[str, Any]:
+        return self.model_stats.setdefault(model, {
+            "calls": 0, "errors": 0, "latency_seconds": 0.0, "cost_usd": 0.0
+        })
 
-    def run(self, state: AgentState) -> AgentState:
-        # Prepend system prompt
-        base_instructions = (
-            f"{self.instructions}\n\n"
-            "STRICT SYSTEM CONSTRAINTS:\n"
-            "1. You must STRICTLY adhere to your persona. Do not hallucinate capabilities or information outside of your instructions.\n"
-            "2. Keep your conversational responses clean, professional, and concise.\n"
-            "3. CRITICAL: You have access to tools/functions. Always call them using the proper tool-calling mechanism provided by the API. NEVER output tool calls as plain text or in any text-based format inside your response. Your text response is ONLY for human reading."
+    def _record_usage(self, model: str, latency: float, usage: Any) -> None:
+        """Prints per-call latency, cost and prompt-cache usage and adds them to the agent's running totals."""
+        details = getattr(usage, "prompt_tokens_details", None) if usage else None
+        prompt = (getattr(usage, "prompt_tokens", 0) or 0) if usage else 0
+        cached = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+        completion = (getattr(usage, "completion_tokens", 0) or 0) if usage else 0
+        cost = _call_cost(model, prompt, completion)
+
+        self.usage["calls"] += 1
+        self.usage["prompt_tokens"] += prompt
+        self.usage["cached_prompt_tokens"] += cached
+        self.usage["completion_tokens"] += completion
+        self.usage["latency_seconds"] += latency
+        self.usage["cost_usd"] += cost
+        stats = self._model_stats(model)
+        stats["calls"] += 1
+        stats["latency_seconds"] += latency
+        stats["cost_usd"] += cost
+        annotate(prompt_tokens=prompt, cached_tokens=cached, completion_tokens=completion, cost_usd=cost)
+        print(
+            f"[{self.name}] LLM {model}: {latency * 1000:.0f}ms ${cost:.6f} "
+            f"prompt={prompt} (cached={cached}, uncached={prompt - cached}) completion={completion}"
         )
-        system_msg = {"role": "system", "content": base_instructions}
-        
-        # Inject shared context into system prompt
-        if state.shared_context:
-            system_msg["content"] += f"\n\nContext from previous agents: {json.dumps(state.shared_context)}"
-            
-        messages = [system_msg] + state.messages
+
+    def _record_failure(self, model: str, error: BaseException) -> None:
+        self.usage["fallbacks"] += 1
+        self._model_stats(model)["errors"] += 1
+        print(f"[{self.name}] LLM {model} failed ({type(error).__name__}: {error}); falling back")
+
+    def stats(self) -> Dict[str, Any]:
+        """Running latency/cost/token totals for this agent, overall and per model."""
+        calls = self.usage["calls"]
+        return {
+            "models": self.models,
+            **self.usage,
+            "avg_latency_ms": round(self.usage["latency_seconds"] / calls * 1000, 1) if calls else None,
+            "by_model": self.model_stats
+        }
+
+    def _budget(self, budget: Optional[TurnBudget]) -> TurnBudget:
+        return budget if budget is not None else TurnBudget(self.max_iterations, self.turn_timeout)
+
+    def _turn(self, state: AgentState, budget: TurnBudget) -> Generator[Any, Any, AgentState]:
+        """
+        The single turn loop shared by run and run_async. It never performs I/O
+        itself: LLM calls, tool execution and events are yielded as effects for
+        the driver, which sends back the result. LLM round-trips and time are
+        charged to budget, which earlier agents of the same user message may
+        already have used.
+        """
+        if self.workflow is not None:
+            outcome = yield from self._workflow_turn(state)
+            if outcome != DEFER_TO_LLM:
+                return state
+            print(f"[{self.name}] Workflow deferred to the LLM")
+
+        state.messages = compact_history(state.messages, self.history_token_budget, self.keep_exchanges)
+        messages = [self.system_message] + state.messages
+        tools = self.tool_executor.schemas if self.tool_executor else None
         
         while True:
+            # Enforce the per-message budget before every LLM round-trip
+            exhausted = budget.exhausted()
+
             # Call LLM
-            tools = self.tool_executor.schemas if self.tool_executor else None
-            response = get_llm_completion(messages=messages, tools=tools)
-            msg = response.choices[0].message # type: ignore
+            if exhausted is None:
+                budget.iterations += 1
+                try:
+                    # Re-read context each call: handoff facts may change mid-turn
+                    context_msg = self._context_message(state)
+                    request = messages + [context_msg] if context_msg else list(messages)
+                    msg, streamed = yield _LLMCall(request, tools, budget.deadline)
+                except TimeoutError:
+                    exhausted = "time"
+            if exhausted is not None:
+                error = TurnBudgetExceeded(self.name, exhausted, budget.iterations, budget.elapsed)
+                print(f"[{self.name}] {error}")
+                yield _Emit("error", error.to_dict())
+                return state
+
+            # Pass text content directly if it's there (streaming drivers already did)
+            if msg.content and not streamed:
+                text_filter = JsonLineFilter()
+                cleaned = text_filter.feed(msg.content) + text_filter.flush()
+                if cleaned:
+                    yield _Emit("chat_stream", cleaned)
+                    yield _Emit("chat_stream_end", None)
             
             # Append to history
             messages.append(msg.model_dump())
             state.messages.append(msg.model_dump())
-            
-            if msg.tool_calls:
-                for tool_call in msg.tool_calls:
-                    print(f"[{self.name}] Tool Call: {tool_call.function.name}")
-                    if self.tool_executor:
-                        result = self.tool_executor.execute(tool_call)
-                    else:
-                        result = "Error: Tool executor not initialized."
-                    
-                    # Add tool response
-                    tool_msg = {
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "name": tool_call.function.name,
-                        "content": result
-                    }
-                    messages.append(tool_msg)
-                    state.messages.append(tool_msg)
-                    
-                    # Intercept handoffs
-                    if "handoff_to" in result:
-                        try:
-                            res_val = json.loads(result)
-                            if "handoff_to" in res_val:
-                                state.current_agent = res_val["handoff_to"]
-                                state.shared_context[f"{self.name}_handoff_reason"] = res_val.get("reason", "")
-                                return state
-                        except:
-                            pass
-            else:
+
+            if not msg.tool_calls:
                 # Agent replied to user or decided to wait
-                break
+                return state
+
+            # Independent calls of one turn run together; results are still
+            # consumed below in the order the model issued them
+            if self.parallel_tools:
+                for tool_call in msg.tool_calls:
+                    yield from self._tool_started(tool_call)
+                results = yield _RunTools(msg.tool_calls)
+
+            handoff = None
+            for index, tool_call in enumerate(msg.tool_calls):
+                if self.parallel_tools:
+                    result = results[index]
+                else:
+                    yield from self._tool_started(tool_call)
+                    result = (yield _RunTools([tool_call]))[0]
                 
-        return state
-
-    async def run_async(self, state: AgentState, emit_event: Callable) -> AgentState:
-        # Prepend system prompt
-        base_instructions = (
-            f"{self.instructions}\n\n"
-            "STRICT SYSTEM CONSTRAINTS:\n"
-            "1. You must STRICTLY adhere to your persona. Do not hallucinate capabilities or information outside of your instructions.\n"
-            "2. Keep your conversational responses clean, professional, and concise.\n"
-            "3. CRITICAL: You have access to tools/functions. Always call them using the proper tool-calling mechanism provided by the API. NEVER output tool calls as plain text or in any text-based format inside your response. Your text response is ONLY for human reading."
-        )
-        system_msg = {"role": "system", "content": base_instructions}
-        
-        # Inject shared context into system prompt
-        if state.shared_context:
-            system_msg["content"] += f"\n\nContext from previous agents: {json.dumps(state.shared_context)}"
-            
-        messages = [system_msg] + state.messages
-        
+                tool_msg, found = yield from self._tool_finished(tool_call, result)
+                messages.append(tool_msg)
+                state.messages.append(tool_msg)
+
+                # Intercept handoffs — the first one in call order wins. Results of
+                # calls that already ran concurrently are still recorded so every
+                # tool_call in the assistant message keeps its tool response.
+                if handoff is None and found is not None:
+                    handoff = found
+                    if not self.parallel_tools:
+                        break
+
+            if handoff is not None:
+                yield from self._handoff(state, handoff)
+                return state
+
+    def _workflow_turn(self, state: AgentState) -> Generator[Any, Any, Any]:
+        """
+        Drives the agent's workflow generator. Each ToolStep becomes an
+        assistant tool_call message plus its tool result, exactly as if the
+        model had issued it, so later agents and compaction see the same history.
+        """
+        steps = self.workflow(state)
+        value = None
         while True:
-            # Call LLM
-            tools = self.tool_executor.schemas if self.tool_executor else None
-            response = await get_llm_acompletion(messages=messages, tools=tools)
-            msg = response.choices[0].message # type: ignore
-            
-            # Append to history
-            messages.append(msg.model_dump())
-            state.messages.append(msg.model_dump())
-            
-            # Pass text content directly if it's there
-            if msg.content:
-                cleaned_content = []
-                for line in msg.content.split('\n'):
-                    line = line.strip()
-                    if not (line.startswith('{') and line.endswith('}')):
-                        cleaned_content.append(line)
-                cleaned = '\n'.join(cleaned_content).strip()
-                if cleaned:
-                    await emit_event("chat_stream", cleaned)
+            try:
+                step = steps.send(value)
+            except StopIteration as done:
+                return done.value
 
-            if msg.tool_calls:
-                for tool_call in msg.tool_calls:
-                    print(f"[{self.name}] Tool Call: {tool_call.function.name}")
-                    
-                    # Send tool call event to frontend
-                    await emit_event("tool_call", {
-                        "tool": tool_call.function.name,
-                        "status": "running"
-                    })
-                    
-                    if self.tool_executor:
-                        result = await asyncio.to_thread(self.tool_executor.execute, tool_call)
+            value = None
+            if isinstance(step, Reply):
+                yield _Emit("chat_stream", step.text)
+                yield _Emit("chat_stream_end", None)
+                state.messages.append({"role": "assistant", "content": step.text})
+            elif isinstance(step, ToolStep):
+                msg = Message(role="assistant", content=None, tool_calls=[{
+                    "id": f"wf_{uuid.uuid4().hex[:12]}",
+                    "type": "function",
+                    "function": {"name": step.tool, "arguments": json.dumps(step.arguments)}
+                }])
+                state.messages.append(msg.model_dump())
+                tool_call = msg.tool_calls[0] # type: ignore
+                yield from self._tool_started(tool_call)
+                value = (yield _RunTools([tool_call]))[0]
+                tool_msg, handoff = yield from self._tool_finished(tool_call, value)
+                state.messages.append(tool_msg)
+                if handoff is not None:
+                    yield from self._handoff(state, handoff)
+                    return None
+
+    def _tool_finished(self, tool_call, result: str) -> Generator[Any, Any, Any]:
+        """Emits the completion events for one tool call; returns its tool message and any handoff it carries."""
+        # Notify tool complete
+        yield _Emit("tool_call", {
+            "tool": tool_call.function.name,
+            "status": "success",
+            "output": result
+        })
+
+        # Special Case Events from Tool Returns
+        if tool_call.function.name == "handoff_to_inventory" and "agreed_price" in result:
+            yield from self._cart_events(result)
+
+        handoff = None
+        if "handoff_to" in result:
+            try:
+                res_val = json.loads(result)
+                if "handoff_to" in res_val:
+                    handoff = res_val
+            except:
+                pass
+
+        tool_msg = {
+            "role": "tool",
+            "tool_call_id": tool_call.id,
+            "name": tool_call.function.name,
+            "content": result
+        }
+        return tool_msg, handoff
+
+    def _handoff(self, state: AgentState, handoff: Dict[str, Any]) -> Generator[Any, Any, None]:
+        next_agent = handoff["handoff_to"]
+        state.current_agent = next_agent
+        reason = handoff.get("reason", "")
+        state.shared_context[f"{self.name}_handoff_reason"] = reason
+        pin_handoff_facts(state.shared_context, handoff)
+
+        yield _Emit("agent_transition", {
+            "from": self.name,
+            "to": next_agent,
+            "reason": reason
+        })
+
+    def _tool_started(self, tool_call) -> Generator[Any, Any, None]:
+        print(f"[{self.name}] Tool Call: {tool_call.function.name}")
+
+        # Send tool call event to frontend
+        yield _Emit("tool_call", {
+            "tool": tool_call.function.name,
+            "status": "running"
+        })
+
+    def _cart_events(self, result: str) -> Generator[Any, Any, None]:
+        try:
+            res_val = json.loads(result)
+            product_id = res_val.get("product_id")
+            agreed_price = res_val.get("agreed_price")
+
+            # Enrich with catalog data for the frontend discount display
+            product_info = _get_catalog_product(product_id)
+            product_name = product_info.get("name", product_id)
+            original_price = product_info.get("price", agreed_price)
+            savings = round(original_price - agreed_price, 2)
+        except:
+            return
+
+        yield _Emit("price_update", {
+            "product_id": product_id,
+            "new_price": agreed_price,
+            "reason": "Negotiated Deal"
+        })
+        yield _Emit("cart_update", {
+            "items": [{
+                "id": product_id,
+                "name": product_name,
+                "qty": 1,
+                "agreed_price": agreed_price,
+                "original_price": original_price,
+                "savings": savings
+            }],
+            "total": agreed_price,
+            "status": "reserved"
+        })
+
+    def _execute_tool(self, tool_call) -> str:
+        with tracer.span("tool", agent=self.name, tool=tool_call.function.name) as span:
+            if not self.tool_executor:
+                return "Error: Tool executor not initialized."
+            result = self.tool_executor.execute(tool_call)
+            span.set(output_chars=len(result))
+            return result
+
+    # ── Sync driver ───────────────────────────────────────────────────────────
+    def run(self, state: AgentState, emit_event: Optional[Callable] = None,
+            budget: Optional[TurnBudget] = None) -> AgentState:
+        turn = self._turn(state, self._budget(budget))
+        value = None
+        while True:
+            try:
+                effect = turn.send(value)
+            except StopIteration as done:
+                return done.value
+
+            value = None
+            if isinstance(effect, _LLMCall):
+                value = (self._complete(effect), False)
+            elif isinstance(effect, _RunTools):
+                value = [self._execute_tool(tc) for tc in effect.tool_calls]
+            elif isinstance(effect, _Emit) and emit_event:
+                emit_event(effect.event_type, effect.payload)
+
+    def _complete(self, call: _LLMCall):
+        """Tries each model of the chain in turn; the last model's error propagates."""
+        for index, model in enumerate(self.models):
+            started = time.monotonic()
+            try:
+                response = get_llm_completion(
+                    messages=call.messages, model=model, tools=call.tools,
+                    parallel_tool_calls=self.parallel_tools
+                )
+            except Exception as e:
+                if index == len(self.models) - 1:
+                    raise
+                self._record_failure(model, e)
+                continue
+            self._record_usage(model, time.monotonic() - started, getattr(response, "usage", None))
+            return response.choices[0].message # type: ignore
+
+    # ── Async driver ──────────────────────────────────────────────────────────
+    async def run_async(self, state: AgentState, emit_event: Callable,
+                        budget: Optional[TurnBudget] = None) -> AgentState:
+        with tracer.span("agent", agent=self.name):
+            return await self._drive_async(state, emit_event, self._budget(budget))
+
+    async def _drive_async(self, state: AgentState, emit_event: Callable, budget: TurnBudget) -> AgentState:
+        turn = self._turn(state, budget)
+        value, error = None, None
+        while True:
+            try:
+                effect = turn.throw(error) if error else turn.send(value)
+            except StopIteration as done:
+                return done.value
+
+            value, error = None, None
+            if isinstance(effect, _LLMCall):
+                try:
+                    value = await asyncio.wait_for(
+                        self._acomplete(effect, emit_event),
+                        timeout=max(0.0, effect.deadline - time.monotonic())
+                    )
+                except asyncio.TimeoutError as e:
+                    error = e
+            elif isinstance(effect, _RunTools):
+                value = await self._aexecute_tools(effect.tool_calls)
+            elif isinstance(effect, _Emit):
+                with tracer.span("emit", event=effect.event_type):
+                    await emit_event(effect.event_type, effect.payload)
+
+    async def _acomplete(self, call: _LLMCall, emit_event: Callable):
+        """
+        Tries each model of the chain in turn. A model that errors, whose
+        request has not been answered (or its stream opened) within
+        attempt_timeout, or whose stream fails before any text reached the
+        client, hands over to the next one; the last model runs until the turn
+        deadline. Time queued in the rate limiter does not count against a
+        model. A stream that fails after text reached the client is not retried.
+        """
+        for index, model in enumerate(self.models):
+            last = index == len(self.models) - 1
+            started = time.monotonic()
+            with tracer.span("llm", agent=self.name, model=model, stream=self.stream) as span:
+                try:
+                    response = await get_llm_acompletion(
+                        messages=call.messages, model=model, tools=call.tools,
+                        stream=self.stream, parallel_tool_calls=self.parallel_tools,
+                        timeout=None if last else self.attempt_timeout
+                    )
+                    if self.stream:
+                        msg, usage = await self._stream_completion(response, emit_event, span)
                     else:
-                        result = "Error: Tool executor not initialized."
-                    
-                    # Notify tool complete
-                    await emit_event("tool_call", {
-                        "tool": tool_call.function.name,
-                        "status": "success",
-                        "output": result
+                        msg, usage = response.choices[0].message, getattr(response, "usage", None) # type: ignore
+                except StreamInterrupted:
+                    raise
+                except Exception as e:
+                    if last:
+                        raise
+                    span.set(failed=f"{type(e).__name__}: {e}", fell_back=True)
+                    self._record_failure(model, e)
+                    continue
+
+                self._record_usage(model, time.monotonic() - started, usage)
+                return msg, self.stream
+
+    async def _aexecute_tools(self, tool_calls: List[Any]) -> List[str]:
+        """Runs tool calls in worker threads with asyncio.gather, at most max_tool_concurrency at a time."""
+        semaphore = asyncio.Semaphore(max(1, self.max_tool_concurrency))
+
+        async def run_one(tool_call) -> str:
+            async with semaphore:
+                return await asyncio.to_thread(self._execute_tool, tool_call)
+
+        return list(await asyncio.gather(*(run_one(tc) for tc in tool_calls)))
+
+    async def _stream_completion(self, stream: Any, emit_event: Callable, span: Any = None):
+        """
+        Consumes one streamed completion: content deltas are filtered and
+        forwarded to emit_event as they arrive, tool-call deltas are stitched
+        together by index and only returned once the stream is complete.
+        Returns the assembled message and the usage block sent with the last chunk.
+        The span, if given, gets time-to-first-token and the number of chunks forwarded.
+        """
+        text_filter = JsonLineFilter()
+        content_parts: List[str] = []
+        calls: Dict[int, Dict[str, Any]] = {}
+        emitted = False
+        usage = None
+
+        try:
+            async for chunk in stream:
+                if span is not None:
+                    span.mark("ttft_ms")
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content_parts.append(delta.content)
+                    visible = text_filter.feed(delta.content)
+                    if visible:
+                        emitted = True
+                        if span is not None:
+                            span.count("stream_events")
+                        await emit_event("chat_stream", visible)
+                for tc in delta.tool_calls or []:
+                    call = calls.setdefault(tc.index or 0, {
+                        "id": None,
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""}
                     })
+                    if tc.id:
+                        call["id"] = tc.id
+                    if tc.function and tc.function.name:
+                        call["function"]["name"] += tc.function.name
+                    if tc.function and tc.function.arguments:
+                        call["function"]["arguments"] += tc.function.arguments
+        except Exception as e:
+            if emitted:
+                # Text already reached the client: the caller must not retry elsewhere
+                raise StreamInterrupted(f"Stream failed after text was sent: {type(e).__name__}: {e}") from e
+            raise
 
-                    # Add tool response
-                    tool_msg = {
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "name": tool_call.function.name,
-                        "content": result
-                    }
-                    messages.append(tool_msg)
-                    state.messages.append(tool_msg)
-                    
-                    # Special Case Events from Tool Returns
-                    if tool_call.function.name == "handoff_to_inventory" and "agreed_price" in result:
-                        try:
-                            res_val = json.loads(result)
-                            product_id = res_val.get("product_id")
-                            agreed_price = res_val.get("agreed_price")
-
-                            # Enrich with catalog data for the frontend discount display
-                            catalog = _get_catalog_lookup()
-                            product_info = catalog.get(product_id, {})
-                            product_name = product_info.get("name", product_id)
-                            original_price = product_info.get("price", agreed_price)
-                            savings = round(original_price - agreed_price, 2)
-
-                            await emit_event("price_update", {
-                                "product_id": product_id,
-                                "new_price": agreed_price,
-                                "reason": "Negotiated Deal"
-                            })
-                            await emit_event("cart_update", {
-                                "items": [{
-                                    "id": product_id,
-                                    "name": product_name,
-                                    "qty": 1,
-                                    "agreed_price": agreed_price,
-                                    "original_price": original_price,
-                                    "savings": savings
-                                }],
-                                "total": agreed_price,
-                                "status": "reserved"
-                            })
-                        except:
-                            pass
-
-                    # Intercept handoffs
-                    if "handoff_to" in result:
-                        try:
-                            res_val = json.loads(result)
-                            if "handoff_to" in res_val:
-                                next_agent = res_val["handoff_to"]
-                                state.current_agent = next_agent
-                                reason = res_val.get("reason", "")
-                                state.shared_context[f"{self.name}_handoff_reason"] = reason
-                                
-                                await emit_event("agent_transition", {
-                                    "from": self.name,
-                                    "to": next_agent,
-                                    "reason": reason
-                                })
-                                return state
-                        except:
-                            pass
-            else:
-                # Agent replied to user or decided to wait
-                break
-                
-        return state
+        tail = text_filter.flush()
+        if tail:
+            emitted = True
+            await emit_event("chat_stream", tail)
+        if emitted:
+            await emit_event("chat_stream_end", None)
+
+        msg = Message(
+            role="assistant",
+            content="".join(content_parts) or None,
+            tool_calls=[calls[i] for i in sorted(calls)] or None
+        )
+        return msg, usage
@@ -0,0 +1,110 @@
+import os
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# ── Event replay ──────────────────────────────────────────────────────────────
+# Every event broadcast to a session gets the next sequence number of that
+# session and is kept, already serialised, in a bounded replay buffer (by event
+# count and by bytes — token-by-token chat_stream events add up quickly). A
+# client that reconnects sends the epoch and the last seq it saw; if everything
+# after it is still buffered only those events are sent again, otherwise the
+# caller falls back to a full sync_state.
+#
+# The epoch names one buffer's lifetime: it changes whenever a session's log is
+# created (new process, another worker, or the log was swept), so a seq from an
+# older log is never mistaken for one in the current log.
+# Events sent to a single socket (sync_state, overloaded, ...) are not logged.
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+class SessionEventLog:
+    def __init__(self, max_events: int, max_bytes: int):
+        self.epoch = os.urandom(4).hex()
+        self.seq = 0
+        self.max_events = max(1, max_events)
+        self.max_bytes = max_bytes
+        # (seq, serialised event, client that should not get it again)
+        self._events: Deque[Tuple[int, str, Optional[str]]] = deque()
+        self._bytes = 0
+        self.touched = time.time()
+
+    def next_seq(self) -> int:
+        self.seq += 1
+        return self.seq
+
+    def touch(self) -> None:
+        self.touched = time.time()
+
+    def append(self, seq: int, message: str, origin: Optional[str] = None) -> None:
+        self._events.append((seq, message, origin))
+        self._bytes += len(message)
+        self.touch()
+        while len(self._events) > self.max_events or (self._bytes > self.max_bytes and len(self._events) > 1):
+            _seq, dropped, _origin = self._events.popleft()
+            self._bytes -= len(dropped)
+
+    def since(self, last_seq: int, client: Optional[str] = None) -> Optional[List[str]]:
+        """Events after last_seq (minus client's own), or None if some were already dropped."""
+        if last_seq == self.seq:
+            return []
+        if last_seq > self.seq or not self._events or self._events[0][0] > last_seq + 1:
+            return None
+        return [message for seq, message, origin in self._events
+                if seq > last_seq and (client is None or origin != client)]
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+
+class EventLogs:
+    """One SessionEventLog per session, dropped once the session has been gone for ttl seconds."""
+    def __init__(self, max_events: int = 1000, max_bytes: int = 256 * 1024, ttl: float = 300.0):
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._logs: Dict[str, SessionEventLog] = {}
+        self.resumed = 0
+        self.replayed = 0
+        self.full_syncs = 0
+
+    def get(self, session_id: str) -> SessionEventLog:
+        log = self._logs.get(session_id)
+        if log is None:
+            log = SessionEventLog(self.max_events, self.max_bytes)
+            self._logs[session_id] = log
+        return log
+
+    def resume(self, session_id: str, epoch: str, last_seq: int, client: Optional[str] = None) -> Optional[List[str]]:
+        """Missed events for a reconnecting client, or None when it needs a full sync."""
+        log = self._logs.get(session_id)
+        missed = log.since(last_seq, client) if log is not None and epoch == log.epoch else None
+        if missed is None:
+            self.full_syncs += 1
+        else:
+            self.resumed += 1
+            self.replayed += len(missed)
+        return missed
+
+    def sweep(self, connected: Callable[[str], bool], now: Optional[float] = None) -> int:
+        """Drops logs of sessions with no open socket that have been quiet for ttl; returns how many."""
+        now = time.time() if now is None else now
+        stale = [sid for sid, log in self._logs.items() if now - log.touched > self.ttl and not connected(sid)]
+        for session_id in stale:
+            del self._logs[session_id]
+        return len(stale)
+
+    def metrics(self) -> Dict[str, Any]:
+        logs = list(self._logs.values())
+        return {
+            "sessions": len(logs),
+            "events": sum(len(log) for log in logs),
+            "bytes": sum(log.bytes for log in logs),
+            "resumed": self.resumed,
+            "replayed": self.replayed,
+            "full_syncs": self.full_syncs,
+        }
@@ -0,0 +1,291 @@
+import json
+import time
+import random
+import asyncio
+import hashlib
+import importlib
+import importlib.util
+import threading
+from typing import List, Dict, Any, Optional, Callable, Union
+
+import httpx
+import aiohttp
+import litellm
+from litellm import completion, acompletion, ModelResponse, ModelResponseStream
+from litellm.llms.custom_httpx.http_handler import HTTPHandler, AsyncHTTPHandler
+
+# ── Pluggable LLM backends ────────────────────────────────────────────────────
+# config.get_llm_completion / get_llm_acompletion hand their kwargs to one of
+# these. "litellm" is the real network backend; "record" wraps it and writes
+# every request/response pair to a JSONL cassette; "replay" serves a cassette
+# offline; "scripted" is a fake model driven by Python code or a JSON list.
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def parse_latency(spec: str, seed: int = 0) -> Callable[[], float]:
+    """
+    Builds a latency sampler from "fixed:0.3", "uniform:0.1,0.6" or
+    "lognormal:-1.2,0.5" (mu, sigma of the underlying normal). Empty = no delay.
+    """
+    if not spec:
+        return lambda: 0.0
+    rng = random.Random(seed)
+    kind, _, args = spec.partition(":")
+    params = [float(a) for a in args.split(",") if a.strip()]
+    if kind == "fixed":
+        return lambda: params[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(params[0], params[1])
+    if kind == "lognormal":
+        return lambda: rng.lognormvariate(params[0], params[1])
+    raise ValueError(f"Unknown latency distribution '{spec}'")
+
+
+def _fingerprints(kwargs: Dict[str, Any]) -> List[str]:
+    """
+    Exact key over model, messages and tool names, plus a looser "shape" key
+    that ignores tool outputs and assistant wording — tool results such as
+    transaction ids are random, so an exact match alone would stop replay
+    after the first payment.
+    """
+    messages = kwargs.get("messages", [])
+    tools = [t["function"]["name"] for t in kwargs.get("tools") or []]
+    exact = {"model": kwargs.get("model"), "tools": tools, "messages": messages}
+    shape = {
+        "model": kwargs.get("model"),
+        "tools": tools,
+        "messages": [
+            [m.get("role"), m.get("name") or "", m.get("content") if m.get("role") == "user" else ""]
+            for m in messages
+        ]
+    }
+    return [
+        hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+        for key in (exact, shape)
+    ]
+
+
+def _to_response(message: Dict[str, Any], model: str, usage: Optional[Dict] = None) -> ModelResponse:
+    return ModelResponse(
+        model=model,
+        choices=[{"index": 0, "message": message, "finish_reason": "tool_calls" if message.get("tool_calls") else "stop"}],
+        usage=usage or {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    )
+
+
+async def _to_stream(response: ModelResponse):
+    """Replays a complete response as delta chunks: content word by word, then each tool call."""
+    msg = response.choices[0].message # type: ignore
+    if msg.content:
+        words = msg.content.split(" ")
+        for i, word in enumerate(words):
+            yield ModelResponseStream(choices=[{"index": 0, "delta": {"content": word if i == 0 else " " + word}}])
+            await asyncio.sleep(0)
+    for i, tc in enumerate(msg.tool_calls or []):
+        yield ModelResponseStream(choices=[{"index": 0, "delta": {"tool_calls": [{
+            "index": i,
+            "id": tc.id,
+            "type": "function",
+            "function": {"name": tc.function.name, "arguments": tc.function.arguments}
+        }]}}])
+    yield ModelResponseStream(choices=[], usage=getattr(response, "usage", None))
+
+
+class LiteLLMBackend:
+    """
+    Network backend. Owns one keep-alive connection pool per process (sync and
+    async), shared by every agent, instead of letting each call set up its own
+    connection. app.py opens it at startup and closes it on shutdown; scripts
+    get it lazily on first use.
+
+    litellm's handlers build their own clients, so its SSL settings, default
+    headers and proxy mounts still apply. The async pool is litellm's default
+    aiohttp transport running on a session we own, which is where the
+    connection limit goes. With http2 litellm uses an httpx HTTP/2 client
+    instead, multiplexing requests over one connection per host.
+    """
+    def __init__(self, max_connections: int = 20, timeout: float = 60.0, connect_timeout: float = 5.0,
+                 http2: bool = False):
+        self.max_connections = max_connections
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        # HTTP/2 needs h2; litellm reads its own flag when it builds a client
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        if self.http2:
+            litellm.http2 = True
+        self._client: Optional[HTTPHandler] = None
+        self._aclient: Optional[AsyncHTTPHandler] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = threading.Lock()
+
+    def _sync_client(self) -> HTTPHandler:
+        with self._lock:
+            if self._client is None:
+                self._client = HTTPHandler(timeout=self.timeout)
+            return self._client
+
+    def _async_client(self) -> AsyncHTTPHandler:
+        if self._aclient is None:
+            if not self.http2:
+                self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+                    limit=self.max_connections, limit_per_host=self.max_connections
+                ))
+            self._aclient = AsyncHTTPHandler(timeout=self.timeout, shared_session=self._session)
+        return self._aclient
+
+    async def start(self) -> None:
+        self._async_client()
+
+    async def aclose(self) -> None:
+        if self._aclient is not None:
+            await self._aclient.close()
+            self._aclient = None
+        if self._session is not None:
+            # Shared with litellm's transport, which leaves closing it to the owner
+            await self._session.close()
+            self._session = None
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    def complete(self, **kwargs):
+        return completion(client=self._sync_client(), timeout=self.timeout.read, **kwargs)
+
+    async def acomplete(self, **kwargs):
+        return await acompletion(client=self._async_client(), timeout=self.timeout.read, **kwargs)
+
+
+class RecordingBackend:
+    """Calls the wrapped backend and appends each exchange to a JSONL cassette."""
+    def __init__(self, path: str, inner=None):
+        self.path = path
+        self.inner = inner or LiteLLMBackend()
+        self._lock = threading.Lock()
+
+    async def start(self) -> None:
+        if hasattr(self.inner, "start"):
+            await self.inner.start()
+
+    async def aclose(self) -> None:
+        if hasattr(self.inner, "aclose"):
+            await self.inner.aclose()
+
+    def _write(self, kwargs: Dict[str, Any], response: ModelResponse) -> None:
+        exact, shape = _fingerprints(kwargs)
+        record = {"key": exact, "shape": shape, "response": response.model_dump()}
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+    def complete(self, **kwargs):
+        response = self.inner.complete(**kwargs)
+        self._write(kwargs, response)
+        return response
+
+    async def acomplete(self, **kwargs):
+        response = await self.inner.acomplete(**kwargs)
+        if not kwargs.get("stream"):
+            self._write(kwargs, response)
+            return response
+
+        async def tee():
+            chunks = []
+            async for chunk in response:
+                chunks.append(chunk)
+                yield chunk
+            self._write(kwargs, litellm.stream_chunk_builder(chunks, messages=kwargs.get("messages")))
+        return tee()
+
+
+class ReplayBackend:
+    """Serves responses from a cassette written by RecordingBackend, with optional injected latency."""
+    def __init__(self, path: str, latency: str = ""):
+        self.sample_latency = parse_latency(latency)
+        self._by_key: Dict[str, List[Dict]] = {}
+        self._served: Dict[str, int] = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                self._by_key.setdefault(record["key"], []).append(record["response"])
+                self._by_key.setdefault(record["shape"], []).append(record["response"])
+
+    def _lookup(self, kwargs: Dict[str, Any]) -> ModelResponse:
+        for key in _fingerprints(kwargs):
+            responses = self._by_key.get(key)
+            if responses:
+                # Identical requests recorded several times are served in turn
+                n = self._served.get(key, 0)
+                self._served[key] = n + 1
+                return ModelResponse(**responses[n % len(responses)])
+        raise LookupError("No recorded LLM response matches this request")
+
+    def complete(self, **kwargs):
+        time.sleep(self.sample_latency())
+        return self._lookup(kwargs)
+
+    async def acomplete(self, **kwargs):
+        await asyncio.sleep(self.sample_latency())
+        response = self._lookup(kwargs)
+        return _to_stream(response) if kwargs.get("stream") else response
+
+
+class ScriptedBackend:
+    """
+    Fake model for offline runs. script is either a callable
+    (messages, tools) -> assistant message dict, or a list of message dicts
+    served in order (the last one repeats once the list is exhausted).
+    """
+    def __init__(self, script: Union[Callable, List[Dict[str, Any]]], latency: str = ""):
+        self.script = script
+        self.sample_latency = parse_latency(latency)
+        self._calls = 0
+        self._lock = threading.Lock()
+
+    def _next(self, kwargs: Dict[str, Any]) -> ModelResponse:
+        with self._lock:
+            n = self._calls
+            self._calls += 1
+        if callable(self.script):
+            message = self.script(kwargs.get("messages", []), kwargs.get("tools") or [])
+        else:
+            message = self.script[min(n, len(self.script) - 1)]
+        # Copy so ids and serialised arguments are never written back into the script
+        message = {"role": "assistant", **json.loads(json.dumps(message))}
+        for i, tc in enumerate(message.get("tool_calls") or []):
+            tc.setdefault("id", f"call_{n}_{i}")
+            tc.setdefault("type", "function")
+            if not isinstance(tc["function"].get("arguments"), str):
+                tc["function"]["arguments"] = json.dumps(tc["function"]["arguments"])
+        return _to_response(message, kwargs.get("model", "scripted"))
+
+    def complete(self, **kwargs):
+        time.sleep(self.sample_latency())
+        return self._next(kwargs)
+
+    async def acomplete(self, **kwargs):
+        await asyncio.sleep(self.sample_latency())
+        response = self._next(kwargs)
+        return _to_stream(response) if kwargs.get("stream") else response
+
+
+def load_script(spec: str) -> Union[Callable, List[Dict[str, Any]]]:
+    """A script is a JSON file of assistant messages or a "module:function" policy."""
+    if spec.endswith(".json"):
+        with open(spec, "r", encoding="utf-8") as f:
+            return json.load(f)
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def create_backend(name: str, cassette: str = "", latency: str = "", script: str = "", **pool):
+    """pool: max_connections / timeout / connect_timeout / http2 for the network backend."""
+    if name == "litellm":
+        return LiteLLMBackend(**pool)
+    if name == "record":
+        return RecordingBackend(cassette, inner=LiteLLMBackend(**pool))
+    if name == "replay":
+        return ReplayBackend(cassette, latency)
+    if name == "scripted":
+        return ScriptedBackend(load_script(script), latency)
+    raise ValueError(f"Unknown LLM backend '{name}'")
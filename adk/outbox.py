@@ -0,0 +1,129 @@
+import json
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional
+
+try:
+    import orjson  # optional: several times faster than json.dumps for event payloads
+except ImportError:
+    orjson = None
+
+# ── Outbound events ───────────────────────────────────────────────────────────
+# Each socket gets an Outbox: send_event() only enqueues already-encoded events
+# and one writer task per socket drains them. Clients that connect with
+# `batch=1` receive everything queued within `window` seconds as one text frame
+# holding a JSON array of events (at most max_batch per frame) — a streamed
+# reply becomes a handful of frames instead of one frame, syscall and deflate
+# block per token. Clients without it get one event per frame, as before.
+#
+# A socket that falls max_pending events behind is closed (1013, try again):
+# the client reconnects and catches up from the replay buffer instead of the
+# server holding an unbounded backlog for it.
+#
+# Tool outputs (the full tool result, e.g. a page of search JSON) are shaped per
+# client with `tool_output=`: "full" (default), "truncated" to preview_chars,
+# or "none"; events are encoded once per shape actually needed.
+# ──────────────────────────────────────────────────────────────────────────────
+
+TOOL_OUTPUT_MODES = ("full", "truncated", "none")
+
+
+def encode_event(event: Dict[str, Any]) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(event).decode()
+        except TypeError:
+            pass  # e.g. non-string dict keys, which json.dumps coerces
+    return json.dumps(event, separators=(",", ":"))
+
+
+def shape_event(event: Dict[str, Any], mode: str, preview_chars: int) -> Dict[str, Any]:
+    """The event as a client with tool_output=mode should see it."""
+    payload = event.get("payload")
+    if mode == "full" or event.get("type") != "tool_call" or not isinstance(payload, dict) or "output" not in payload:
+        return event
+    output = payload["output"]
+    text = output if isinstance(output, str) else json.dumps(output)
+    shaped = {k: v for k, v in payload.items() if k != "output"}
+    shaped["output_chars"] = len(text)
+    if mode == "truncated":
+        shaped["output"] = text[:preview_chars]
+        shaped["output_truncated"] = len(text) > preview_chars
+    return {**event, "payload": shaped}
+
+
+def frames(messages: Iterable[str], batch: bool, max_batch: int) -> Iterator[str]:
+    """Groups encoded events into text frames: JSON arrays when batching, else one per frame."""
+    if not batch:
+        yield from messages
+        return
+    group: List[str] = []
+    for message in messages:
+        group.append(message)
+        if len(group) >= max_batch:
+            yield "[" + ",".join(group) + "]"
+            group = []
+    if group:
+        yield "[" + ",".join(group) + "]"
+
+
+class Outbox:
+    def __init__(self, websocket: Any, batch: bool = False, window: float = 0.01, max_batch: int = 64,
+                 max_pending: int = 2000, stats: Optional[Dict[str, int]] = None):
+        self.websocket = websocket
+        self.batch = batch
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.max_pending = max_pending
+        self._pending: Deque[str] = deque()
+        self._ready = asyncio.Event()
+        self._closed = False
+        self.stats = stats if stats is not None else {"events": 0, "frames": 0, "bytes": 0, "overflows": 0}
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def put(self, message: str) -> None:
+        if self._closed:
+            return
+        if len(self._pending) >= self.max_pending:
+            self.stats["overflows"] += 1
+            self._closed = True
+            self._pending.clear()
+            asyncio.create_task(self._abort())
+            return
+        self._pending.append(message)
+        self._ready.set()
+
+    async def _abort(self) -> None:
+        try:
+            await self.websocket.close(code=1013)
+        except Exception:
+            pass
+
+    async def _run(self) -> None:
+        try:
+            while not self._closed:
+                await self._ready.wait()
+                if self.batch and self.window > 0:
+                    # Let the rest of this burst (stream chunks, follow-up events) arrive
+                    await asyncio.sleep(self.window)
+                self._ready.clear()
+                while self._pending:
+                    count = min(len(self._pending), self.max_batch if self.batch else 1)
+                    messages = [self._pending.popleft() for _ in range(count)]
+                    for frame in frames(messages, self.batch, self.max_batch):
+                        await self.websocket.send_text(frame)
+                        self.stats["frames"] += 1
+                        self.stats["bytes"] += len(frame)
+                    self.stats["events"] += count
+        except Exception as e:
+            # Socket went away mid-send; its receive loop cleans up
+            print(f"[Outbox] Send failed: {e}")
+            self._closed = True
+
+    def close(self) -> None:
+        self._closed = True
+        self._task.cancel()
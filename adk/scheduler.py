@@ -0,0 +1,225 @@
+import re
+import time
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+# ── Request context ───────────────────────────────────────────────────────────
+# Set once per WebSocket session / script; asyncio tasks and to_thread copies
+# inherit them, so LLM calls deep inside the engine know who they serve.
+INTERACTIVE = 0
+BACKGROUND = 1
+
+current_session: ContextVar[str] = ContextVar("adk_session", default="default")
+current_priority: ContextVar[int] = ContextVar("adk_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def background(session: Optional[str] = None) -> Iterator[None]:
+    """LLM calls made inside the block queue behind interactive ones (and under session, if given)."""
+    priority_token = current_priority.set(BACKGROUND)
+    session_token = current_session.set(session) if session is not None else None
+    try:
+        yield
+    finally:
+        if session_token is not None:
+            current_session.reset(session_token)
+        current_priority.reset(priority_token)
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Parses provider reset durations such as "7.66s", "2m59.56s" or "120ms" into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at capacity per minute. capacity <= 0 disables it."""
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        # May go negative: the debt is repaid by refill before anyone else is admitted
+        if self.capacity > 0:
+            self.tokens -= amount
+
+    def observe(self, remaining: Optional[float], reset_seconds: Optional[float], now: float) -> None:
+        """Aligns the local view with the provider's rate-limit headers."""
+        if self.capacity <= 0 or remaining is None:
+            return
+        self._refill(now)
+        if remaining <= 0 and reset_seconds:
+            # Empty until the provider's window resets
+            self.tokens = min(self.tokens, -reset_seconds * self.rate)
+        else:
+            self.tokens = min(self.tokens, remaining)
+
+
+class LLMScheduler:
+    """
+    Client-side admission for LLM calls: a requests/min and a tokens/min
+    bucket, fed by response headers. Waiters are served by priority
+    (interactive before background) and round-robin across sessions within a
+    priority, so one chatty session cannot starve the others.
+    """
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._queues: Dict[int, "OrderedDict[str, Deque[Any]]"] = {}
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._waits: Deque[float] = deque(maxlen=1000)
+        self.admitted = 0
+        self.rate_limited = 0
+        # Smoothed provider latency (seconds to a response or an open stream)
+        self.latency_ewma: Optional[float] = None
+
+    # ── Admission ─────────────────────────────────────────────────────────────
+    def _try_admit(self, estimated_tokens: int) -> float:
+        now = time.monotonic()
+        wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(estimated_tokens, now))
+        if wait <= 0:
+            self.requests.take(1)
+            self.tokens.take(estimated_tokens)
+            self.admitted += 1
+        return wait
+
+    def queue_depth(self) -> int:
+        return sum(len(q) for queues in self._queues.values() for q in queues.values())
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        enqueued = time.monotonic()
+        if self.queue_depth() == 0 and self._try_admit(estimated_tokens) <= 0:
+            self._waits.append(0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        queues = self._queues.setdefault(current_priority.get(), OrderedDict())
+        queues.setdefault(current_session.get(), deque()).append((future, estimated_tokens))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wake = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        else:
+            self._wake.set()
+        await future
+        self._waits.append(time.monotonic() - enqueued)
+
+    def _next_waiter(self):
+        """Head of the fairest queue: lowest priority value, then least recently served session."""
+        for priority in sorted(self._queues):
+            queues = self._queues[priority]
+            while queues:
+                session, waiters = next(iter(queues.items()))
+                while waiters and waiters[0][0].done():   # cancelled callers
+                    waiters.popleft()
+                if waiters:
+                    return priority, session
+                del queues[session]
+        return None
+
+    async def _dispatch(self) -> None:
+        while True:
+            head = self._next_waiter()
+            if head is None:
+                return
+            priority, session = head
+            queues = self._queues[priority]
+            future, estimated_tokens = queues[session][0]
+            wait = self._try_admit(estimated_tokens)
+            if wait > 0:
+                # Sleep until capacity returns, or until a more urgent waiter arrives
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            queues[session].popleft()
+            # Rotate the session to the back so others in this priority go next
+            queues.move_to_end(session)
+            if not queues[session]:
+                del queues[session]
+            future.set_result(None)
+
+    # ── Feedback ──────────────────────────────────────────────────────────────
+    def record(self, estimated_tokens: int, response: Any, hidden_params: Optional[Dict] = None) -> None:
+        """
+        Charges actual token usage and syncs both buckets with rate-limit headers.
+        Streams carry headers on the stream wrapper, passed as hidden_params.
+        """
+        usage = getattr(response, "usage", None)
+        total = getattr(usage, "total_tokens", None) if usage else None
+        if total:
+            self.tokens.take(total - estimated_tokens)
+
+        hidden = hidden_params or getattr(response, "_hidden_params", None) or {}
+        headers = {k.lower(): v for k, v in (hidden.get("additional_headers") or {}).items()}
+
+        def header(name: str) -> Optional[str]:
+            return headers.get(name) or headers.get(f"llm_provider-{name}")
+
+        now = time.monotonic()
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            remaining = header(f"x-ratelimit-remaining-{kind}")
+            try:
+                remaining_value = float(remaining) if remaining is not None else None
+            except ValueError:
+                remaining_value = None
+            bucket.observe(remaining_value, parse_reset(header(f"x-ratelimit-reset-{kind}")), now)
+
+    def observe_latency(self, seconds: float, alpha: float = 0.2) -> None:
+        if self.latency_ewma is None:
+            self.latency_ewma = seconds
+        else:
+            self.latency_ewma += alpha * (seconds - self.latency_ewma)
+
+    def throttle(self, retry_after: float) -> None:
+        """Called on a 429: nobody is admitted until retry_after has passed."""
+        self.rate_limited += 1
+        now = time.monotonic()
+        self.requests.observe(0, retry_after, now)
+
+    # ── Metrics ───────────────────────────────────────────────────────────────
+    def metrics(self) -> Dict[str, Any]:
+        waits: List[float] = sorted(self._waits)
+
+        def pct(p: float) -> Optional[float]:
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 1) if waits else None
+
+        return {
+            "queue_depth": self.queue_depth(),
+            "queue_depth_by_priority": {
+                "interactive" if p == INTERACTIVE else "background": sum(len(q) for q in queues.values())
+                for p, queues in self._queues.items()
+            },
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "latency_ewma_ms": round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+            "wait_ms": {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99)},
+            "requests_available": round(self.requests.tokens, 1) if self.requests.capacity > 0 else None,
+            "tokens_available": round(self.tokens.tokens) if self.tokens.capacity > 0 else None,
+        }
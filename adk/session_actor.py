@@ -0,0 +1,110 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+# ── Session actors ────────────────────────────────────────────────────────────
+# Exactly one asyncio task at a time runs turns for a session, however many
+# sockets (tabs, reconnects) feed it, so AgentState is never written by two
+# turns at once. Sockets only submit() into the session's inbox and go straight
+# back to reading; a burst of messages is handled like this:
+#   • a plain message arriving while another one is still waiting is merged
+#     into it (coalesced), up to max_coalesce messages — the next turn answers
+#     them together instead of running one multi-agent chain per line;
+#   • commands ("/reset_session") and messages that find the last entry full
+#     take a new slot;
+#   • with max_depth entries already waiting the message is rejected, and the
+#     caller tells the client it is overloaded.
+# The actor's task exits when the inbox drains and is started again on demand.
+# ──────────────────────────────────────────────────────────────────────────────
+
+QUEUED = "queued"
+COALESCED = "coalesced"
+REJECTED = "rejected"
+
+
+class SessionActor:
+    def __init__(self, session_id: str, handle: Callable[[str, str], Awaitable[None]],
+                 max_depth: int = 2, max_coalesce: int = 4, stats: Optional[Dict[str, int]] = None):
+        self.session_id = session_id
+        self.handle = handle
+        self.max_depth = max(1, max_depth)
+        self.max_coalesce = max(1, max_coalesce)
+        # Waiting entries: [text, messages merged into it]
+        self._inbox: Deque[List[Any]] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # Counters, shared across a registry's actors so they outlive each actor
+        self.stats = stats if stats is not None else {"turns": 0, "coalesced": 0, "rejected": 0}
+
+    @property
+    def busy(self) -> bool:
+        return not self._idle.is_set()
+
+    @property
+    def depth(self) -> int:
+        return len(self._inbox)
+
+    def submit(self, text: str) -> str:
+        """Queues text for the session; returns QUEUED, COALESCED or REJECTED."""
+        last = self._inbox[-1] if self._inbox else None
+        if (last is not None and last[1] < self.max_coalesce
+                and not text.startswith("/") and not last[0].startswith("/")):
+            last[0] = f"{last[0]}\n{text}"
+            last[1] += 1
+            self.stats["coalesced"] += 1
+            return COALESCED
+        if len(self._inbox) >= self.max_depth:
+            self.stats["rejected"] += 1
+            return REJECTED
+        self._inbox.append([text, 1])
+        if self._task is None or self._task.done():
+            self._idle.clear()
+            self._task = asyncio.create_task(self._run())
+        return QUEUED
+
+    async def _run(self) -> None:
+        try:
+            while self._inbox:
+                text, _count = self._inbox.popleft()
+                try:
+                    await self.handle(self.session_id, text)
+                except Exception as e:
+                    print(f"[Session {self.session_id}] Turn failed: {e}")
+                self.stats["turns"] += 1
+        finally:
+            self._idle.set()
+
+    async def wait_idle(self) -> None:
+        await self._idle.wait()
+
+
+class SessionActors:
+    """Registry of live actors; an idle actor with no sockets is dropped by discard()."""
+    def __init__(self, handle: Callable[[str, str], Awaitable[None]], max_depth: int = 2, max_coalesce: int = 4):
+        self.handle = handle
+        self.max_depth = max_depth
+        self.max_coalesce = max_coalesce
+        self._actors: Dict[str, SessionActor] = {}
+        self.stats = {"turns": 0, "coalesced": 0, "rejected": 0}
+
+    def get(self, session_id: str) -> SessionActor:
+        actor = self._actors.get(session_id)
+        if actor is None:
+            actor = SessionActor(session_id, self.handle, self.max_depth, self.max_coalesce, self.stats)
+            self._actors[session_id] = actor
+        return actor
+
+    def discard(self, session_id: str) -> None:
+        actor = self._actors.get(session_id)
+        if actor is not None and not actor.busy:
+            del self._actors[session_id]
+
+    def metrics(self) -> Dict[str, Any]:
+        actors = list(self._actors.values())
+        return {
+            "actors": len(actors),
+            "busy": sum(a.busy for a in actors),
+            "queued": sum(a.depth for a in actors),
+            **self.stats,
+        }
@@ -0,0 +1,307 @@
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Protocol, Tuple
+
+from adk.engine import AgentState
+
+# ── Session stores ────────────────────────────────────────────────────────────
+# Where the WebSocket handler keeps each shopper's AgentState:
+#   MemorySessionStore – process-local, bounded, spills to disk (default)
+#   SQLiteSessionStore – one SQLite file (WAL) shared by every worker process,
+#                        so any worker can serve any reconnect — no sticky sessions
+# Both version sessions optimistically: put() saves only if the state's version
+# is still the stored one, then bumps it; a stale write raises SessionConflict.
+# States are stored as zlib-compressed compact JSON (see encode_state).
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+class SessionConflict(Exception):
+    """The session was saved by someone else (another worker or tab) since it was loaded."""
+
+
+class SessionStore(Protocol):
+    def get(self, session_id: str) -> Optional[AgentState]: ...
+    def put(self, session_id: str, state: AgentState, force: bool = False) -> None: ...
+    def delete(self, session_id: str) -> None: ...
+    def sweep(self, now: Optional[float] = None) -> int: ...
+    def metrics(self) -> Dict[str, Any]: ...
+
+
+def encode_state(state: AgentState) -> bytes:
+    # Message histories are repetitive text: compact JSON compresses 3-5x even at level 1
+    return zlib.compress(state.model_dump_json().encode(), 1)
+
+
+def decode_state(blob: bytes) -> AgentState:
+    return AgentState.model_validate_json(zlib.decompress(blob))
+
+
+# ── In memory ─────────────────────────────────────────────────────────────────
+# Bounded home for every shopper's AgentState. Sessions are kept in LRU order
+# and sized by their serialised JSON (a close proxy for what their message
+# history costs in RAM). A session is evicted when
+#   • the store holds more than max_entries sessions,
+#   • the total of all session sizes exceeds max_bytes, or
+#   • it has not been touched for idle_ttl seconds (see sweep()).
+# Evicted sessions are written to spill_dir and restored transparently on the
+# next get(), so a shopper who comes back later resumes where they left off.
+# Spill files older than spill_ttl are deleted by sweep().
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+class MemorySessionStore:
+    def __init__(self, max_entries: int = 5000, max_bytes: int = 256 * 1024 * 1024,
+                 idle_ttl: float = 1800.0, spill_dir: str = "", spill_ttl: float = 7 * 86400.0):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.spill_dir = spill_dir
+        self.spill_ttl = spill_ttl
+        # session_id -> (state, size in bytes, last touched); least recently used first
+        self._sessions: "OrderedDict[str, Tuple[AgentState, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = {"entries": 0, "bytes": 0, "idle": 0}
+        self.spilled = 0
+        self.restored = 0
+        self.conflicts = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    @staticmethod
+    def _size(state: AgentState) -> int:
+        return len(state.model_dump_json())
+
+    def _spill_path(self, session_id: str) -> str:
+        # Session ids come from the URL; hash them into safe file names
+        return os.path.join(self.spill_dir, hashlib.sha1(session_id.encode()).hexdigest() + ".session")
+
+    # ── Access ────────────────────────────────────────────────────────────────
+    def get(self, session_id: str) -> Optional[AgentState]:
+        """The session's state (restored from disk if it was evicted), or None."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._sessions[session_id] = (entry[0], entry[1], time.time())
+                self._sessions.move_to_end(session_id)
+                return entry[0]
+        state = self._restore(session_id)
+        if state is not None:
+            self.put(session_id, state)
+        return state
+
+    def put(self, session_id: str, state: AgentState, force: bool = False) -> None:
+        """
+        Stores (or replaces) a session and evicts least recently used ones past
+        the limits. Raises SessionConflict if a newer version was stored meanwhile,
+        unless force (resets).
+        """
+        size = self._size(state)
+        with self._lock:
+            old = self._sessions.pop(session_id, None)
+            if old is not None:
+                if not force and old[0].version != state.version:
+                    self._sessions[session_id] = old
+                    self.conflicts += 1
+                    raise SessionConflict(session_id)
+                self._bytes -= old[1]
+            state.version = (old[0].version if old is not None else state.version) + 1
+            self._sessions[session_id] = (state, size, time.time())
+            self._bytes += size
+            evicted = self._evict_over_limits()
+        self._spill(evicted)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            old = self._sessions.pop(session_id, None)
+            if old is not None:
+                self._bytes -= old[1]
+        if self.spill_dir:
+            try:
+                os.remove(self._spill_path(session_id))
+            except FileNotFoundError:
+                pass
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    # ── Eviction ──────────────────────────────────────────────────────────────
+    def _pop_oldest(self, reason: str) -> Tuple[str, AgentState]:
+        session_id, (state, size, _) = self._sessions.popitem(last=False)
+        self._bytes -= size
+        self.evictions[reason] += 1
+        return session_id, state
+
+    def _evict_over_limits(self) -> List[Tuple[str, AgentState]]:
+        """Pops LRU sessions until within max_entries and max_bytes. Caller holds the lock."""
+        evicted = []
+        while len(self._sessions) > self.max_entries:
+            evicted.append(self._pop_oldest("entries"))
+        # The session just written is last in LRU order, so it stays even if it alone is over budget
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            evicted.append(self._pop_oldest("bytes"))
+        return evicted
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Evicts sessions idle longer than idle_ttl and deletes expired spill files; returns sessions evicted."""
+        now = time.time() if now is None else now
+        evicted = []
+        with self._lock:
+            # LRU order: stop at the first session touched recently enough
+            while self._sessions and now - next(iter(self._sessions.values()))[2] > self.idle_ttl:
+                evicted.append(self._pop_oldest("idle"))
+        self._spill(evicted)
+        if self.spill_dir:
+            for name in os.listdir(self.spill_dir):
+                path = os.path.join(self.spill_dir, name)
+                try:
+                    if now - os.path.getmtime(path) > self.spill_ttl:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return len(evicted)
+
+    # ── Spill ─────────────────────────────────────────────────────────────────
+    def _spill(self, evicted: List[Tuple[str, AgentState]]) -> None:
+        if not self.spill_dir:
+            return
+        for session_id, state in evicted:
+            path = self._spill_path(session_id)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(encode_state(state))
+            os.replace(tmp, path)
+            self.spilled += 1
+
+    def _restore(self, session_id: str) -> Optional[AgentState]:
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(session_id)
+        try:
+            with open(path, "rb") as f:
+                state = decode_state(f.read())
+        except FileNotFoundError:
+            return None
+        except (ValueError, zlib.error) as e:
+            print(f"[Sessions] Discarding unreadable spill file for {session_id}: {e}")
+            state = None
+        os.remove(path)
+        if state is None:
+            return None
+        self.restored += 1
+        return state
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "evictions": dict(self.evictions),
+                "spilled": self.spilled,
+                "restored": self.restored,
+                "conflicts": self.conflicts,
+            }
+
+
+# ── SQLite ────────────────────────────────────────────────────────────────────
+_SESSION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id       TEXT PRIMARY KEY,
+    version  INTEGER NOT NULL,
+    updated  REAL NOT NULL,
+    state    BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated);
+"""
+_SESSION_GET = "SELECT version, state FROM sessions WHERE id = ?"
+_SESSION_INSERT = "INSERT INTO sessions (id, version, updated, state) VALUES (?, ?, ?, ?) ON CONFLICT(id) DO NOTHING"
+_SESSION_UPDATE = "UPDATE sessions SET version = ?, updated = ?, state = ? WHERE id = ? AND version = ?"
+_SESSION_FORCE = """
+INSERT INTO sessions (id, version, updated, state) VALUES (?, 1, ?, ?)
+ON CONFLICT(id) DO UPDATE SET version = version + 1, updated = excluded.updated, state = excluded.state
+RETURNING version
+"""
+
+
+class SQLiteSessionStore:
+    """
+    Sessions in one SQLite file that every uvicorn worker opens. WAL mode lets
+    readers run alongside the single writer; busy_timeout queues writers from
+    other processes instead of failing. Each put is one conditional statement.
+    """
+    def __init__(self, path: str, ttl: float = 7 * 86400.0):
+        self.path = path
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, cached_statements=16)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute("PRAGMA busy_timeout = 5000")
+        self._conn.executescript(_SESSION_SCHEMA)
+        self._lock = threading.Lock()
+        self.conflicts = 0
+        self.bytes_written = 0
+
+    def get(self, session_id: str) -> Optional[AgentState]:
+        with self._lock:
+            row = self._conn.execute(_SESSION_GET, (session_id,)).fetchone()
+        if row is None:
+            return None
+        state = decode_state(row[1])
+        state.version = row[0]
+        return state
+
+    def put(self, session_id: str, state: AgentState, force: bool = False) -> None:
+        """Saves if the stored version is still state.version (or nothing is stored yet); force overwrites."""
+        blob = encode_state(state)
+        now = time.time()
+        with self._lock:
+            if force:
+                state.version = self._conn.execute(_SESSION_FORCE, (session_id, now, blob)).fetchone()[0]
+            else:
+                if state.version == 0:
+                    cursor = self._conn.execute(_SESSION_INSERT, (session_id, 1, now, blob))
+                else:
+                    cursor = self._conn.execute(_SESSION_UPDATE, (state.version + 1, now, blob, session_id, state.version))
+                if cursor.rowcount == 0:
+                    self.conflicts += 1
+                    raise SessionConflict(session_id)
+                state.version += 1
+            self.bytes_written += len(blob)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Deletes sessions untouched for ttl seconds; returns how many."""
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._conn.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,)).rowcount
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(state)), 0) FROM sessions").fetchone()
+        return {
+            "backend": "sqlite",
+            "sessions": count,
+            "bytes": size,
+            "conflicts": self.conflicts,
+            "bytes_written": self.bytes_written,
+        }
+
+
+def open_session_store(backend: str, path: str = "", **memory_options) -> SessionStore:
+    """"memory" (bounded, process-local) or "sqlite" (shared file at path, for several workers)."""
+    if backend == "sqlite":
+        return SQLiteSessionStore(path, ttl=memory_options.get("spill_ttl", 7 * 86400.0))
+    if backend != "memory":
+        raise ValueError(f"Unknown session backend {backend!r} (expected memory or sqlite)")
+    return MemorySessionStore(**memory_options)
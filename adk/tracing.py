@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional
+
+# ── Tracing ───────────────────────────────────────────────────────────────────
+# In-process spans, no collector needed. A span opened with no span around it
+# starts a trace (normally one user turn); spans opened inside it — agent runs,
+# LLM calls, tool executions, emits — become its children through a context
+# variable, which asyncio tasks and asyncio.to_thread inherit, so tools running
+# in worker threads still land in the right trace.
+#
+# When a trace's root span ends the whole trace is kept in a ring buffer (for
+# /debug/traces) and, if a path is set, appended to a JSONL file, one trace per
+# line. Chatty events (stream chunks) are counted on their span, not traced.
+# Session ids are bearer credentials (they open /ws/chat/{id}), so spans carry
+# session_tag(id) instead: enough to group one session's turns, not to join it.
+# ──────────────────────────────────────────────────────────────────────────────
+
+current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("tracer", "name", "trace", "span_id", "parent_id", "start", "started", "duration_ms",
+                 "attrs", "error", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.error: Optional[str] = None
+        self.duration_ms: Optional[float] = None
+        self.span_id = os.urandom(4).hex()
+        parent = current_span.get()
+        self.parent_id = parent.span_id if parent is not None else None
+        # Spans of one trace share this list; the root's end exports it
+        self.trace: List["Span"] = parent.trace if parent is not None else []
+        self.trace.append(self)
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def mark(self, key: str) -> None:
+        """Records milliseconds since the span started under key (first call wins)."""
+        self.attrs.setdefault(key, round((time.perf_counter() - self.started) * 1000, 1))
+
+    def count(self, key: str, n: int = 1) -> None:
+        self.attrs[key] = self.attrs.get(key, 0) + n
+
+    def __enter__(self) -> "Span":
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self._token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.duration_ms = round((time.perf_counter() - self.started) * 1000, 2)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        current_span.reset(self._token)
+        if self.parent_id is None:
+            self.tracer._finish(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": round(self.start, 6),
+            "duration_ms": self.duration_ms,
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+def session_tag(session_id: str) -> str:
+    """A short one-way tag for a session id, safe to put in traces."""
+    return hashlib.sha256(session_id.encode()).hexdigest()[:12]
+
+
+def annotate(**attrs: Any) -> None:
+    """Adds attributes to the innermost open span, if any."""
+    span = current_span.get()
+    if span is not None:
+        span.attrs.update(attrs)
+
+
+class Tracer:
+    def __init__(self, ring_size: int = 500, path: str = ""):
+        self.path = path
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=max(1, ring_size))
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8") if path else None
+        self.traces = 0
+
+    def span(self, name: str, **attrs: Any) -> Span:
+        return Span(self, name, attrs)
+
+    def _finish(self, root: Span) -> None:
+        spans = [span.to_dict() for span in root.trace]
+        # Time per span kind, so a slow turn shows where it went at a glance
+        by_kind: Dict[str, float] = {}
+        for span in root.trace[1:]:
+            if span.duration_ms is not None:
+                by_kind[span.name] = round(by_kind.get(span.name, 0.0) + span.duration_ms, 2)
+        trace = {
+            "trace_id": root.span_id,
+            "name": root.name,
+            "start": round(root.start, 6),
+            "duration_ms": root.duration_ms,
+            "attrs": root.attrs,
+            "error": root.error,
+            "ms_by_kind": by_kind,
+            "spans": spans,
+        }
+        with self._lock:
+            self._recent.append(trace)
+            self.traces += 1
+            if self._file is not None:
+                self._file.write(json.dumps(trace, default=str, separators=(",", ":")) + "\n")
+                self._file.flush()
+
+    # ── Queries ───────────────────────────────────────────────────────────────
+    def recent(self, limit: int = 20, name: str = "", slowest: bool = False,
+               min_ms: float = 0.0) -> List[Dict[str, Any]]:
+        """Recent traces (newest first), or the slowest of them; optionally by root name."""
+        with self._lock:
+            traces = [t for t in self._recent
+                      if (not name or t["name"] == name) and (t["duration_ms"] or 0) >= min_ms]
+        traces.reverse()
+        if slowest:
+            traces.sort(key=lambda t: t["duration_ms"] or 0, reverse=True)
+        return traces[:max(0, limit)]
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return next((t for t in self._recent if t["trace_id"] == trace_id), None)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
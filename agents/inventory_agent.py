@@ -1,6 +1,8 @@
 import json
-from adk.engine import Agent
-from mcp_servers.inventory_server import check_stock, reserve_inventory
+from adk.engine import Agent, ToolStep, Reply, DEFER_TO_LLM
+from config import DEFAULT_MODEL, FAST_MODEL
+from adk.scheduler import current_session
+from mcp_servers.inventory_server import check_stock, reserve_inventory, release_session_reservations
 
 
 def handoff_to_order(product_id: str, agreed_price: float, reserved_qty: int) -> str:
@@ -21,6 +23,8 @@ def end_transaction(reason: str) -> str:
     Ends the transaction if the item is out of stock and no alternatives exist.
     Apologise sincerely to the customer before calling this.
     """
+    # Nothing this session holds should outlive the transaction
+    release_session_reservations(current_session.get())
     return json.dumps({"handoff_to": "None", "reason": reason})
 
 
@@ -40,8 +44,38 @@ RULES:
 Keep your messages brief. You are a background process — the customer should barely notice the transition.
 """
 
+def inventory_workflow(state):
+    """
+    The rules above as a fixed procedure: check -> reserve 1 unit -> hand off,
+    or apologise and end. No model round-trips; the LLM only takes over if the
+    negotiated deal is missing from the shared context.
+    """
+    product_id = state.shared_context.get("product_id")
+    agreed_price = state.shared_context.get("agreed_price")
+    if not product_id or agreed_price is None:
+        return DEFER_TO_LLM
+
+    stock = json.loads((yield ToolStep("check_stock", product_id=product_id)))
+    if stock.get("in_stock"):
+        reservation = json.loads((yield ToolStep("reserve_inventory", product_id=product_id, quantity=1)))
+        if reservation.get("success"):
+            yield Reply("Great news — your item is reserved. Moving you to checkout now!")
+            yield ToolStep(
+                "handoff_to_order", product_id=product_id, agreed_price=agreed_price,
+                reserved_qty=reservation["reserved_quantity"]
+            )
+            return
+
+    yield Reply("I'm sorry — that item just went out of stock. Would you like to explore an alternative?")
+    yield ToolStep("end_transaction", reason=f"{product_id} out of stock")
+
+
 inventory_agent = Agent(
     name="Inventory",
     instructions=inventory_instructions,
-    tools=[check_stock, reserve_inventory, handoff_to_order, end_transaction]
+    tools=[check_stock, reserve_inventory, handoff_to_order, end_transaction],
+    # Only used when the workflow defers: a fixed sequence does not need the large model
+    model=FAST_MODEL,
+    fallback_models=[DEFAULT_MODEL],
+    workflow=inventory_workflow
 )
@@ -1,28 +1,28 @@
 import json
 from adk.engine import Agent
-from mcp_servers.catalog_server import get_product_pricing_intel
-from mcp_servers.crm_server import get_customer_profile, log_negotiation_outcome
+from mcp_servers.catalog_server import get_product_pricing_intel, PRICING_TABLE
+from mcp_servers.crm_server import CRM_DB, get_customer_profile, log_negotiation_outcome
+from mcp_servers.pricing_policy import customer_tier
 
 
-def handoff_to_inventory(product_id: str, agreed_price: float, reason: str) -> str:
+def handoff_to_inventory(user_id: str, product_id: str, agreed_price: float, reason: str) -> str:
     """
     Closes the negotiation successfully and transfers to the Inventory agent
     to reserve stock and proceed to checkout.
     Call this ONLY after the customer explicitly agrees to a specific price.
-    agreed_price must be >= the floor_price from get_product_pricing_intel.
+    agreed_price must be >= the lowest price allowed for this customer
+    (lowest_price_new_customer or lowest_price_loyal_customer from get_product_pricing_intel).
     """
     # [SECURITY MITIGATION]: Server-side validation to prevent context spoofing
-    intel_json = get_product_pricing_intel(product_id)
-    try:
-        intel = json.loads(intel_json)
-        if "floor_price" in intel:
-            floor_price = intel["floor_price"]
-            if agreed_price < floor_price:
-                return json.dumps({
-                    "error": "SECURITY VIOLATION: The requested handoff price is below the allowable floor price. You MUST negotiate a higher price."
-                })
-    except Exception as e:
-        return f"Error verifying price limits: {e}"
+    limits = PRICING_TABLE.get(product_id)
+    if limits is None:
+        return json.dumps({"error": f"Error verifying price limits: unknown product {product_id}."})
+    # Unknown customers get the new-customer limit, same as get_customer_profile
+    lifetime_value = CRM_DB.get(user_id, {}).get("lifetime_value", 0.0)
+    if agreed_price < limits.lowest_price(customer_tier(lifetime_value)):
+        return json.dumps({
+            "error": "SECURITY VIOLATION: The requested handoff price is below the lowest price allowed for this customer. You MUST negotiate a higher price."
+        })
 
     return json.dumps({
         "handoff_to": "Inventory",
@@ -89,8 +89,8 @@ STAGE 3 — OFFER A VALUE-ADD (not a price cut)
 STAGE 4 — STRATEGIC CONCESSIONS (use sparingly, never eagerly)
   Rules for Concessions:
   • DYNAMIC PRICING LIMIT: Base your maximum discount on their customer profile.
-    - If `lifetime_value` == 0 (New Customer): Max discount is 2% off the selling_price.
-    - If `lifetime_value` > 0 (Loyal Customer): Max discount is 5% off the selling_price.
+    - If `lifetime_value` == 0 (New Customer): Max discount is 2% off the selling_price (`lowest_price_new_customer` in the pricing intel).
+    - If `lifetime_value` > 0 (Loyal Customer): Max discount is 5% off the selling_price (`lowest_price_loyal_customer` in the pricing intel).
   • HARD RULE: The final agreed_price must ALWAYS be >= floor_price. If the allowed discount goes below floor_price, stop at floor_price.
   • SMALL CONCESSIONS: If you make multiple drops, they must be in DECREASING increments to signal you are reaching your limit. (e.g., initial drop of Rs. 2000, next drop of only Rs. 500).
   • REASONED OFFERS: NEVER give a naked discount. Always pair a price drop with a justification:
@@ -110,7 +110,7 @@ STAGE 5 — WALK AWAY (firm but respectful)
 ════════════════════════════════════════════════
 When customer agrees to a price:
 1. Call log_negotiation_outcome with the correct outcome type and agreed price.
-2. Immediately call handoff_to_inventory with product_id and agreed_price.
+2. Immediately call handoff_to_inventory with user_id, product_id and agreed_price.
 3. Congratulate the customer warmly: "Excellent choice! Let's get this reserved for you."
 """
 
@@ -123,5 +123,7 @@ negotiator_agent = Agent(
         log_negotiation_outcome,
         handoff_to_inventory,
         end_negotiation
-    ]
+    ],
+    # The mandatory opening pair (profile + pricing intel) has no data dependency
+    parallel_tools=True
 )
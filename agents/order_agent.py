@@ -1,7 +1,21 @@
 import json
 from adk.engine import Agent
 from mcp_servers.payment_server import validate_shipping_address, process_payment, generate_invoice
-from mcp_servers.catalog_server import deduct_stock
+from adk.scheduler import current_session
+from mcp_servers.catalog_server import STOCK_LEDGER, deduct_stock as catalog_deduct_stock
+from mcp_servers.inventory_server import commit_session_reservation
+
+
+def deduct_stock(product_id: str, quantity: int = 1) -> str:
+    """
+    Deducts stock for a product upon successful purchase.
+    """
+    # The session's hold becomes the sale (one ledger entry); only units it
+    # does not cover are sold from available stock
+    sold = commit_session_reservation(current_session.get(), product_id)
+    if sold >= quantity:
+        return json.dumps({"success": True, "remaining_stock": STOCK_LEDGER.available(product_id)})
+    return catalog_deduct_stock(product_id, quantity - sold)
 
 
 def final_confirmation(invoice_id: str) -> str:
@@ -1,20 +1,88 @@
 import os
+import gzip
 import json
+import time
+import asyncio
+import hashlib
+import hmac
 import uvicorn
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 
-from adk.engine import AgentState
+from config import (
+    start_llm_client, close_llm_client, llm_scheduler, tracer, DEBUG_TOKEN,
+    SESSION_BACKEND, SESSION_DB, SESSION_MAX_ENTRIES, SESSION_MAX_BYTES, WEB_WORKERS,
+    SESSION_IDLE_TTL_SECONDS, SESSION_SPILL_DIR, SESSION_SPILL_TTL_SECONDS,
+    SESSION_QUEUE_DEPTH, SESSION_MAX_COALESCE, MAX_CONCURRENT_TURNS, MIN_CONCURRENT_TURNS,
+    TURN_QUEUE_LIMIT, TURN_QUEUE_TIMEOUT_SECONDS, TARGET_LLM_LATENCY_SECONDS,
+    EVENT_REPLAY_EVENTS, EVENT_REPLAY_BYTES, EVENT_REPLAY_TTL_SECONDS, DISCONNECT_RELEASE_GRACE_SECONDS,
+    WS_BATCH_WINDOW_MS, WS_MAX_BATCH, WS_MAX_PENDING, TOOL_OUTPUT_PREVIEW_CHARS
+)
+from adk.scheduler import current_session
+from adk.engine import AgentState, TurnBudget
+from adk.session_store import SessionConflict, open_session_store
+from adk.session_actor import SessionActors, COALESCED, REJECTED
+from adk.admission import AdmissionController, Overloaded
+from adk.event_log import EventLogs
+from adk.tracing import annotate, session_tag
+from adk.outbox import Outbox, TOOL_OUTPUT_MODES, encode_event, frames, shape_event
 from agents.discovery_agent import discovery_agent
 from agents.negotiator_agent import negotiator_agent
 from agents.inventory_agent import inventory_agent
 from agents.order_agent import order_agent
-from mcp_servers.catalog_server import CATALOG_DB
+from mcp_servers.catalog_server import CATALOG_STORE, STOCK_LEDGER
+from mcp_servers.inventory_server import INVENTORY, release_session_reservations
 
-app = FastAPI(title="Autonomous Retail Store API")
+try:
+    import brotli  # optional: br responses for /api/catalog
+except ImportError:
+    brotli = None
+
+# Longest the reservation sweeper sleeps, so holds made meanwhile are not missed by much
+RESERVATION_SWEEP_MAX_SECONDS = 1.0
+
+async def sweep_reservations():
+    """Releases expired inventory holds; sleeps until the earliest expiry (heap top)."""
+    while True:
+        expired = INVENTORY.expire_due()
+        if expired:
+            print(f"[Inventory] Expired {len(expired)} abandoned reservation(s)")
+        next_expiry = INVENTORY.next_expiry()
+        delay = RESERVATION_SWEEP_MAX_SECONDS if next_expiry is None else next_expiry - time.time()
+        await asyncio.sleep(min(RESERVATION_SWEEP_MAX_SECONDS, max(0.0, delay)))
+
+# How often idle sessions are moved out of memory
+SESSION_SWEEP_SECONDS = 30.0
+
+async def sweep_sessions():
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_SECONDS)
+        evicted = await asyncio.to_thread(sessions.sweep)
+        if evicted:
+            print(f"[Sessions] Evicted {evicted} idle session(s)")
+        event_logs.sweep(manager.connected)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled, keep-alive LLM client for every agent and session
+    await start_llm_client()
+    sweepers = [asyncio.create_task(sweep_reservations()), asyncio.create_task(sweep_sessions())]
+    yield
+    # Holds still in their disconnect grace period are left to expire by TTL
+    for task in [*sweepers, *pending_releases.values()]:
+        task.cancel()
+    # Fold the WAL into a snapshot so the next start replays nothing
+    STOCK_LEDGER.checkpoint()
+    STOCK_LEDGER.close()
+    tracer.close()
+    await close_llm_client()
+
+app = FastAPI(title="Autonomous Retail Store API", lifespan=lifespan)
 
 # Mount static files
 os.makedirs("static", exist_ok=True)
@@ -28,68 +96,439 @@ AGENTS = {
     "OrderTaking": order_agent
 }
 
-# In-memory session store
-sessions: Dict[str, AgentState] = {}
+# Session store: bounded in-memory (LRU / idle / byte-budget eviction, spilled
+# to disk) or, with ADK_SESSION_BACKEND=sqlite, one file shared by all workers
+sessions = open_session_store(
+    SESSION_BACKEND,
+    path=SESSION_DB,
+    max_entries=SESSION_MAX_ENTRIES,
+    max_bytes=SESSION_MAX_BYTES,
+    idle_ttl=SESSION_IDLE_TTL_SECONDS,
+    spill_dir=SESSION_SPILL_DIR,
+    spill_ttl=SESSION_SPILL_TTL_SECONDS
+)
+
+# Each worker would otherwise serve its own copy of sessions and sell its own copy of stock
+if WEB_WORKERS > 1 and (SESSION_BACKEND != "sqlite" or not STOCK_LEDGER.shared):
+    raise RuntimeError(
+        f"WEB_CONCURRENCY={WEB_WORKERS} needs ADK_SESSION_BACKEND=sqlite and ADK_STOCK_LEDGER_DB; "
+        "run one worker or set both"
+    )
+
+def new_session_state(session_id: str) -> AgentState:
+    return AgentState(
+        user_id=session_id,
+        messages=[],
+        shared_context={},
+        current_agent="Discovery"
+    )
+
+def sync_payload(state: AgentState) -> Dict[str, Any]:
+    # Only what the chat renders: tool calls and tool results stay server-side
+    return {
+        "messages": [
+            {"role": m["role"], "content": m["content"]}
+            for m in state.messages
+            if m.get("role") in ("user", "assistant") and m.get("content")
+        ],
+        "current_agent": state.current_agent,
+        "shared_context": state.shared_context
+    }
+
+def tool_output_mode(websocket: WebSocket) -> str:
+    # Clients ask for "truncated" or "none" when they do not render tool outputs
+    mode = websocket.query_params.get("tool_output", "full")
+    return mode if mode in TOOL_OUTPUT_MODES else "full"
+
+def wants_batches(websocket: WebSocket) -> bool:
+    return websocket.query_params.get("batch") == "1"
 
 class ConnectionManager:
+    """Every open socket per session: a shopper may have several tabs on one session_id."""
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+        self.active_connections: Dict[str, List[WebSocket]] = {}
+        self.outboxes: Dict[WebSocket, Outbox] = {}
+        self.stats = {"events": 0, "frames": 0, "bytes": 0, "overflows": 0}
 
     async def connect(self, session_id: str, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections[session_id] = websocket
-
-    def disconnect(self, session_id: str):
-        if session_id in self.active_connections:
-            del self.active_connections[session_id]
-
-    async def send_event(self, session_id: str, event_type: str, payload: Any, agent: str = "system"):
-        if session_id in self.active_connections:
-            message = {
-                "type": event_type,
-                "agent": agent,
-                "payload": payload
-            }
+
+    def attach(self, session_id: str, websocket: WebSocket):
+        """Starts live events for a socket; it must already be caught up (see catch_up)."""
+        self.outboxes[websocket] = Outbox(
+            websocket, batch=wants_batches(websocket), window=WS_BATCH_WINDOW_MS / 1000,
+            max_batch=WS_MAX_BATCH, max_pending=WS_MAX_PENDING, stats=self.stats
+        )
+        self.active_connections.setdefault(session_id, []).append(websocket)
+
+    def disconnect(self, session_id: str, websocket: WebSocket):
+        sockets = self.active_connections.get(session_id, [])
+        if websocket in sockets:
+            sockets.remove(websocket)
+        outbox = self.outboxes.pop(websocket, None)
+        if outbox is not None:
+            outbox.close()
+        if not sockets:
+            self.active_connections.pop(session_id, None)
+
+    def connected(self, session_id: str) -> bool:
+        return session_id in self.active_connections
+
+    async def send_event(self, session_id: str, event_type: str, payload: Any, agent: str = "system",
+                         only: Optional[WebSocket] = None, exclude: Optional[WebSocket] = None):
+        """
+        Sends to every socket of the session, or just `only`, skipping `exclude`.
+        Session-wide events are numbered and kept for replay on reconnect.
+        """
+        event = {
+            "type": event_type,
+            "agent": agent,
+            "payload": payload
+        }
+        # Encoded once per distinct shape: only tool outputs differ between clients
+        encoded: Dict[str, str] = {}
+
+        def encoding(mode: str) -> str:
+            shaped = shape_event(event, mode, TOOL_OUTPUT_PREVIEW_CHARS)
+            key = mode if shaped is not event else "full"
+            if key not in encoded:
+                encoded[key] = encode_event(shaped)
+            return encoded[key]
+
+        if only is not None:
+            sockets = [only]
+        else:
+            sockets = list(self.active_connections.get(session_id, []))
+            log = event_logs.get(session_id)
+            event["seq"] = log.next_seq()
+            # Replay keeps the truncated shape: enough for every client, and small
+            origin = exclude.query_params.get("client") if exclude is not None else None
+            log.append(event["seq"], encoding("truncated"), origin)
+        # A growing backlog in a trace means the socket, not the turn, is slow
+        backlog = [self.outboxes[ws].depth for ws in sockets if ws in self.outboxes]
+        annotate(sockets=len(sockets), backlog=max(backlog, default=0))
+        for websocket in sockets:
+            if websocket is exclude:
+                continue
+            message = encoding(tool_output_mode(websocket))
+            outbox = self.outboxes.get(websocket)
+            if outbox is not None:
+                outbox.put(message)
+                continue
+            # Not attached yet (catching up): written directly, in order
             try:
-                await self.active_connections[session_id].send_text(json.dumps(message))
+                await websocket.send_text(message)
             except Exception as e:
                 print(f"Error sending to {session_id}: {e}")
 
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "sockets": len(self.outboxes),
+            "pending": sum(outbox.depth for outbox in self.outboxes.values()),
+            **self.stats,
+        }
+
 manager = ConnectionManager()
+event_logs = EventLogs(max_events=EVENT_REPLAY_EVENTS, max_bytes=EVENT_REPLAY_BYTES, ttl=EVENT_REPLAY_TTL_SECONDS)
 
 @app.get("/", response_class=HTMLResponse)
 async def get_index():
     with open("static/index.html", "r", encoding="utf-8") as f:
         return f.read()
 
+# ── Catalog API ───────────────────────────────────────────────────────────────
+# Pages are serialised and compressed once per catalog version and served from
+# memory; a matching If-None-Match costs no serialisation at all. Any stock or
+# product change bumps CATALOG_STORE.version, which retires every cached page.
+PUBLIC_PRODUCT_FIELDS = (
+    "id", "name", "mrp", "price", "stock", "image_url", "category", "description", "key_features"
+)
+CATALOG_PAGE_LIMIT = 100
+CATALOG_MAX_PAGE_LIMIT = 500
+CATALOG_CACHE_ENTRIES = 256
+
+_catalog_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # Weak comparison: gzip/br variants of one page share a validator
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or etag[2:] in tags
+
+def _build_catalog_page(category: str, cursor: str, limit: int, fields: tuple) -> Dict[str, Any]:
+    products = CATALOG_STORE.list_products(category=category or None, after=cursor or None, limit=limit + 1)
+    page = products[:limit]
+    body = json.dumps({
+        "products": [{f: p[f] for f in fields} for p in page],
+        "next_cursor": page[-1]["id"] if len(products) > limit else None
+    }, separators=(",", ":")).encode()
+    return {
+        "identity": body,
+        "gzip": gzip.compress(body, 6),
+        "br": brotli.compress(body) if brotli else None
+    }
+
 @app.get("/api/catalog")
-async def get_catalog():
-    return JSONResponse(content={"products": CATALOG_DB})
+async def get_catalog(request: Request, category: str = "", cursor: str = "",
+                      limit: int = CATALOG_PAGE_LIMIT, fields: str = ""):
+    """Public catalog page: ?category=&cursor=<next_cursor>&limit=&fields=id,name,price"""
+    limit = max(1, min(limit, CATALOG_MAX_PAGE_LIMIT))
+    if fields:
+        requested = tuple(f.strip() for f in fields.split(",") if f.strip())
+        unknown = [f for f in requested if f not in PUBLIC_PRODUCT_FIELDS]
+        if unknown:
+            return JSONResponse(status_code=400, content={"error": f"Unknown or private fields: {', '.join(unknown)}"})
+        projection = tuple(dict.fromkeys(("id",) + requested))
+    else:
+        projection = PUBLIC_PRODUCT_FIELDS
+
+    if cursor and CATALOG_STORE.get(cursor) is None:
+        return JSONResponse(status_code=400, content={"error": "Unknown cursor; start again without one"})
+
+    version = CATALOG_STORE.version
+    key = (category, cursor, limit, projection)
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+    etag = f'W/"{version}-{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    entry = _catalog_cache.get(key)
+    if entry is None or entry["version"] != version:
+        entry = {"version": version, **_build_catalog_page(category, cursor, limit, projection)}
+        _catalog_cache[key] = entry
+        if len(_catalog_cache) > CATALOG_CACHE_ENTRIES:
+            _catalog_cache.popitem(last=False)
+    _catalog_cache.move_to_end(key)
+
+    accept = request.headers.get("accept-encoding", "")
+    if entry["br"] is not None and "br" in accept:
+        encoding = "br"
+    elif "gzip" in accept:
+        encoding = "gzip"
+    else:
+        encoding = "identity"
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=entry[encoding], media_type="application/json", headers=headers)
+
+def require_debug_token(x_debug_token: str = Header(default="")) -> None:
+    """/debug/* is off unless ADK_DEBUG_TOKEN is set, and then needs it in X-Debug-Token."""
+    if not DEBUG_TOKEN or not hmac.compare_digest(x_debug_token.encode(), DEBUG_TOKEN.encode()):
+        raise HTTPException(status_code=404)
+
+@app.get("/debug/traces", dependencies=[Depends(require_debug_token)])
+async def get_traces(limit: int = 20, sort: str = "slowest", name: str = "turn", min_ms: float = 0.0,
+                     trace_id: str = ""):
+    """Recent traces, slowest first (?sort=recent for newest); ?trace_id= for one trace."""
+    if trace_id:
+        trace = tracer.get(trace_id)
+        if trace is None:
+            return JSONResponse(status_code=404, content={"error": "Trace not found (it may have left the ring buffer)."})
+        return JSONResponse(content=trace)
+    return JSONResponse(content={
+        "traces": tracer.recent(limit=limit, name=name, slowest=sort != "recent", min_ms=min_ms),
+        "recorded": tracer.traces
+    })
+
+@app.get("/debug/metrics", dependencies=[Depends(require_debug_token)])
+async def get_metrics():
+    return JSONResponse(content={
+        "llm_scheduler": llm_scheduler.metrics(),
+        "sessions": sessions.metrics(),
+        "session_actors": actors.metrics(),
+        "admission": admission.metrics(),
+        "event_replay": event_logs.metrics(),
+        "outbound": manager.metrics(),
+        "inventory": INVENTORY.metrics(),
+        "stock_ledger": STOCK_LEDGER.metrics(),
+        "agents": {name: agent.stats() for name, agent in AGENTS.items()}
+    })
+
+# Turn priority by the agent a session is with (lower is served first)
+TURN_PRIORITIES = {"OrderTaking": 0, "Inventory": 0, "Negotiator": 1, "Discovery": 2}
+
+# Global cap on concurrent agent turns, adapted to observed LLM latency
+admission = AdmissionController(
+    max_in_flight=MAX_CONCURRENT_TURNS,
+    min_in_flight=MIN_CONCURRENT_TURNS,
+    max_queue=TURN_QUEUE_LIMIT,
+    max_wait=TURN_QUEUE_TIMEOUT_SECONDS,
+    target_latency=TARGET_LLM_LATENCY_SECONDS,
+    latency=lambda: llm_scheduler.latency_ewma
+)
+
+async def run_turn(session_id: str, user_message: str):
+    """One user message through the agent chain, traced as one "turn". Only the session's actor calls this."""
+    current_agent = None
+    try:
+        with tracer.span("turn", session=session_tag(session_id), chars=len(user_message)):
+            current_agent = await handle_turn(session_id, user_message)
+    except Exception as e:
+        # The trace keeps the error; the client must still leave its "thinking" state
+        print(f"[Session {session_id}] Turn failed: {type(e).__name__}: {e}")
+        await manager.send_event(session_id, "error", {
+            "message": "Sorry, something went wrong while handling that message. Please try again."
+        })
+    if current_agent is None:
+        state = await asyncio.to_thread(sessions.get, session_id)
+        current_agent = state.current_agent if state is not None else "Discovery"
+    # Every turn ends with turn_complete, whichever way it went (reset, shed, failed)
+    await manager.send_event(session_id, "turn_complete", {"current_agent": current_agent})
+
+async def handle_turn(session_id: str, user_message: str) -> str:
+    """Runs the turn; returns the agent the session is with afterwards."""
+    # Store calls run in a thread: SQLite may wait on busy_timeout, the memory store may restore a spill file
+    state = await asyncio.to_thread(sessions.get, session_id) or new_session_state(session_id)
+    annotate(agent=state.current_agent)
+
+    if user_message.strip() == "/reset_session":
+        release_session_reservations(session_id)
+        await asyncio.to_thread(sessions.put, session_id, new_session_state(session_id), force=True)
+        # Send confirmation back so frontend knows the session is clean
+        await manager.send_event(session_id, "sync_state", {
+            "messages": [],
+            "current_agent": "Discovery",
+            "shared_context": {}
+        })
+        return "Discovery"
+
+    if state.current_agent in ["Completed", "None"]:
+        await asyncio.to_thread(sessions.put, session_id, new_session_state(session_id), force=True)
+        await manager.send_event(session_id, "reset_ui", {}, agent="system")
+        return "Discovery"
+
+    # Checkouts go first; under overload new browsing turns are the ones shed
+    priority = TURN_PRIORITIES.get(state.current_agent, len(TURN_PRIORITIES))
+    try:
+        with tracer.span("admission", priority=priority):
+            await admission.acquire(priority)
+    except Overloaded as e:
+        annotate(shed=True)
+        await manager.send_event(session_id, "busy", {
+            "message": "We're very busy right now — please send that again in a moment.",
+            "retry_after": e.retry_after
+        })
+        return state.current_agent
+    started = time.monotonic()
+    try:
+        state.messages.append({"role": "user", "content": user_message})
+        # One budget for the whole message, however many agents it passes through
+        budget = TurnBudget()
+
+        # Helper callback for engine events
+        async def emit_callback(event_type: str, payload: Any):
+            await manager.send_event(session_id, event_type, payload, agent=state.current_agent)
+
+        break_to_user = False
+        while state.current_agent in AGENTS and not break_to_user:
+            current_name = state.current_agent
+            agent = AGENTS[current_name]
+
+            # Await the async run logic
+            state = await agent.run_async(state, emit_callback, budget)
+            # Keep the session store in sync after each agent run (re-sizes it)
+            try:
+                await asyncio.to_thread(sessions.put, session_id, state)
+            except SessionConflict:
+                # Another worker saved this session meanwhile; its version wins
+                state = await asyncio.to_thread(sessions.get, session_id) or new_session_state(session_id)
+                await manager.send_event(session_id, "sync_state", sync_payload(state))
+                break
+
+            if state.current_agent != current_name:
+                # It transitioned
+                pass
+            else:
+                break_to_user = True
+
+        if state.current_agent in ["Completed", "None"]:
+            # Paid holds were committed by deduct_stock; anything left is abandoned
+            release_session_reservations(session_id)
+            state = new_session_state(session_id)
+            await asyncio.to_thread(sessions.put, session_id, state, force=True)
+            await manager.send_event(session_id, "reset_ui", {}, agent="system")
+
+        annotate(final_agent=state.current_agent)
+        return state.current_agent
+    finally:
+        admission.release(time.monotonic() - started)
+
+# One actor per session serialises its turns; sockets only enqueue
+actors = SessionActors(run_turn, max_depth=SESSION_QUEUE_DEPTH, max_coalesce=SESSION_MAX_COALESCE)
+
+async def load_session(session_id: str) -> AgentState:
+    # Any worker can pick the session up: restored from disk or the shared store
+    state = await asyncio.to_thread(sessions.get, session_id)
+    if state is None:
+        # Initialize new session
+        state = new_session_state(session_id)
+        try:
+            await asyncio.to_thread(sessions.put, session_id, state)
+        except SessionConflict:
+            # Another socket created it first
+            state = await asyncio.to_thread(sessions.get, session_id) or state
+    return state
+
+async def catch_up(session_id: str, websocket: WebSocket):
+    """Brings a new socket up to date, then attaches it for live events."""
+    params = websocket.query_params
+    client = params.get("client")
+    log = event_logs.get(session_id)
+    log.touch()
+    missed = None
+    if params.get("epoch") and params.get("last_seq", "").isdigit():
+        missed = event_logs.resume(session_id, params["epoch"], int(params["last_seq"]), client)
+    while True:
+        # Loaded before reading seq, so the snapshot and the seq it claims are taken together
+        state = await load_session(session_id) if missed is None else None
+        seq = log.seq
+        if missed is None:
+            # Fallback: this socket only; other tabs are already in sync
+            payload = {**sync_payload(state), "epoch": log.epoch, "seq": seq}
+            await manager.send_event(session_id, "sync_state", payload, only=websocket)
+        else:
+            for frame in frames(missed, wants_batches(websocket), WS_MAX_BATCH):
+                await websocket.send_text(frame)
+        # Events emitted while we were sending go out next; attaching with no
+        # await after the last check means none can fall in between
+        missed = log.since(seq, client)
+        if missed == []:
+            manager.attach(session_id, websocket)
+            return
+
+# Sessions whose last socket closed, waiting out the grace period before their holds are released
+pending_releases: Dict[str, asyncio.Task] = {}
+
+async def release_after_grace(session_id: str):
+    """Releases a departed session's holds unless a socket reconnects first (which cancels this)."""
+    try:
+        # Let a turn already in flight finish (and save) first
+        await actors.get(session_id).wait_idle()
+        await asyncio.sleep(DISCONNECT_RELEASE_GRACE_SECONDS)
+        if not manager.connected(session_id):
+            release_session_reservations(session_id)
+            actors.discard(session_id)
+    finally:
+        if pending_releases.get(session_id) is asyncio.current_task():
+            del pending_releases[session_id]
 
 @app.websocket("/ws/chat/{session_id}")
 async def websocket_chat(websocket: WebSocket, session_id: str):
+    # Every LLM call made for this session is queued fairly under it
+    # (the actor's task inherits this context)
+    current_session.set(session_id)
     await manager.connect(session_id, websocket)
+    # Back within the grace period: the session keeps its holds
+    pending = pending_releases.pop(session_id, None)
+    if pending is not None:
+        pending.cancel()
     try:
-        if session_id not in sessions:
-            # Initialize new session
-            sessions[session_id] = AgentState(
-                user_id=session_id, 
-                messages=[], 
-                shared_context={}, 
-                current_agent="Discovery"
-            )
-        
-        state = sessions[session_id]
-        
-        # Send initial sync_state
-        await manager.send_event(session_id, "sync_state", {
-            "messages": state.messages,
-            "current_agent": state.current_agent,
-            "shared_context": state.shared_context
-        })
+        # A reconnecting client gets only the events it missed; others a full sync_state
+        await catch_up(session_id, websocket)
 
         while True:
-            # Wait for user message
+            # Wait for user message; the turn itself runs in the session's actor
             data = await websocket.receive_text()
             try:
                 msg_data = json.loads(data)
@@ -100,70 +539,35 @@ async def websocket_chat(websocket: WebSocket, session_id: str):
             if not user_message:
                 continue
 
-            # ── Always re-read from dict so reset/transitions are reflected ──
-            state = sessions[session_id]
-
-            if user_message.strip() == "/reset_session":
-                sessions[session_id] = AgentState(
-                    user_id=session_id, 
-                    messages=[], 
-                    shared_context={}, 
-                    current_agent="Discovery"
-                )
-                # Send confirmation back so frontend knows the session is clean
-                await manager.send_event(session_id, "sync_state", {
-                    "messages": [],
-                    "current_agent": "Discovery",
-                    "shared_context": {}
-                })
-                continue
-
-            if state.current_agent in ["Completed", "None"]:
-                sessions[session_id] = AgentState(
-                    user_id=session_id, 
-                    messages=[], 
-                    shared_context={}, 
-                    current_agent="Discovery"
-                )
-                await manager.send_event(session_id, "reset_ui", {}, agent="system")
+            actor = actors.get(session_id)
+            busy = actor.busy
+            outcome = actor.submit(user_message)
+            if outcome == REJECTED:
+                await manager.send_event(session_id, "overloaded", {
+                    "message": "Still working on your previous messages — please wait for the reply before sending more.",
+                    "queue_depth": actor.depth
+                }, only=websocket)
                 continue
-                
-            state.messages.append({"role": "user", "content": user_message})
-            
-            # Helper callback for engine events
-            async def emit_callback(event_type: str, payload: Any):
-                await manager.send_event(session_id, event_type, payload, agent=state.current_agent)
-
-            break_to_user = False
-            while state.current_agent in AGENTS and not break_to_user:
-                current_name = state.current_agent
-                agent = AGENTS[current_name]
-                
-                # Await the async run logic
-                state = await agent.run_async(state, emit_callback)
-                # Keep sessions dict in sync after each agent run
-                sessions[session_id] = state
-                
-                if state.current_agent != current_name:
-                    # It transitioned
-                    pass
-                else:
-                    break_to_user = True
-                    
-            if state.current_agent in ["Completed", "None"]:
-                sessions[session_id] = AgentState(
-                    user_id=session_id, 
-                    messages=[], 
-                    shared_context={}, 
-                    current_agent="Discovery"
-                )
-                await manager.send_event(session_id, "reset_ui", {}, agent="system")
+            if not user_message.startswith("/"):
+                # Other tabs on this session show what was sent
+                await manager.send_event(session_id, "user_message", {"content": user_message}, exclude=websocket)
+            if busy:
+                await manager.send_event(session_id, "message_queued", {
+                    "coalesced": outcome == COALESCED,
+                    "queue_depth": actor.depth
+                }, only=websocket)
 
     except WebSocketDisconnect:
-        manager.disconnect(session_id)
+        pass
     except Exception as e:
         print(f"WS Error: {e}")
-        manager.disconnect(session_id)
+    manager.disconnect(session_id, websocket)
+    # Keep the replay buffer for a reconnect within the TTL
+    event_logs.get(session_id).touch()
+    if not manager.connected(session_id) and session_id not in pending_releases:
+        # A shopper who leaves mid-checkout should not keep holding stock, but a
+        # dropped connection that comes back within the grace period keeps it
+        pending_releases[session_id] = asyncio.create_task(release_after_grace(session_id))
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
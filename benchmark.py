@@ -0,0 +1,389 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  Headless throughput benchmark
+#
+#  Spins up N simulated shoppers that walk Discovery → Negotiator → Inventory →
+#  OrderTaking either directly against the agent pipeline or against a running
+#  server's /ws/chat/{session_id}. Reports turns/sec, per-agent turn latency
+#  percentiles, LLM calls per completed order, WebSocket egress and memory growth as JSON.
+#
+#    python benchmark.py --shoppers 50                      # offline, scripted model
+#    python benchmark.py --llm replay --cassette run.jsonl  # offline, recorded model
+#    ADK_LLM_BACKEND=scripted ADK_LLM_SCRIPT=benchmark:retail_policy ADK_LLM_RPM=0 ADK_LLM_TPM=0 python app.py
+#    python benchmark.py --mode ws --url ws://localhost:8000 --shoppers 50
+#    python benchmark.py --mode ws --ws-params ""  # one event per frame, full tool outputs
+# ══════════════════════════════════════════════════════════════════════════════
+
+KEYWORDS = ["laptop", "drone", "monitor", "smartwatch", "earbuds", "camera", "speaker", "keyboard"]
+
+
+def shopper_journey(keyword: str) -> List[str]:
+    return [
+        f"Show me a {keyword}",
+        "That's too expensive, can you do better?",
+        "OK, deal at that price",
+        "street: 12 Mall Road",
+        "city: Lahore",
+        "zip: 54000",
+        "country: Pakistan",
+        "mock_token_123",
+    ]
+
+
+# ── Scripted fake model for the journey ───────────────────────────────────────
+# Usable as ADK_LLM_SCRIPT=benchmark:retail_policy. It recognises each agent by
+# its tools and plays the happy path so runs need no network.
+
+def _call(name: str, **arguments) -> Dict[str, Any]:
+    return {"function": {"name": name, "arguments": arguments}}
+
+
+def _context(messages: List[Dict]) -> Dict[str, Any]:
+    for msg in reversed(messages):
+        content = msg.get("content") or ""
+        if msg.get("role") == "system" and content.startswith("Context from previous agents: "):
+            return json.loads(content[len("Context from previous agents: "):])
+    return {}
+
+
+def _tool_result(messages: List[Dict], name: str) -> Dict[str, Any]:
+    for msg in reversed(messages):
+        if msg.get("role") == "tool" and msg.get("name") == name:
+            try:
+                data = json.loads(msg["content"])
+            except (ValueError, TypeError):
+                return {}
+            return data[0] if isinstance(data, list) and data else data if isinstance(data, dict) else {}
+    return {}
+
+
+def retail_policy(messages: List[Dict], tools: List[Dict]) -> Dict[str, Any]:
+    names = {t["function"]["name"] for t in tools}
+    ctx = _context(messages)
+    convo = [m for m in messages if m.get("role") != "system"]
+    last = convo[-1] if convo else {}
+    user_text = (last.get("content") or "").lower() if last.get("role") == "user" else ""
+    last_tool = last.get("name") if last.get("role") == "tool" else None
+
+    if "search_catalog" in names:
+        product = _tool_result(messages, "search_catalog")
+        if "expensive" in user_text and product:
+            return {"tool_calls": [_call(
+                "handoff_to_negotiator", product_id=product["id"], product_name=product["name"],
+                asking_price=product["price"], reason="Customer asked for a better price"
+            )]}
+        if user_text:
+            return {"tool_calls": [_call("search_catalog", query=user_text.split()[-1])]}
+        if last_tool == "search_catalog" and product:
+            return {"content": f"The {product['name']} has an MRP of Rs. {product['mrp']:,.0f}. "
+                               f"We have it today at Rs. {product['price']:,.0f}. Would you like it?"}
+        return {"content": "We couldn't find that. Could you try another product?"}
+
+    if "get_product_pricing_intel" in names:
+        intel = _tool_result(messages, "get_product_pricing_intel")
+        if last_tool in ("handoff_to_negotiator", None) and not user_text.startswith("ok"):
+            return {"tool_calls": [
+                _call("get_customer_profile", user_id="user_456"),
+                _call("get_product_pricing_intel", product_id=ctx.get("product_id", "p1")),
+            ]}
+        offer = max(intel.get("floor_price", 0), round(intel.get("selling_price", 0) * 0.98, 2))
+        if user_text.startswith("ok"):
+            return {"tool_calls": [
+                _call("log_negotiation_outcome", user_id="user_456", product_id=intel.get("product_id", "p1"),
+                      outcome="sold_with_concession", final_price=offer),
+                _call("handoff_to_inventory", user_id="user_456", product_id=intel.get("product_id", "p1"),
+                      agreed_price=offer, reason="Customer accepted the welcome courtesy"),
+            ]}
+        return {"content": f"Normally Rs. {intel.get('mrp', 0):,.0f}. As a one-time welcome courtesy I can do Rs. {offer:,.0f}."}
+
+    if "check_stock" in names:
+        if last_tool == "check_stock":
+            if _tool_result(messages, "check_stock").get("in_stock"):
+                return {"tool_calls": [_call("reserve_inventory", product_id=ctx.get("product_id"), quantity=1)]}
+            return {"tool_calls": [_call("end_transaction", reason="Out of stock")]}
+        if last_tool == "reserve_inventory":
+            if _tool_result(messages, "reserve_inventory").get("success"):
+                return {"content": "Great news — your item is reserved. Moving you to checkout now!",
+                        "tool_calls": [_call("handoff_to_order", product_id=ctx.get("product_id"),
+                                             agreed_price=ctx.get("agreed_price"), reserved_qty=1)]}
+            return {"tool_calls": [_call("end_transaction", reason="Reservation failed")]}
+        return {"tool_calls": [_call("check_stock", product_id=ctx.get("product_id"))]}
+
+    if "process_payment" in names:
+        price = ctx.get("agreed_price", 0)
+        if user_text.startswith("country"):
+            fields = {}
+            for msg in convo:
+                text = msg.get("content") or ""
+                if msg.get("role") == "user" and ":" in text:
+                    key, _, value = text.partition(":")
+                    fields[key.strip().lower()] = value.strip()
+            return {"tool_calls": [_call("validate_shipping_address", street=fields.get("street", ""),
+                                         city=fields.get("city", ""), zip_code=fields.get("zip", ""),
+                                         country=fields.get("country", ""))]}
+        if last_tool == "validate_shipping_address":
+            return {"content": "Please provide your payment method. For demo purposes, use 'mock_token_123'."}
+        if user_text.startswith("mock_token"):
+            return {"tool_calls": [_call("process_payment", user_id="user_456", amount=price, payment_method="mock_token_123")]}
+        if last_tool == "process_payment":
+            return {"tool_calls": [_call("deduct_stock", product_id=ctx.get("product_id"), quantity=1)]}
+        if last_tool == "deduct_stock":
+            payment = _tool_result(messages, "process_payment")
+            return {"tool_calls": [_call("generate_invoice", user_id="user_456", product_id=ctx.get("product_id"),
+                                         agreed_price=price, transaction_id=payment.get("transaction_id", ""))]}
+        if last_tool == "generate_invoice":
+            invoice = _tool_result(messages, "generate_invoice")
+            return {"content": f"Your order is confirmed! Invoice {invoice.get('invoice_id')} has been sent.",
+                    "tool_calls": [_call("final_confirmation", invoice_id=invoice.get("invoice_id", ""))]}
+        return {"content": "Thanks! What's the next part of your shipping address?"}
+
+    return {"content": "OK"}
+
+
+# ── Measurement helpers ───────────────────────────────────────────────────────
+
+class CountingBackend:
+    """Wraps the configured LLM backend and counts calls."""
+    def __init__(self, inner):
+        self.inner = inner
+        self.calls = 0
+
+    def complete(self, **kwargs):
+        self.calls += 1
+        return self.inner.complete(**kwargs)
+
+    async def acomplete(self, **kwargs):
+        self.calls += 1
+        return await self.inner.acomplete(**kwargs)
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+
+    def rank(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2)
+
+    return {"count": len(ordered), "p50": rank(0.50), "p95": rank(0.95), "p99": rank(0.99),
+            "max": round(ordered[-1] * 1000, 2)}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+class Results:
+    def __init__(self):
+        self.turns = 0
+        self.orders = 0
+        self.ended = 0
+        self.errors = 0
+        # Turns the server shed as busy (ws mode); the message was never handled
+        self.failed_turns = 0
+        # ws mode: what the server sent (text frames, events, bytes)
+        self.ws_frames = 0
+        self.ws_events = 0
+        self.ws_bytes = 0
+        self.agent_latency: Dict[str, List[float]] = defaultdict(list)
+
+
+# ── Drivers ───────────────────────────────────────────────────────────────────
+
+async def run_pipeline_shopper(shopper_id: int, journey: List[str], results: Results):
+    from adk.engine import AgentState, TurnBudget
+    from adk.scheduler import current_session
+    from workflow import AGENTS
+
+    # Each shopper runs in its own task: holds, commits and releases stay its own
+    # (as with one session per socket on the server) instead of all sharing "default"
+    session_id = f"bench_{shopper_id}_{random.randrange(1 << 30)}"
+    current_session.set(session_id)
+    state = AgentState(user_id=session_id, messages=[], shared_context={}, current_agent="Discovery")
+
+    async def emit(event_type: str, payload: Any):
+        if event_type == "error":
+            results.errors += 1
+
+    for message in journey:
+        state.messages.append({"role": "user", "content": message})
+        budget = TurnBudget()
+        while state.current_agent in AGENTS:
+            current_name = state.current_agent
+            started = time.perf_counter()
+            state = await AGENTS[current_name].run_async(state, emit, budget)
+            results.agent_latency[current_name].append(time.perf_counter() - started)
+            if state.current_agent == current_name:
+                break
+        results.turns += 1
+        if state.current_agent == "Completed":
+            results.orders += 1
+            return
+        if state.current_agent == "None":
+            results.ended += 1
+            return
+
+
+async def run_ws_shopper(shopper_id: int, journey: List[str], results: Results, url: str, params: str,
+                         turn_timeout: float = 120.0):
+    import websockets
+
+    session_id = f"bench_{shopper_id}_{random.randrange(1 << 30)}"
+    current_agent = "Discovery"
+    async with websockets.connect(f"{url}/ws/chat/{session_id}?{params}", max_size=None) as ws:
+        json.loads(await ws.recv())  # initial sync_state
+        for message in journey:
+            turn_agent = current_agent
+            started = time.perf_counter()
+            await ws.send(json.dumps({"message": message}))
+            outcome = None
+            shed = False
+            done = False
+            while not done:
+                # A server that never finishes the turn fails the shopper instead of hanging the run
+                frame = await asyncio.wait_for(ws.recv(), timeout=turn_timeout)
+                events = json.loads(frame)
+                # batch=1: several events per frame, as a JSON array
+                events = events if isinstance(events, list) else [events]
+                results.ws_frames += 1
+                results.ws_events += len(events)
+                results.ws_bytes += len(frame)
+                for event in events:
+                    if event["type"] == "agent_transition":
+                        current_agent = event["payload"]["to"]
+                        outcome = current_agent
+                    elif event["type"] == "error":
+                        results.errors += 1
+                    elif event["type"] == "busy":
+                        # Shed by admission control: the turn did not run
+                        shed = True
+                    elif event["type"] == "turn_complete":
+                        done = True
+            if shed:
+                # The journey cannot go on without this message; count it as abandoned
+                results.failed_turns += 1
+                return
+            results.agent_latency[turn_agent].append(time.perf_counter() - started)
+            results.turns += 1
+            if outcome == "Completed":
+                results.orders += 1
+                return
+            if outcome == "None":
+                results.ended += 1
+                return
+
+
+async def run_benchmark(args) -> Dict[str, Any]:
+    import config
+
+    if args.llm == "scripted":
+        from adk.llm_backends import ScriptedBackend
+        config.llm_backend = ScriptedBackend(retail_policy, latency=args.latency)
+    elif args.llm == "replay":
+        from adk.llm_backends import ReplayBackend
+        config.llm_backend = ReplayBackend(args.cassette, latency=args.latency)
+    counter = CountingBackend(config.llm_backend)
+    config.llm_backend = counter
+    # Offline runs measure the engine, so the client-side rate limiter is off unless asked for
+    from adk.scheduler import LLMScheduler
+    config.llm_scheduler = LLMScheduler(args.rpm, args.tpm)
+
+    rng = random.Random(args.seed)
+    results = Results()
+    semaphore = asyncio.Semaphore(args.concurrency or args.shoppers)
+
+    async def shopper(i: int):
+        async with semaphore:
+            journey = shopper_journey(rng.choice(KEYWORDS))
+            try:
+                if args.mode == "ws":
+                    await run_ws_shopper(i, journey, results, args.url, args.ws_params, args.turn_timeout)
+                else:
+                    await run_pipeline_shopper(i, journey, results)
+            except Exception as e:
+                results.errors += 1
+                print(f"[shopper {i}] {type(e).__name__}: {e}", file=sys.stderr)
+
+    tracemalloc.start()
+    mem_before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    await asyncio.gather(*(shopper(i) for i in range(args.shoppers)))
+    elapsed = time.perf_counter() - started
+    mem_after, mem_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    all_turns = [s for samples in results.agent_latency.values() for s in samples]
+    return {
+        "commit": git_commit(),
+        "config": {
+            "mode": args.mode, "llm": args.llm, "shoppers": args.shoppers,
+            "concurrency": args.concurrency or args.shoppers, "latency": args.latency, "seed": args.seed
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "turns": results.turns,
+        "turns_per_second": round(results.turns / elapsed, 2) if elapsed else None,
+        "orders_completed": results.orders,
+        "journeys_ended_without_order": results.ended,
+        "journeys_abandoned": args.shoppers - results.orders - results.ended,
+        "errors": results.errors,
+        "failed_turns": results.failed_turns,
+        # In ws mode calls happen in the server process and are not counted here
+        "llm_calls": counter.calls if args.mode == "pipeline" else None,
+        "llm_calls_per_order": round(counter.calls / results.orders, 2) if results.orders and args.mode == "pipeline" else None,
+        "ws_egress": {
+            "frames": results.ws_frames, "events": results.ws_events, "bytes": results.ws_bytes
+        } if args.mode == "ws" else None,
+        "turn_latency_ms": percentiles(all_turns),
+        "agent_turn_latency_ms": {name: percentiles(samples) for name, samples in sorted(results.agent_latency.items())},
+        # Python-heap growth traced in this process (pipeline mode includes all agent state)
+        "memory": {
+            "growth_bytes": mem_after - mem_before,
+            "peak_bytes": mem_peak,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent shopper benchmark for the agent pipeline")
+    parser.add_argument("--mode", choices=["pipeline", "ws"], default="pipeline")
+    parser.add_argument("--url", default="ws://localhost:8000", help="Server base URL for --mode ws")
+    parser.add_argument("--turn-timeout", type=float, default=120.0,
+                        help="Seconds --mode ws waits for a turn to complete before failing the shopper")
+    parser.add_argument("--ws-params", default="batch=1&tool_output=none",
+                        help="Socket query string for --mode ws (empty: one event per frame, full tool outputs)")
+    parser.add_argument("--shoppers", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=0, help="Max shoppers in flight (default: all)")
+    parser.add_argument("--llm", choices=["scripted", "replay", "config"], default="scripted",
+                        help="scripted fake model, replay a cassette, or whatever ADK_LLM_BACKEND selects")
+    parser.add_argument("--cassette", default=os.getenv("ADK_LLM_CASSETTE", "llm_cassette.jsonl"))
+    parser.add_argument("--latency", default="", help="Injected LLM latency, e.g. lognormal:-1.0,0.4")
+    parser.add_argument("--rpm", type=float, default=0, help="Client-side LLM requests/min limit (0 = off)")
+    parser.add_argument("--tpm", type=float, default=0, help="Client-side LLM tokens/min limit (0 = off)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import sys
+import json
+import asyncio
+import argparse
+from typing import List, Tuple
+
+from adk.scheduler import LLMScheduler, background, current_priority, current_session, INTERACTIVE
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  LLM scheduler ordering check
+#
+#  Empties the scheduler's request bucket, queues waiters, and records the order
+#  they are admitted in as capacity refills: an interactive waiter that arrives
+#  after a background one must still go first, and sessions of one priority
+#  take turns. Exits non-zero if the order is wrong.
+#
+#    python check_scheduler.py
+# ══════════════════════════════════════════════════════════════════════════════
+
+
+async def admitted_order(waiters: List[Tuple[str, str, bool]], rpm: float) -> List[str]:
+    """Queues (label, session, is_background) waiters one after another on an empty bucket; returns labels as admitted."""
+    scheduler = LLMScheduler(requests_per_minute=rpm, tokens_per_minute=0)
+    scheduler.requests.tokens = 0
+    order: List[str] = []
+
+    async def waiter(label: str, session: str, is_background: bool) -> None:
+        current_session.set(session)
+        if is_background:
+            with background():
+                await scheduler.acquire(1)
+        else:
+            await scheduler.acquire(1)
+        order.append(label)
+
+    tasks = []
+    for label, session, is_background in waiters:
+        tasks.append(asyncio.create_task(waiter(label, session, is_background)))
+        # Let each one reach the queue before the next arrives
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def check_priority(rpm: float) -> Tuple[bool, str]:
+    order = asyncio.run(admitted_order([
+        ("background", "red_team", True),
+        ("interactive", "shopper", False),
+    ], rpm))
+    if order != ["interactive", "background"]:
+        return False, f"admitted {order}, expected the interactive waiter first"
+    return True, "an interactive waiter queued after a background one was admitted first"
+
+
+def check_round_robin(rpm: float) -> Tuple[bool, str]:
+    order = asyncio.run(admitted_order([
+        ("a1", "a", False), ("a2", "a", False), ("a3", "a", False), ("b1", "b", False),
+    ], rpm))
+    if order.index("b1") > 1:
+        return False, f"admitted {order}; session b waited behind session a's backlog"
+    return True, f"admitted {order}: session b was not starved by session a"
+
+
+def check_context_reset() -> Tuple[bool, str]:
+    with background(session="job"):
+        inside = (current_priority.get(), current_session.get())
+    outside = (current_priority.get(), current_session.get())
+    if outside != (INTERACTIVE, "default") or inside[1] != "job" or inside[0] == INTERACTIVE:
+        return False, f"inside {inside}, after the block {outside}"
+    return True, "background() sets priority and session for its block only"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Checks the LLM scheduler's priority and fairness ordering")
+    parser.add_argument("--rpm", type=float, default=1200, help="refill rate; higher runs faster")
+    args = parser.parse_args()
+
+    checks = {
+        "interactive_overtakes_background": lambda: check_priority(args.rpm),
+        "round_robin_sessions": lambda: check_round_robin(args.rpm),
+        "background_context": check_context_reset,
+    }
+    report, failed = {}, False
+    for name, check in checks.items():
+        ok, detail = check()
+        report[name] = {"ok": ok, "detail": detail}
+        failed = failed or not ok
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
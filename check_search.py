@@ -0,0 +1,76 @@
+import os
+import sys
+import copy
+import json
+import argparse
+import tempfile
+from typing import Dict, List, Tuple
+
+from mcp_servers.catalog_server import CATALOG_DB
+from mcp_servers.catalog_store import MemoryCatalogStore, SQLiteCatalogStore
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  Catalog search regression check
+#
+#  The original search_catalog was a substring match over name, description and
+#  category. Ranked search may find more, but every product the substring match
+#  found must still be found, by both catalog stores: "smart" must reach
+#  Smartwatch and Smartphone, "phone" must reach inside Smartphone. Exits
+#  non-zero on any product the baseline found that a store misses.
+#
+#    python check_search.py
+#    python check_search.py --query "gaming laptop" --query light
+# ══════════════════════════════════════════════════════════════════════════════
+
+QUERIES = [
+    "smart", "light", "phone", "watch", "pro", "drone", "camera", "audio",
+    "wireless", "gaming laptop", "case",
+]
+
+
+def baseline_search(query: str, products: List[Dict]) -> List[str]:
+    """The pre-index search_catalog: whole query or any 3+ letter word as a substring."""
+    full = query.lower().strip()
+    tokens = [t for t in full.split() if len(t) >= 3]
+    found = []
+    for product in products:
+        searchable = f"{product['name']} {product['description']} {product['category']}".lower()
+        if full in searchable or any(token in searchable for token in tokens):
+            found.append(product["id"])
+    return found
+
+
+def check_store(name: str, store, queries: List[str]) -> Tuple[bool, str]:
+    missing = {}
+    for query in queries:
+        expected = baseline_search(query, CATALOG_DB)
+        found = {p["id"] for p in store.search(query, limit=len(CATALOG_DB))}
+        lost = [pid for pid in expected if pid not in found]
+        if lost:
+            missing[query] = lost
+    if missing:
+        return False, f"{name} misses products the substring search found: {missing}"
+    return True, f"{name} finds every baseline match for {len(queries)} queries"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Checks catalog search against the original substring search")
+    parser.add_argument("--query", action="append", help="query to check (repeatable; default: built-in list)")
+    args = parser.parse_args()
+    queries = args.query or QUERIES
+
+    report, failed = {}, False
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite_store = SQLiteCatalogStore(os.path.join(tmp, "catalog.db"))
+        sqlite_store.bulk_upsert(copy.deepcopy(CATALOG_DB))
+        stores = {"memory": MemoryCatalogStore(copy.deepcopy(CATALOG_DB)), "sqlite": sqlite_store}
+        for name, store in stores.items():
+            ok, detail = check_store(name, store, queries)
+            report[name] = {"ok": ok, "detail": detail}
+            failed = failed or not ok
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
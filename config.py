@@ -1,8 +1,15 @@
 import os
+import json
+import time
+import random
+import asyncio
 import litellm
 import logging
-from litellm import completion, acompletion
 from dotenv import load_dotenv
+from adk.llm_backends import create_backend
+from adk.scheduler import LLMScheduler
+from adk.tracing import Tracer, annotate
+from adk.compaction import estimate_tokens
 
 # Load environment variables
 load_dotenv()
@@ -12,13 +19,164 @@ for name in logging.root.manager.loggerDict:
     if 'litellm' in name.lower():
         logging.getLogger(name).setLevel(logging.ERROR)
 
-# Automatically retry when hitting the free-tier rate limit
-litellm.num_retries = 3
+# Rate-limit retries are handled here (get_llm_completion / get_llm_acompletion,
+# with backoff from the provider's headers) instead of litellm's lockstep retries
+litellm.num_retries = 0
+LLM_MAX_RETRIES = int(os.getenv("ADK_LLM_MAX_RETRIES", "3"))
 
 # Standard model to use globally unless overridden
 DEFAULT_MODEL = "groq/meta-llama/llama-4-scout-17b-16e-instruct"
+# Smaller, faster model for mechanical agents and the default fallback
+FAST_MODEL = os.getenv("ADK_FAST_MODEL", "groq/llama-3.1-8b-instant")
 
-def get_llm_completion(messages, model=DEFAULT_MODEL, tools=None):
+# How long a model may take to answer (or start streaming) before the next
+# model in an agent's fallback chain is tried. The last model gets whatever
+# is left of the turn budget.
+LLM_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("ADK_LLM_ATTEMPT_TIMEOUT_SECONDS", "20"))
+
+def agent_models(agent_name, model=None, fallback_models=None):
+    """
+    Model chain for one agent: primary first, then fallbacks in order.
+    ADK_MODEL_<NAME> / ADK_FALLBACK_MODELS_<NAME> (comma separated) override
+    the agent's own settings, which default to DEFAULT_MODEL then FAST_MODEL.
+    """
+    key = agent_name.upper()
+    primary = os.getenv(f"ADK_MODEL_{key}") or model or DEFAULT_MODEL
+    env_fallbacks = os.getenv(f"ADK_FALLBACK_MODELS_{key}")
+    if env_fallbacks is not None:
+        fallbacks = [m.strip() for m in env_fallbacks.split(",") if m.strip()]
+    elif fallback_models is not None:
+        fallbacks = list(fallback_models)
+    else:
+        fallbacks = [FAST_MODEL]
+    chain = [primary]
+    for m in fallbacks:
+        if m not in chain:
+            chain.append(m)
+    return chain
+
+# Stream agent replies token-by-token to the WebSocket (set ADK_STREAM_RESPONSES=0 to disable)
+STREAM_RESPONSES = os.getenv("ADK_STREAM_RESPONSES", "1") != "0"
+
+# Upper bound on tool calls an agent with parallel_tools runs at the same time
+MAX_TOOL_CONCURRENCY = int(os.getenv("ADK_MAX_TOOL_CONCURRENCY", "4"))
+
+# Per user-message budget, shared by every agent the message reaches: LLM round-trips and wall-clock seconds
+MAX_TURN_ITERATIONS = int(os.getenv("ADK_MAX_TURN_ITERATIONS", "8"))
+TURN_TIMEOUT_SECONDS = float(os.getenv("ADK_TURN_TIMEOUT_SECONDS", "60"))
+
+# Conversation history compaction: estimated-token budget and exchanges kept verbatim
+HISTORY_TOKEN_BUDGET = int(os.getenv("ADK_HISTORY_TOKEN_BUDGET", "6000"))
+HISTORY_KEEP_EXCHANGES = int(os.getenv("ADK_HISTORY_KEEP_EXCHANGES", "4"))
+
+# Session backend: "memory" (process-local, default) or "sqlite" (ADK_SESSION_DB,
+# shared by every worker so the server can run with several uvicorn workers)
+SESSION_BACKEND = os.getenv("ADK_SESSION_BACKEND", "memory")
+SESSION_DB = os.getenv("ADK_SESSION_DB", "sessions.db")
+
+# uvicorn's worker count; more than one needs the shared session and stock backends
+WEB_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# Session store bounds (see adk/session_store.py). Evicted sessions spill to
+# ADK_SESSION_SPILL_DIR and are restored on reconnect; empty disables spilling.
+SESSION_MAX_ENTRIES = int(os.getenv("ADK_SESSION_MAX_ENTRIES", "5000"))
+SESSION_MAX_BYTES = int(os.getenv("ADK_SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_IDLE_TTL_SECONDS = float(os.getenv("ADK_SESSION_IDLE_TTL_SECONDS", "1800"))
+SESSION_SPILL_DIR = os.getenv("ADK_SESSION_SPILL_DIR", "session_spill")
+SESSION_SPILL_TTL_SECONDS = float(os.getenv("ADK_SESSION_SPILL_TTL_SECONDS", str(7 * 86400)))
+
+# Per-session inbox: turns that may wait behind the running one, and how many
+# messages sent meanwhile are merged into each; anything beyond is rejected
+SESSION_QUEUE_DEPTH = int(os.getenv("ADK_SESSION_QUEUE_DEPTH", "2"))
+SESSION_MAX_COALESCE = int(os.getenv("ADK_SESSION_MAX_COALESCE", "4"))
+
+# Turn admission (see adk/admission.py): concurrent agent turns adapt between
+# the min and max as smoothed LLM latency crosses the target; turns waiting
+# longer than the timeout, or beyond the queue limit, are shed with "busy"
+MAX_CONCURRENT_TURNS = int(os.getenv("ADK_MAX_CONCURRENT_TURNS", "16"))
+MIN_CONCURRENT_TURNS = int(os.getenv("ADK_MIN_CONCURRENT_TURNS", "2"))
+TURN_QUEUE_LIMIT = int(os.getenv("ADK_TURN_QUEUE_LIMIT", "64"))
+TURN_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADK_TURN_QUEUE_TIMEOUT_SECONDS", "15"))
+TARGET_LLM_LATENCY_SECONDS = float(os.getenv("ADK_TARGET_LLM_LATENCY_SECONDS", "3"))
+
+# Reconnect replay (see adk/event_log.py): per-session buffer of recent events,
+# bounded by count and bytes, kept this long after the session's last socket closes
+EVENT_REPLAY_EVENTS = int(os.getenv("ADK_EVENT_REPLAY_EVENTS", "1000"))
+EVENT_REPLAY_BYTES = int(os.getenv("ADK_EVENT_REPLAY_BYTES", str(256 * 1024)))
+EVENT_REPLAY_TTL_SECONDS = float(os.getenv("ADK_EVENT_REPLAY_TTL_SECONDS", "300"))
+
+# A session's inventory holds outlive its last socket this long, so a shopper
+# whose connection drops mid-checkout keeps them by reconnecting in time
+DISCONNECT_RELEASE_GRACE_SECONDS = float(os.getenv("ADK_DISCONNECT_RELEASE_GRACE_SECONDS", "60"))
+
+# Outbound WebSocket events (see adk/outbox.py): clients connecting with batch=1
+# get events queued within the window as one JSON-array frame; a socket this many
+# events behind is closed so it reconnects and resumes from the replay buffer
+WS_BATCH_WINDOW_MS = float(os.getenv("ADK_WS_BATCH_WINDOW_MS", "10"))
+WS_MAX_BATCH = int(os.getenv("ADK_WS_MAX_BATCH", "64"))
+WS_MAX_PENDING = int(os.getenv("ADK_WS_MAX_PENDING", "2000"))
+# Characters of a tool's output sent to clients that ask for tool_output=truncated
+TOOL_OUTPUT_PREVIEW_CHARS = int(os.getenv("ADK_TOOL_OUTPUT_PREVIEW_CHARS", "512"))
+
+# LLM backend: "litellm" (network), "record" (litellm + write cassette),
+# "replay" (serve cassette offline) or "scripted" (fake model, see adk/llm_backends.py)
+LLM_BACKEND = os.getenv("ADK_LLM_BACKEND", "litellm")
+LLM_CASSETTE = os.getenv("ADK_LLM_CASSETTE", "llm_cassette.jsonl")
+LLM_SCRIPT = os.getenv("ADK_LLM_SCRIPT", "")
+# Injected latency for replay/scripted backends, e.g. "lognormal:-1.0,0.4"
+LLM_LATENCY = os.getenv("ADK_LLM_LATENCY", "")
+
+# Shared HTTP connection pool for the network backend
+LLM_MAX_CONNECTIONS = int(os.getenv("ADK_LLM_MAX_CONNECTIONS", "20"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("ADK_LLM_TIMEOUT_SECONDS", "60"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("ADK_LLM_CONNECT_TIMEOUT_SECONDS", "5"))
+# HTTP/2 (needs h2) multiplexes over one connection; the pool size then does not apply
+LLM_HTTP2 = os.getenv("ADK_LLM_HTTP2", "0") == "1"
+
+llm_backend = create_backend(
+    LLM_BACKEND, cassette=LLM_CASSETTE, latency=LLM_LATENCY, script=LLM_SCRIPT,
+    max_connections=LLM_MAX_CONNECTIONS, timeout=LLM_TIMEOUT_SECONDS,
+    connect_timeout=LLM_CONNECT_TIMEOUT_SECONDS, http2=LLM_HTTP2
+)
+
+# Client-side rate limiter for async LLM calls (0 disables a limit). Defaults match the Groq free tier.
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("ADK_LLM_RPM", "30"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("ADK_LLM_TPM", "30000"))
+# Tokens reserved for the completion when estimating a request's cost up front
+LLM_COMPLETION_ALLOWANCE = 256
+
+llm_scheduler = LLMScheduler(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
+
+# Tracing (see adk/tracing.py): recent turn traces kept in memory for
+# /debug/traces; set ADK_TRACE_FILE to also append every trace to a JSONL file
+TRACE_RING_SIZE = int(os.getenv("ADK_TRACE_RING_SIZE", "500"))
+TRACE_FILE = os.getenv("ADK_TRACE_FILE", "")
+
+# /debug/* is served only when this is set, to requests sending it as X-Debug-Token
+DEBUG_TOKEN = os.getenv("ADK_DEBUG_TOKEN", "")
+
+tracer = Tracer(ring_size=TRACE_RING_SIZE, path=TRACE_FILE)
+
+async def start_llm_client():
+    """Opens the shared LLM connection pool. Called from the app's startup."""
+    if hasattr(llm_backend, "start"):
+        await llm_backend.start()
+
+async def close_llm_client():
+    """Closes the shared LLM connection pool. Called from the app's shutdown."""
+    if hasattr(llm_backend, "aclose"):
+        await llm_backend.aclose()
+
+def _retry_after(error: Exception, attempt: int) -> float:
+    """Seconds to wait after a 429: the provider's retry-after, else jittered exponential backoff."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    retry_after = headers.get("retry-after")
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return (2 ** attempt) + random.random()
+
+def get_llm_completion(messages, model=DEFAULT_MODEL, tools=None, parallel_tool_calls=False):
     """
     Wrapper for litellm.completion to ensure consistent configuration
     and full observability across all agents.
@@ -29,26 +187,75 @@ def get_llm_completion(messages, model=DEFAULT_MODEL, tools=None):
     }
     if tools:
         kwargs["tools"] = tools
-        # Disable parallel tool calls - Llama 3.3 generates malformed
+        # Parallel tool calls stay off by default - Llama 3.3 generates malformed
         # XML-style calls (<function=...>) when batching is enabled
-        kwargs["parallel_tool_calls"] = False
+        kwargs["parallel_tool_calls"] = parallel_tool_calls
 
-    response = completion(**kwargs)
-    return response
+    # Not scheduled (CLI / workflow.py), so it backs off from 429s by itself;
+    # litellm's own retries are off globally (see above)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            return llm_backend.complete(**kwargs)
+        except litellm.RateLimitError as e:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            time.sleep(_retry_after(e, attempt))
 
-async def get_llm_acompletion(messages, model=DEFAULT_MODEL, tools=None):
+async def get_llm_acompletion(messages, model=DEFAULT_MODEL, tools=None, stream=False, parallel_tool_calls=False,
+                              timeout=None):
     """
     Async wrapper for litellm.acompletion to ensure consistent configuration.
+    With stream=True the awaited result is an async iterator of delta chunks.
+    parallel_tool_calls lets agents that run tools concurrently opt back in to batching.
+    timeout bounds each provider request only (until a stream opens), never the
+    wait for rate-limit capacity; it raises asyncio.TimeoutError.
     """
     kwargs = {
         "model": model,
         "messages": messages,
     }
+    if stream:
+        kwargs["stream"] = True
+        # Ask for a final usage chunk so prompt-cache hits are still reported
+        kwargs["stream_options"] = {"include_usage": True}
     if tools:
         kwargs["tools"] = tools
-        # Disable parallel tool calls - Llama 3.3 generates malformed
+        # Parallel tool calls stay off by default - Llama 3.3 generates malformed
         # XML-style calls (<function=...>) when batching is enabled
-        kwargs["parallel_tool_calls"] = False
+        kwargs["parallel_tool_calls"] = parallel_tool_calls
+
+    estimated = estimate_tokens(messages) + LLM_COMPLETION_ALLOWANCE
+    if tools:
+        estimated += len(json.dumps(tools)) // 4
+
+    queued = 0.0
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        # Waits for rate-limit capacity; served fairly across sessions, interactive first
+        waiting = time.monotonic()
+        await llm_scheduler.acquire(estimated)
+        started = time.monotonic()
+        queued += started - waiting
+        try:
+            request = llm_backend.acomplete(**kwargs)
+            response = await (asyncio.wait_for(request, timeout) if timeout is not None else request)
+            # Provider latency only (queueing excluded) — drives turn admission
+            llm_scheduler.observe_latency(time.monotonic() - started)
+            annotate(queue_wait_ms=round(queued * 1000, 1), retries=attempt)
+            break
+        except litellm.RateLimitError as e:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            llm_scheduler.throttle(_retry_after(e, attempt))
+
+    if not stream:
+        llm_scheduler.record(estimated, response)
+        return response
 
-    response = await acompletion(**kwargs)
-    return response
+    async def reconcile():
+        # Usage arrives with the last chunk, so charge the bucket once the stream ends
+        last = None
+        async for chunk in response:
+            last = chunk
+            yield chunk
+        llm_scheduler.record(estimated, last, getattr(response, "_hidden_params", None))
+    return reconcile()
@@ -1,9 +1,15 @@
 from mcp.server.fastmcp import FastMCP
+import os
 import json
+from typing import Optional
+from mcp_servers.catalog_store import open_catalog_store
+from mcp_servers.stock_ledger import open_stock_ledger
+from mcp_servers.pricing_policy import PricingPolicy, PricingTable
 
 mcp = FastMCP("Catalog")
 
-# ── Product Catalog ────────────────────────────────────────────────────────────
+# ── Product Catalog (seed) ─────────────────────────────────────────────────────
+# Loaded into the catalog store below; tools never read this list directly.
 # Fields:
 #   mrp        – Maximum Retail Price (what the tag shows, anchor price)
 #   price      – Current selling/asking price presented to the customer
@@ -373,51 +379,66 @@ CATALOG_DB = [
     },
 ]
 
-# ── Internal pricing lookup (keyed by product id) ─────────────────────────────
-_PRICING = {p["id"]: p for p in CATALOG_DB}
+# ── Stock ledger ──────────────────────────────────────────────────────────────
+# The one place stock lives; the catalog shows its available units and the
+# inventory server reserves against it (see stock_ledger.py). The "stock" values
+# above are opening counts. ADK_STOCK_LEDGER_DIR persists it across restarts;
+# ADK_STOCK_LEDGER_DB keeps it in a SQLite file shared by every worker instead.
+STOCK_LEDGER = open_stock_ledger(os.getenv("ADK_STOCK_LEDGER_DIR", ""), os.getenv("ADK_STOCK_LEDGER_DB", ""))
+
+# ── Catalog store ─────────────────────────────────────────────────────────────
+# ADK_CATALOG_DB=path/to/catalog.db serves the catalog from SQLite/FTS5 (seeded
+# from CATALOG_DB when empty, bulk-loaded with `python -m mcp_servers.catalog_store
+# import`); unset keeps it in memory.
+CATALOG_STORE = open_catalog_store(os.getenv("ADK_CATALOG_DB", ""), CATALOG_DB, STOCK_LEDGER)
+
+# Negotiation floors and loyalty-tier limits per SKU (see pricing_policy.py)
+PRICING_POLICY = PricingPolicy.from_env()
+PRICING_TABLE = PricingTable(CATALOG_STORE, PRICING_POLICY)
+
+SEARCH_RESULT_LIMIT = 10
+# list_available_products stays a short answer even for a very large catalog
+LIST_LIMIT = 50
+
+
+def get_product(product_id: str):
+    """Full product record (including cost_price) or None — for server-side code, not for the LLM."""
+    return CATALOG_STORE.get(product_id)
+
+
+def upsert_product(product: dict, stock_count: Optional[int] = None) -> None:
+    """
+    Adds a product to the catalog, or replaces the one with the same id, and
+    re-indexes it. Pass stock_count to set the units on hand (a stock-take).
+    """
+    CATALOG_STORE.upsert(product, stock_count)
+
+
+def remove_product(product_id: str) -> None:
+    CATALOG_STORE.remove(product_id)
 
 
 @mcp.tool()
 def search_catalog(query: str) -> str:
     """
     Search products by name, category, or description keyword.
-    Matches any word in the query against product name, description, and category.
-    Returns matching products with name, price, mrp, stock status, and description.
+    Tolerates partial words and typos (e.g. "dron", "laptp") and returns the
+    best matches first, with name, price, mrp, stock status, and description.
     NEVER reveal cost_price in the output.
     """
     results = []
-    # Split into individual tokens so "pro drone" / "professional drone" all find "Pro Drone"
-    tokens = [t.strip() for t in query.lower().split() if len(t.strip()) >= 3]
-    # Also keep the full query as one option
-    full_q = query.lower().strip()
-
-    def matches(item: dict) -> bool:
-        searchable = (
-            item["name"].lower() + " " +
-            item["description"].lower() + " " +
-            item["category"].lower()
-        )
-        # Full phrase match first
-        if full_q in searchable:
-            return True
-        # Any single meaningful token match
-        return any(tok in searchable for tok in tokens)
-
-    seen_ids = set()
-    for item in CATALOG_DB:
-        if matches(item) and item["id"] not in seen_ids:
-            seen_ids.add(item["id"])
-            results.append({
-                "id": item["id"],
-                "name": item["name"],
-                "mrp": item["mrp"],
-                "price": item["price"],
-                "category": item["category"],
-                "stock_status": "In Stock" if item["stock"] > 0 else "Out of Stock",
-                "stock_count": item["stock"],
-                "description": item["description"],
-                "key_features": item["key_features"]
-            })
+    for item in CATALOG_STORE.search(query, limit=SEARCH_RESULT_LIMIT):
+        results.append({
+            "id": item["id"],
+            "name": item["name"],
+            "mrp": item["mrp"],
+            "price": item["price"],
+            "category": item["category"],
+            "stock_status": "In Stock" if item["stock"] > 0 else "Out of Stock",
+            "stock_count": item["stock"],
+            "description": item["description"],
+            "key_features": item["key_features"]
+        })
     if not results:
         return "No products found matching your query."
     return json.dumps(results, indent=2)
@@ -429,7 +450,7 @@ def get_product_details(product_id: str) -> str:
     Returns full public details of a single product including key features.
     NEVER reveals cost_price.
     """
-    item = _PRICING.get(product_id)
+    item = CATALOG_STORE.get(product_id)
     if not item:
         return "Product ID not found."
     return json.dumps({
@@ -451,54 +472,38 @@ def list_available_products() -> str:
     Returns a brief list of all available products with their selling price and stock.
     Use this if the user asks what we have for sale.
     """
-    lines = [f"• {p['name']} — Rs. {p['price']:,.0f} ({'In Stock' if p['stock'] > 0 else 'Out of Stock'})" for p in CATALOG_DB]
+    products = CATALOG_STORE.list_products(limit=LIST_LIMIT)
+    lines = [f"• {p['name']} — Rs. {p['price']:,.0f} ({'In Stock' if p['stock'] > 0 else 'Out of Stock'})" for p in products]
+    total = CATALOG_STORE.count()
+    if total > len(products):
+        lines.append(f"…and {total - len(products):,} more — search by name or category to see them.")
     return "We currently carry:\n" + "\n".join(lines)
 
 
 @mcp.tool()
 def deduct_stock(product_id: str, quantity: int = 1) -> str:
     """
-    Deducts stock for a product upon successful purchase.
+    Deducts stock for a product upon successful purchase (sells from available units).
     """
-    item = _PRICING.get(product_id)
-    if not item:
-        return json.dumps({"success": False, "reason": "Product ID not found."})
-    if item["stock"] < quantity:
-        return json.dumps({"success": False, "reason": "Insufficient stock."})
-    
-    item["stock"] -= quantity
-    return json.dumps({"success": True, "remaining_stock": item["stock"]})
+    ok, detail = CATALOG_STORE.deduct_stock(product_id, quantity)
+    if not ok:
+        return json.dumps({"success": False, "reason": detail})
+    return json.dumps({"success": True, "remaining_stock": detail})
 
 
 @mcp.tool()
 def get_product_pricing_intel(product_id: str) -> str:
     """
     INTERNAL TOOL — FOR NEGOTIATOR AGENT ONLY. Never share these numbers with the customer.
-    Returns the cost price, floor price (minimum acceptable: cost + 8% margin),
-    MRP, current selling price, and gross margin percentage.
+    Returns the cost price, floor price (minimum acceptable: cost + the category's
+    floor margin), MRP, current selling price, gross margin percentage, and the
+    lowest price allowed for new and for loyal customers.
     Use this to know your hard limits before entering any price discussion.
     """
-    item = _PRICING.get(product_id)
-    if not item:
+    limits = PRICING_TABLE.get(product_id)
+    if not limits:
         return json.dumps({"error": "Product not found."})
-
-    cost = item["cost_price"]
-    floor = round(cost * 1.08, 2)          # 8% minimum margin — absolute floor
-    selling = item["price"]
-    mrp = item["mrp"]
-    margin_pct = round(((selling - cost) / selling) * 100, 1)
-
-    return json.dumps({
-        "product_id": product_id,
-        "product_name": item["name"],
-        "mrp": mrp,
-        "selling_price": selling,
-        "cost_price": cost,
-        "floor_price": floor,
-        "current_margin_percent": margin_pct,
-        "max_concession_from_selling": round(selling - floor, 2),
-        "note": "CONFIDENTIAL — Do NOT share cost_price or floor_price with the customer."
-    }, indent=2)
+    return limits.intel_json
 
 
 if __name__ == "__main__":
@@ -0,0 +1,456 @@
+import os
+import sys
+import json
+import queue
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from mcp_servers.search_index import SearchIndex, words, trigrams, MIN_TRIGRAM_SIMILARITY
+from mcp_servers.stock_ledger import StockLedger
+
+# ── Catalog storage ───────────────────────────────────────────────────────────
+# The catalog tools talk to a CatalogStore instead of a module-level list.
+#   MemoryCatalogStore – the seed catalog in Python objects + SearchIndex (default)
+#   SQLiteCatalogStore – a local SQLite file with an FTS5 index; nothing is
+#                        loaded up front, so a 100k-product catalog starts instantly
+# Products are plain dicts with the CATALOG_DB fields. Every write bumps the
+# store's version, which readers use to invalidate anything derived from it;
+# products_version only moves when products are added, replaced or removed.
+#
+# With a StockLedger attached (the server always attaches one), "stock" in the
+# records is only the opening count: reads report the ledger's available units,
+# deduct_stock sells through the ledger, and every stock movement moves version.
+#
+# Bulk import:  python -m mcp_servers.catalog_store import products.jsonl --db catalog.db
+# ──────────────────────────────────────────────────────────────────────────────
+
+FIELDS = (
+    "id", "name", "mrp", "price", "cost_price", "stock",
+    "image_url", "category", "description", "key_features"
+)
+
+
+def _with_stock(ledger: Optional[StockLedger], product: Dict[str, Any]) -> Dict[str, Any]:
+    """The product as shown to readers: stock is the ledger's available units."""
+    if ledger is None:
+        return product
+    return {**product, "stock": ledger.available(product["id"])}
+
+
+def _count_stock(ledger: StockLedger, product: Dict[str, Any], stock_count: Optional[int]) -> None:
+    """A new SKU opens with the product's stock; a known one only moves on an explicit count."""
+    if stock_count is not None:
+        ledger.count(product["id"], stock_count)
+    else:
+        ledger.seed({product["id"]: product.get("stock", 0)})
+
+
+class MemoryCatalogStore:
+    """In-process store. Without a ledger, products are kept as the given dicts and stock changes in place."""
+    def __init__(self, products: List[Dict[str, Any]], ledger: Optional[StockLedger] = None):
+        self._products = products
+        self._by_id = {p["id"]: p for p in products}
+        self._index = SearchIndex()
+        self._index.rebuild(products)
+        self._lock = threading.Lock()
+        self.ledger = ledger
+        self._version = 0
+        self.products_version = 0
+
+    @property
+    def version(self) -> int:
+        return self._version + (self.ledger.version if self.ledger else 0)
+
+    def stock_levels(self) -> Dict[str, int]:
+        """Opening stock per product id, for seeding a ledger."""
+        return {p["id"]: p["stock"] for p in self._products}
+
+    def get(self, product_id: str) -> Optional[Dict[str, Any]]:
+        product = self._by_id.get(product_id)
+        return _with_stock(self.ledger, product) if product else None
+
+    def count(self) -> int:
+        return len(self._products)
+
+    def list_products(self, category: Optional[str] = None, after: Optional[str] = None,
+                      limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Catalog order; after is the id of the last product of the previous page (unknown id: empty)."""
+        products = self._products
+        if after is not None:
+            if after not in self._by_id:
+                return []
+            products = products[products.index(self._by_id[after]) + 1:]
+        if category:
+            products = [p for p in products if p["category"] == category]
+        return [_with_stock(self.ledger, p) for p in (products[:limit] if limit else products)]
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        return [_with_stock(self.ledger, self._by_id[pid]) for pid, _score in self._index.search(query, limit=limit)]
+
+    def deduct_stock(self, product_id: str, quantity: int) -> Tuple[bool, Any]:
+        """Returns (True, remaining_stock) or (False, reason)."""
+        if self.ledger is not None:
+            return self.ledger.sell(product_id, quantity)
+        with self._lock:
+            item = self._by_id.get(product_id)
+            if not item:
+                return False, "Product ID not found."
+            if item["stock"] < quantity:
+                return False, "Insufficient stock."
+            item["stock"] -= quantity
+            self._version += 1
+            return True, item["stock"]
+
+    def upsert(self, product: Dict[str, Any], stock_count: Optional[int] = None) -> None:
+        """
+        Adds a product, or replaces the one with the same id, and re-indexes it.
+        Stock only changes with an explicit stock_count (a stock-take): a product
+        read back from the store carries *available* units, which must not be
+        written back as units on hand.
+        """
+        if stock_count is not None and self.ledger is None:
+            product = {**product, "stock": stock_count}
+        with self._lock:
+            existing = self._by_id.get(product["id"])
+            if existing is not None:
+                self._products[self._products.index(existing)] = product
+            else:
+                self._products.append(product)
+            self._by_id[product["id"]] = product
+            self._version += 1
+            self.products_version += 1
+        self._index.add(product["id"], product)
+        if self.ledger is not None:
+            _count_stock(self.ledger, product, stock_count)
+
+    def remove(self, product_id: str) -> None:
+        with self._lock:
+            item = self._by_id.pop(product_id, None)
+            if item is None:
+                return
+            self._products.remove(item)
+            self._version += 1
+            self.products_version += 1
+        self._index.remove(product_id)
+
+
+# ── SQLite / FTS5 ─────────────────────────────────────────────────────────────
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    seq          INTEGER PRIMARY KEY,
+    id           TEXT NOT NULL UNIQUE,
+    name         TEXT NOT NULL,
+    mrp          REAL NOT NULL,
+    price        REAL NOT NULL,
+    cost_price   REAL NOT NULL,
+    stock        INTEGER NOT NULL,
+    image_url    TEXT,
+    category     TEXT NOT NULL,
+    description  TEXT,
+    key_features TEXT
+);
+CREATE INDEX IF NOT EXISTS products_category ON products(category, seq);
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    name, category, description, key_features,
+    content='products', content_rowid='seq',
+    tokenize='porter unicode61 remove_diacritics 2', prefix='2 3'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS products_vocab USING fts5vocab(products_fts, row);
+-- Substrings of 3+ characters, for words inside compounds ("phone" in Smartphone)
+CREATE VIRTUAL TABLE IF NOT EXISTS products_tri USING fts5(
+    name, category, description, key_features,
+    content='products', content_rowid='seq', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS products_ai AFTER INSERT ON products BEGIN
+    INSERT INTO products_fts(rowid, name, category, description, key_features)
+    VALUES (new.seq, new.name, new.category, new.description, new.key_features);
+END;
+CREATE TRIGGER IF NOT EXISTS products_ad AFTER DELETE ON products BEGIN
+    INSERT INTO products_fts(products_fts, rowid, name, category, description, key_features)
+    VALUES ('delete', old.seq, old.name, old.category, old.description, old.key_features);
+END;
+CREATE TRIGGER IF NOT EXISTS products_au AFTER UPDATE OF name, category, description, key_features ON products BEGIN
+    INSERT INTO products_fts(products_fts, rowid, name, category, description, key_features)
+    VALUES ('delete', old.seq, old.name, old.category, old.description, old.key_features);
+    INSERT INTO products_fts(rowid, name, category, description, key_features)
+    VALUES (new.seq, new.name, new.category, new.description, new.key_features);
+END;
+CREATE TRIGGER IF NOT EXISTS products_tri_ai AFTER INSERT ON products BEGIN
+    INSERT INTO products_tri(rowid, name, category, description, key_features)
+    VALUES (new.seq, new.name, new.category, new.description, new.key_features);
+END;
+CREATE TRIGGER IF NOT EXISTS products_tri_ad AFTER DELETE ON products BEGIN
+    INSERT INTO products_tri(products_tri, rowid, name, category, description, key_features)
+    VALUES ('delete', old.seq, old.name, old.category, old.description, old.key_features);
+END;
+CREATE TRIGGER IF NOT EXISTS products_tri_au AFTER UPDATE OF name, category, description, key_features ON products BEGIN
+    INSERT INTO products_tri(products_tri, rowid, name, category, description, key_features)
+    VALUES ('delete', old.seq, old.name, old.category, old.description, old.key_features);
+    INSERT INTO products_tri(rowid, name, category, description, key_features)
+    VALUES (new.seq, new.name, new.category, new.description, new.key_features);
+END;
+"""
+
+# Fixed statements — sqlite3 keeps each connection's compiled copies in its statement cache
+_COLUMNS = ", ".join(FIELDS)
+_SELECT_ONE = f"SELECT {_COLUMNS} FROM products WHERE id = ?"
+_SELECT_PAGE = f"SELECT {_COLUMNS} FROM products WHERE seq > ? ORDER BY seq LIMIT ?"
+_SELECT_PAGE_CATEGORY = f"SELECT {_COLUMNS} FROM products WHERE category = ? AND seq > ? ORDER BY seq LIMIT ?"
+_SEQ_OF = "SELECT seq FROM products WHERE id = ?"
+# Column weights mirror SearchIndex: name > category > description > features
+_SEARCH = f"""
+SELECT {", ".join("p." + f for f in FIELDS)}
+FROM products_fts JOIN products p ON p.seq = products_fts.rowid
+WHERE products_fts MATCH ?
+ORDER BY bm25(products_fts, 3.0, 2.0, 1.0, 0.5)
+LIMIT ?
+"""
+_SUBSTRING_SEARCH = f"""
+SELECT {", ".join("p." + f for f in FIELDS)}
+FROM products_tri JOIN products p ON p.seq = products_tri.rowid
+WHERE products_tri MATCH ?
+ORDER BY bm25(products_tri, 3.0, 2.0, 1.0, 0.5)
+LIMIT ?
+"""
+_PROBE = "SELECT 1 FROM products_fts WHERE products_fts MATCH ? LIMIT 1"
+_SUBSTRING_PROBE = "SELECT 1 FROM products_tri WHERE products_tri MATCH ? LIMIT 1"
+_VOCAB_RANGE = "SELECT term FROM products_vocab WHERE term >= ? AND term < ?"
+_UPSERT = f"""
+INSERT INTO products ({_COLUMNS}) VALUES ({", ".join("?" for _ in FIELDS)})
+ON CONFLICT(id) DO UPDATE SET {", ".join(f"{f} = excluded.{f}" for f in FIELDS if f != "id")}
+"""
+_DEDUCT = "UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ? RETURNING stock"
+
+
+def _row_to_product(row: Tuple) -> Dict[str, Any]:
+    product = dict(zip(FIELDS, row))
+    product["key_features"] = json.loads(product["key_features"] or "[]")
+    return product
+
+
+def _product_to_row(product: Dict[str, Any]) -> Tuple:
+    return tuple(
+        json.dumps(product.get(f) or []) if f == "key_features" else product.get(f)
+        for f in FIELDS
+    )
+
+
+class SQLiteCatalogStore:
+    """
+    Catalog in a SQLite file (WAL mode). Reads go through a small pool of
+    query-only connections so tool threads never share one; writes use a
+    single connection behind a lock.
+    """
+    def __init__(self, path: str, read_connections: int = 4, ledger: Optional[StockLedger] = None):
+        self.path = path
+        self.ledger = ledger
+        self._writer = self._connect()
+        had_trigrams = self._writer.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'products_tri'").fetchone() is not None
+        self._writer.executescript(_SCHEMA)
+        if not had_trigrams:
+            # A file from before the trigram index: fill it from the rows already there
+            self._writer.execute("INSERT INTO products_tri(products_tri) VALUES ('rebuild')")
+        self._write_lock = threading.Lock()
+        # Bumped by writes made through this store
+        self._version = 0
+        self.products_version = 0
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(max(1, read_connections)):
+            conn = self._connect()
+            conn.execute("PRAGMA query_only = 1")
+            self._readers.put(conn)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, cached_statements=64)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @property
+    def version(self) -> int:
+        return self._version + (self.ledger.version if self.ledger else 0)
+
+    def _product(self, row: Tuple) -> Dict[str, Any]:
+        return _with_stock(self.ledger, _row_to_product(row))
+
+    # ── Reads ─────────────────────────────────────────────────────────────────
+    def get(self, product_id: str) -> Optional[Dict[str, Any]]:
+        with self._reader() as conn:
+            row = conn.execute(_SELECT_ONE, (product_id,)).fetchone()
+        return self._product(row) if row else None
+
+    def stock_levels(self) -> Dict[str, int]:
+        """Opening stock per product id, for seeding a ledger."""
+        with self._reader() as conn:
+            return dict(conn.execute("SELECT id, stock FROM products"))
+
+    def count(self) -> int:
+        with self._reader() as conn:
+            return conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def list_products(self, category: Optional[str] = None, after: Optional[str] = None,
+                      limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Catalog (insertion) order; after is the id of the last product of the previous page (unknown id: empty)."""
+        with self._reader() as conn:
+            start = 0
+            if after is not None:
+                row = conn.execute(_SEQ_OF, (after,)).fetchone()
+                if row is None:
+                    return []
+                start = row[0]
+            limit_value = limit if limit else -1
+            if category:
+                rows = conn.execute(_SELECT_PAGE_CATEGORY, (category, start, limit_value)).fetchall()
+            else:
+                rows = conn.execute(_SELECT_PAGE, (start, limit_value)).fetchall()
+        return [self._product(r) for r in rows]
+
+    def _correct(self, conn: sqlite3.Connection, token: str) -> Optional[str]:
+        """Closest indexed term for a typo, scanning only terms with the same first letter."""
+        grams = trigrams(token)
+        best, best_score = None, MIN_TRIGRAM_SIMILARITY
+        for (term,) in conn.execute(_VOCAB_RANGE, (token[0], chr(ord(token[0]) + 1))):
+            other = trigrams(term)
+            score = 2 * len(grams & other) / (len(grams) + len(other))
+            if score > best_score:
+                best, best_score = term, score
+        return best
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        tokens = list(dict.fromkeys(words(query)))
+        if not tokens:
+            return []
+        with self._reader() as conn:
+            terms, substrings = [], []
+            for token in tokens:
+                # Prefix match ("dron" -> drone), then a substring inside a compound
+                # ("phone" -> Smartphone), then a typo correction
+                if len(token) < 3:
+                    continue
+                if conn.execute(_PROBE, (f'"{token}"*',)).fetchone() is not None:
+                    terms.append(f'"{token}"*')
+                elif conn.execute(_SUBSTRING_PROBE, (f'"{token}"',)).fetchone() is not None:
+                    substrings.append(f'"{token}"')
+                elif len(token) >= 4:
+                    corrected = self._correct(conn, token)
+                    if corrected:
+                        terms.append(f'"{corrected}"')
+            rows = conn.execute(_SEARCH, (" OR ".join(terms), limit)).fetchall() if terms else []
+            if substrings and len(rows) < limit:
+                # Substring hits rank after word matches, as prefix/typo expansions do in SearchIndex
+                seen = {row[0] for row in rows}
+                for row in conn.execute(_SUBSTRING_SEARCH, (" OR ".join(substrings), limit)):
+                    if row[0] not in seen and len(rows) < limit:
+                        rows.append(row)
+        return [self._product(r) for r in rows]
+
+    # ── Writes ────────────────────────────────────────────────────────────────
+    def deduct_stock(self, product_id: str, quantity: int) -> Tuple[bool, Any]:
+        """Returns (True, remaining_stock) or (False, reason). The check and update are one statement."""
+        if self.ledger is not None:
+            return self.ledger.sell(product_id, quantity)
+        with self._write_lock:
+            row = self._writer.execute(_DEDUCT, (quantity, product_id, quantity)).fetchone()
+            if row is not None:
+                self._version += 1
+                return True, row[0]
+            exists = self._writer.execute(_SEQ_OF, (product_id,)).fetchone()
+        return False, "Insufficient stock." if exists else "Product ID not found."
+
+    def upsert(self, product: Dict[str, Any], stock_count: Optional[int] = None) -> None:
+        """Adds or replaces a product; stock only changes with an explicit stock_count (see MemoryCatalogStore.upsert)."""
+        if stock_count is not None and self.ledger is None:
+            product = {**product, "stock": stock_count}
+        self.bulk_upsert([product])
+        if self.ledger is not None:
+            _count_stock(self.ledger, product, stock_count)
+
+    def bulk_upsert(self, products: Iterable[Dict[str, Any]], batch_size: int = 5000) -> int:
+        """Inserts or replaces products in batched transactions; returns how many were written."""
+        written = 0
+        batch: List[Tuple] = []
+        with self._write_lock:
+            for product in products:
+                batch.append(_product_to_row(product))
+                if len(batch) >= batch_size:
+                    written += self._write_batch(batch)
+                    batch = []
+            if batch:
+                written += self._write_batch(batch)
+        return written
+
+    def _write_batch(self, rows: List[Tuple]) -> int:
+        self._writer.execute("BEGIN")
+        try:
+            self._writer.executemany(_UPSERT, rows)
+            self._writer.execute("COMMIT")
+            self._version += 1
+            self.products_version += 1
+        except Exception:
+            self._writer.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def remove(self, product_id: str) -> None:
+        with self._write_lock:
+            self._writer.execute("DELETE FROM products WHERE id = ?", (product_id,))
+            self._version += 1
+            self.products_version += 1
+
+
+def open_catalog_store(path: str, seed: List[Dict[str, Any]], ledger: Optional[StockLedger] = None):
+    """
+    SQLite store at path (seeded when empty), or the in-memory store over seed
+    when path is empty. Products the ledger has not seen yet open at their stock.
+    """
+    if not path:
+        store = MemoryCatalogStore(seed, ledger)
+    else:
+        store = SQLiteCatalogStore(path, ledger=ledger)
+        if store.count() == 0:
+            store.bulk_upsert(seed)
+    if ledger is not None:
+        ledger.seed(store.stock_levels())
+    return store
+
+
+# ── Bulk import CLI ───────────────────────────────────────────────────────────
+def _read_products(path: str) -> Iterator[Dict[str, Any]]:
+    """A .json file holding a list of products, or .jsonl with one product per line."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Catalog store maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    importer = sub.add_parser("import", help="bulk-load products from .json / .jsonl")
+    importer.add_argument("source")
+    importer.add_argument("--db", default=os.getenv("ADK_CATALOG_DB") or "catalog.db")
+    importer.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    store = SQLiteCatalogStore(args.db)
+    written = store.bulk_upsert(_read_products(args.source), batch_size=args.batch_size)
+    print(f"Imported {written} products into {args.db} ({store.count()} total)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
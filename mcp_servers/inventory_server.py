@@ -1,18 +1,34 @@
 from mcp.server.fastmcp import FastMCP
+import os
 import json
+from adk.scheduler import current_session
+from mcp_servers.inventory_store import InventoryStore
+from mcp_servers.catalog_server import STOCK_LEDGER
 
 mcp = FastMCP("Inventory")
 
-# Mock Inventory DB
-INVENTORY_DB = {
-    "p1": {"stock": 10, "reserved": 2},
-    "p2": {"stock": 50, "reserved": 0},
-    "p3": {"stock": 3,  "reserved": 3},   # Out of stock (all reserved)
-    "p4": {"stock": 100, "reserved": 5},
-    "p5": {"stock": 8,  "reserved": 1},   # Pro OLED Monitor
-    "p6": {"stock": 25, "reserved": 3},   # Titanium Smartwatch
-    "p7": {"stock": 40, "reserved": 0},   # Noise Cancelling Earbuds
-}
+# Unpaid reservations go back on sale after this long (abandoned checkouts)
+RESERVATION_TTL_SECONDS = float(os.getenv("ADK_RESERVATION_TTL_SECONDS", "900"))
+
+# Reservations against the same stock ledger the catalog reads, so both agree
+INVENTORY = InventoryStore(STOCK_LEDGER, default_ttl=RESERVATION_TTL_SECONDS)
+
+
+def release_session_reservations(session_id: str) -> int:
+    """Releases every reservation a session still holds; returns how many."""
+    released = INVENTORY.release_owner(session_id)
+    if released:
+        print(f"[Inventory] Released {released} reservation(s) held by {session_id}")
+    return released
+
+
+def commit_session_reservation(session_id: str, product_id: str) -> int:
+    """Marks the session's reservation for product_id as sold (called once payment succeeds); returns units sold."""
+    for reservation_id in INVENTORY.owned_by(session_id, product_id):
+        items = INVENTORY.commit(reservation_id)
+        if items:
+            return items.get(product_id, 0)
+    return 0
 
 @mcp.tool()
 def check_stock(product_id: str) -> str:
@@ -20,10 +36,10 @@ def check_stock(product_id: str) -> str:
     Real-time check to see how many units of a given product are currently available.
     Available = stock - reserved.
     """
-    if product_id not in INVENTORY_DB:
+    item = INVENTORY.get(product_id)
+    if item is None:
         return json.dumps({"error": "Product not found in inventory system."})
-        
-    item = INVENTORY_DB[product_id]
+
     available = item["stock"] - item["reserved"]
     
     return json.dumps({
@@ -38,18 +54,32 @@ def check_stock(product_id: str) -> str:
 def reserve_inventory(product_id: str, quantity: int) -> str:
     """
     Temporarily reserves inventory during the validation/negotiation phase to prevent overselling.
+    The hold expires automatically if checkout is not completed in time.
     """
-    if product_id not in INVENTORY_DB:
-        return json.dumps({"success": False, "reason": "Item not found"})
-        
-    item = INVENTORY_DB[product_id]
-    available = item["stock"] - item["reserved"]
-    
-    if available >= quantity:
-        INVENTORY_DB[product_id]["reserved"] += quantity
-        return json.dumps({"success": True, "reserved_quantity": quantity})
-    else:
-        return json.dumps({"success": False, "reason": "Insufficient stock"})
+    reservation_id, reason = INVENTORY.reserve(product_id, quantity, owner=current_session.get())
+    if reservation_id:
+        return json.dumps({
+            "success": True,
+            "reserved_quantity": quantity,
+            "reservation_id": reservation_id,
+            "expires_in_seconds": RESERVATION_TTL_SECONDS
+        })
+    return json.dumps({"success": False, "reason": reason})
+
+@mcp.tool()
+def reserve_inventory_batch(items: str) -> str:
+    """
+    Reserves several products at once, all or nothing.
+    items is a JSON object mapping product_id to quantity, e.g. {"p1": 1, "p7": 2}.
+    """
+    try:
+        requested = {str(k): int(v) for k, v in json.loads(items).items()}
+    except (ValueError, TypeError, AttributeError):
+        return json.dumps({"success": False, "reason": "items must be a JSON object of product_id -> quantity"})
+    reservation_id, failures = INVENTORY.reserve_many(requested, owner=current_session.get())
+    if reservation_id:
+        return json.dumps({"success": True, "reserved": requested, "reservation_id": reservation_id})
+    return json.dumps({"success": False, "failures": failures})
 
 if __name__ == "__main__":
     mcp.run()
@@ -0,0 +1,147 @@
+import time
+import heapq
+import uuid
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+from mcp_servers.stock_ledger import StockLedger, SQLiteStockLedger
+
+# ── Inventory store ───────────────────────────────────────────────────────────
+# Reservations on top of the shared StockLedger, which owns the counters and
+# their per-SKU locking (see stock_ledger.py). This class adds what sessions
+# need: reservation ids, an owner index and expiry.
+#
+# Every reservation has an id, an owner (the session that made it) and an
+# expiry. Expiries sit in a min-heap, so the sweeper pops only what is due —
+# O(log n) per reservation, never a scan. Released or committed reservations
+# leave stale heap entries behind that are skipped when they surface. Holds
+# recovered by a persistent ledger after a restart are indexed again on start.
+# A shared ledger (SQLiteStockLedger) indexes holds itself, so holds made by
+# other workers are found too; the local indexes are then left empty.
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+class InventoryStore:
+    """Views a StockLedger as {"stock": int, "reserved": int} records; available = stock - reserved."""
+    def __init__(self, ledger: Union[StockLedger, SQLiteStockLedger], default_ttl: float = 900.0):
+        self.ledger = ledger
+        self.default_ttl = default_ttl
+        self._by_owner: Dict[str, Set[str]] = {}
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._res_lock = threading.Lock()
+        self.expired = 0
+        if not ledger.shared:
+            for reservation_id, hold in ledger.holds().items():
+                self._index(reservation_id, hold["owner"], hold["expires_at"])
+
+    def get(self, product_id: str) -> Optional[Dict[str, int]]:
+        """A consistent copy of one record."""
+        return self.ledger.get(product_id)
+
+    def _index(self, reservation_id: str, owner: str, expires_at: Optional[float]) -> None:
+        if self.ledger.shared:
+            return
+        with self._res_lock:
+            self._by_owner.setdefault(owner, set()).add(reservation_id)
+            if expires_at is not None:
+                heapq.heappush(self._expiry_heap, (expires_at, reservation_id))
+
+    # ── Reserve ───────────────────────────────────────────────────────────────
+    def reserve(self, product_id: str, quantity: int, owner: str = "default",
+                ttl: Optional[float] = None) -> Tuple[Optional[str], Optional[str]]:
+        """Returns (reservation_id, None) or (None, reason)."""
+        reservation_id, failures = self.reserve_many({product_id: quantity}, owner, ttl)
+        return reservation_id, failures.get(product_id)
+
+    def reserve_many(self, items: Dict[str, int], owner: str = "default",
+                     ttl: Optional[float] = None) -> Tuple[Optional[str], Dict[str, str]]:
+        """
+        Reserves every SKU in items or none of them, for ttl seconds (<= 0:
+        until released). Returns (reservation_id, {}) or (None, {product_id: reason})
+        for the lines that could not be met.
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        reservation_id = f"res_{uuid.uuid4().hex[:12]}"
+        expires_at = time.time() + ttl if ttl > 0 else None
+        failures = self.ledger.reserve(reservation_id, items, owner, expires_at)
+        if failures:
+            return None, failures
+        self._index(reservation_id, owner, expires_at)
+        return reservation_id, {}
+
+    # ── Release / commit ──────────────────────────────────────────────────────
+    def _forget(self, reservation_id: str, owner: str) -> None:
+        with self._res_lock:
+            owned = self._by_owner.get(owner)
+            if owned is not None:
+                owned.discard(reservation_id)
+                if not owned:
+                    del self._by_owner[owner]
+
+    def _settle(self, reservation_id: str, sold: bool) -> Optional[Dict[str, int]]:
+        """Drops a reservation; its units go back on sale, or out of stock when sold."""
+        hold = self.ledger.hold(reservation_id)
+        if hold is None:
+            return None
+        items = self.ledger.commit(reservation_id) if sold else self.ledger.release(reservation_id)
+        if items is not None:
+            self._forget(reservation_id, hold["owner"])
+        return items
+
+    def release(self, reservation_id: str) -> bool:
+        """Returns the reservation's units to sale. False if it no longer exists."""
+        return self._settle(reservation_id, sold=False) is not None
+
+    def commit(self, reservation_id: str) -> Optional[Dict[str, int]]:
+        """Turns a reservation into a sale: the units leave stock for good. Returns the items sold."""
+        return self._settle(reservation_id, sold=True)
+
+    def owned_by(self, owner: str, product_id: Optional[str] = None) -> List[str]:
+        if self.ledger.shared:
+            ids = self.ledger.owned_by(owner)
+        else:
+            with self._res_lock:
+                ids = list(self._by_owner.get(owner, ()))
+        if product_id is not None:
+            ids = [rid for rid in ids if product_id in (self.ledger.hold(rid) or {}).get("items", {})]
+        return ids
+
+    def release_owner(self, owner: str) -> int:
+        """Releases everything a session still holds (reset, disconnect, abandoned deal)."""
+        return sum(self.release(rid) for rid in self.owned_by(owner))
+
+    # ── Expiry ────────────────────────────────────────────────────────────────
+    def next_expiry(self) -> Optional[float]:
+        if self.ledger.shared:
+            return self.ledger.next_expiry()
+        with self._res_lock:
+            return self._expiry_heap[0][0] if self._expiry_heap else None
+
+    def expire_due(self, now: Optional[float] = None) -> List[str]:
+        """Releases every reservation whose expiry has passed; returns their ids."""
+        now = time.time() if now is None else now
+        due = self.ledger.due(now) if self.ledger.shared else []
+        with self._res_lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expires_at, reservation_id = heapq.heappop(self._expiry_heap)
+                hold = self.ledger.hold(reservation_id)
+                # Stale entry: already released or committed
+                if hold is not None and hold["expires_at"] == expires_at:
+                    due.append(reservation_id)
+        released = [rid for rid in due if self.release(rid)]
+        self.expired += len(released)
+        return released
+
+    def metrics(self) -> Dict[str, Any]:
+        open_holds = self.ledger.metrics()["open_holds"]
+        with self._res_lock:
+            return {
+                "active_reservations": open_holds,
+                "owners": len(self._by_owner),
+                "heap_entries": len(self._expiry_heap),
+                "expired": self.expired,
+            }
+
+    def totals(self) -> Dict[str, Any]:
+        """Point-in-time sums across all SKUs."""
+        return self.ledger.totals()
@@ -0,0 +1,131 @@
+import os
+import json
+import threading
+from typing import Any, Dict, NamedTuple, Optional
+
+# ── Pricing policy ────────────────────────────────────────────────────────────
+# Negotiation limits per SKU, computed on first use and cached:
+#   floor      = cost_price × (1 + floor margin of the product's category)
+#   tier floor = max(floor, selling_price × (1 - loyalty discount))
+# A row is computed from one get_product lookup and kept until the catalog's
+# products or the policy change, so a large catalog is never read whole; tools
+# and validators read rows directly.
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Max discount off the selling price by customer tier (see the negotiator prompt)
+LOYALTY_DISCOUNTS = {"new": 0.02, "loyal": 0.05}
+
+
+def customer_tier(lifetime_value: float) -> str:
+    return "loyal" if lifetime_value > 0 else "new"
+
+
+def _parse_margins(spec: str) -> Dict[str, float]:
+    """"Accessories=0.12,Audio=0.10" -> {"Accessories": 0.12, "Audio": 0.10}"""
+    margins = {}
+    for part in spec.split(","):
+        category, _, margin = part.partition("=")
+        if category.strip() and margin.strip():
+            margins[category.strip()] = float(margin)
+    return margins
+
+
+class PricingPolicy:
+    def __init__(self, floor_margin: float = 0.08, category_floor_margins: Optional[Dict[str, float]] = None,
+                 loyalty_discounts: Optional[Dict[str, float]] = None):
+        self.floor_margin = floor_margin
+        self.category_floor_margins = dict(category_floor_margins or {})
+        self.loyalty_discounts = dict(loyalty_discounts or LOYALTY_DISCOUNTS)
+        self.version = 0
+
+    @classmethod
+    def from_env(cls) -> "PricingPolicy":
+        return cls(
+            floor_margin=float(os.getenv("ADK_FLOOR_MARGIN", "0.08")),
+            category_floor_margins=_parse_margins(os.getenv("ADK_CATEGORY_FLOOR_MARGINS", ""))
+        )
+
+    def margin_for(self, category: str) -> float:
+        return self.category_floor_margins.get(category, self.floor_margin)
+
+    def update(self, floor_margin: Optional[float] = None, category_floor_margins: Optional[Dict[str, float]] = None,
+               loyalty_discounts: Optional[Dict[str, float]] = None) -> None:
+        """Changes the policy; every SKU's limits are recomputed on their next read."""
+        if floor_margin is not None:
+            self.floor_margin = floor_margin
+        if category_floor_margins is not None:
+            self.category_floor_margins = dict(category_floor_margins)
+        if loyalty_discounts is not None:
+            self.loyalty_discounts = dict(loyalty_discounts)
+        self.version += 1
+
+
+class PriceLimits(NamedTuple):
+    product_id: str
+    name: str
+    mrp: float
+    selling_price: float
+    cost_price: float
+    floor_price: float
+    tier_floors: Dict[str, float]
+    intel_json: str          # get_product_pricing_intel's answer, serialised once
+
+    def lowest_price(self, tier: str) -> float:
+        return self.tier_floors.get(tier, self.floor_price)
+
+
+class PricingTable:
+    """Per-SKU PriceLimits for a catalog store, cached until (products version, policy version) moves."""
+    def __init__(self, store: Any, policy: PricingPolicy):
+        self.store = store
+        self.policy = policy
+        self._rows: Dict[str, PriceLimits] = {}
+        self._built_for: Optional[tuple] = None
+        self._lock = threading.Lock()
+
+    def _limits(self, product: Dict[str, Any]) -> PriceLimits:
+        cost = product["cost_price"]
+        selling = product["price"]
+        margin = self.policy.margin_for(product["category"])
+        floor = round(cost * (1 + margin), 2)
+        tier_floors = {
+            tier: max(floor, round(selling * (1 - discount), 2))
+            for tier, discount in self.policy.loyalty_discounts.items()
+        }
+        intel = {
+            "product_id": product["id"],
+            "product_name": product["name"],
+            "mrp": product["mrp"],
+            "selling_price": selling,
+            "cost_price": cost,
+            "floor_price": floor,
+            "floor_margin_percent": round(margin * 100, 1),
+            "current_margin_percent": round(((selling - cost) / selling) * 100, 1),
+            "max_concession_from_selling": round(selling - floor, 2),
+            "lowest_price_new_customer": tier_floors.get("new", floor),
+            "lowest_price_loyal_customer": tier_floors.get("loyal", floor),
+            "note": "CONFIDENTIAL — Do NOT share cost_price or floor_price with the customer."
+        }
+        return PriceLimits(
+            product["id"], product["name"], product["mrp"], selling, cost, floor, tier_floors,
+            json.dumps(intel)
+        )
+
+    def get(self, product_id: str) -> Optional[PriceLimits]:
+        key = (self.store.products_version, self.policy.version)
+        with self._lock:
+            if key != self._built_for:
+                # Only SKUs read since the last change are cached; drop them all
+                self._rows = {}
+                self._built_for = key
+            limits = self._rows.get(product_id)
+        if limits is not None:
+            return limits
+        product = self.store.get(product_id)
+        if product is None:
+            return None
+        limits = self._limits(product)
+        with self._lock:
+            if key == self._built_for:
+                self._rows[product_id] = limits
+        return limits
@@ -0,0 +1,198 @@
+import re
+import math
+import bisect
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# ── Catalog search index ──────────────────────────────────────────────────────
+# Inverted index over the product catalog, built once and updated per product.
+# Query terms are matched exactly (after stemming), by prefix ("dron" → "drone",
+# "smart" → "smartwatch") and by trigram similarity for typos ("laptp" →
+# "laptop"); expansions always apply, scoring below an exact match.
+# Hits are ranked with BM25, with name and category weighted above description.
+# ──────────────────────────────────────────────────────────────────────────────
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Filler words shoppers type around the product they want
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "with", "is", "are",
+    "i", "me", "my", "you", "your", "we", "it", "do", "does", "have", "has", "any",
+    "some", "something", "show", "want", "need", "looking", "buy", "get", "please",
+    "what", "which", "can", "like", "would",
+}
+
+# Field weights: a word in the product name counts three times a description word
+DEFAULT_FIELDS = {"name": 3.0, "category": 2.0, "description": 1.0, "key_features": 0.5}
+
+PREFIX_PENALTY = 0.8        # prefix expansions score below exact matches
+MIN_TRIGRAM_SIMILARITY = 0.5
+
+
+def stem(word: str) -> str:
+    """Light suffix stripping so "drones", "batteries" and "switches" meet their singular form."""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("sses"):
+        return word[:-2]
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "xes")):
+        return word[:-2]
+    if word.endswith("ing") and len(word) > 5:
+        return word[:-3]
+    if word.endswith("ed") and len(word) > 4:
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def words(text: str) -> List[str]:
+    """Lowercased words of text without stopwords, unstemmed."""
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def tokenize(text: str) -> List[str]:
+    return [stem(t) for t in words(text)]
+
+
+def trigrams(term: str) -> Set[str]:
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    BM25 inverted index. add / remove keep it current as products change;
+    search is safe to call from the engine's tool threads.
+    """
+    def __init__(self, fields: Optional[Dict[str, float]] = None, k1: float = 1.2, b: float = 0.75):
+        self.fields = fields or DEFAULT_FIELDS
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, float]] = defaultdict(dict)   # term -> doc -> weighted tf
+        self._doc_terms: Dict[str, Dict[str, float]] = {}
+        self._doc_len: Dict[str, float] = {}
+        self._total_len = 0.0
+        self._trigrams: Dict[str, Set[str]] = defaultdict(set)            # trigram -> terms
+        self._vocab: List[str] = []                                       # sorted, for prefix lookups
+        self._vocab_dirty = False
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def _field_text(self, value: Any) -> str:
+        if isinstance(value, (list, tuple)):
+            return " ".join(str(v) for v in value)
+        return str(value or "")
+
+    # ── Maintenance ───────────────────────────────────────────────────────────
+    def add(self, doc_id: str, doc: Dict[str, Any]) -> None:
+        """Indexes (or re-indexes) one document."""
+        terms: Dict[str, float] = defaultdict(float)
+        for field, weight in self.fields.items():
+            for term in tokenize(self._field_text(doc.get(field))):
+                terms[term] += weight
+
+        with self._lock:
+            self.remove(doc_id)
+            for term, tf in terms.items():
+                if term not in self._postings:
+                    self._vocab_dirty = True
+                    for gram in trigrams(term):
+                        self._trigrams[gram].add(term)
+                self._postings[term][doc_id] = tf
+            self._doc_terms[doc_id] = dict(terms)
+            self._doc_len[doc_id] = sum(terms.values())
+            self._total_len += self._doc_len[doc_id]
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            terms = self._doc_terms.pop(doc_id, None)
+            if terms is None:
+                return
+            self._total_len -= self._doc_len.pop(doc_id)
+            for term in terms:
+                docs = self._postings[term]
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self._postings[term]
+                    self._vocab_dirty = True
+                    for gram in trigrams(term):
+                        self._trigrams[gram].discard(term)
+
+    def rebuild(self, docs: Iterable[Dict[str, Any]], id_field: str = "id") -> None:
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_len.clear()
+            self._total_len = 0.0
+            self._trigrams.clear()
+            self._vocab_dirty = True
+            for doc in docs:
+                self.add(doc[id_field], doc)
+
+    # ── Query ─────────────────────────────────────────────────────────────────
+    def _expand(self, term: str) -> List[Tuple[str, float]]:
+        """
+        Index terms standing in for one query term, with a match-quality factor:
+        the term itself, then every longer term it prefixes and every close
+        spelling, all below an exact match. "smart" keeps its own hits and also
+        reaches "smartwatch" and "smartphone".
+        """
+        expansions: List[Tuple[str, float]] = [(term, 1.0)] if term in self._postings else []
+
+        if self._vocab_dirty:
+            self._vocab = sorted(self._postings)
+            self._vocab_dirty = False
+        if len(term) >= 3:
+            i = bisect.bisect_left(self._vocab, term)
+            while i < len(self._vocab) and self._vocab[i].startswith(term):
+                if self._vocab[i] != term:
+                    expansions.append((self._vocab[i], PREFIX_PENALTY))
+                i += 1
+        if len(term) < 4:
+            return expansions
+
+        # Typo tolerance: Dice similarity over padded trigrams
+        expanded = {candidate for candidate, _quality in expansions}
+        grams = trigrams(term)
+        shared: Dict[str, int] = defaultdict(int)
+        for gram in grams:
+            for candidate in self._trigrams.get(gram, ()):
+                if candidate not in expanded:
+                    shared[candidate] += 1
+        for candidate, count in shared.items():
+            similarity = 2 * count / (len(grams) + len(trigrams(candidate)))
+            if similarity >= MIN_TRIGRAM_SIMILARITY:
+                expansions.append((candidate, PREFIX_PENALTY * similarity))
+        return expansions
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """Returns up to limit (doc_id, score) pairs, best first."""
+        with self._lock:
+            n = len(self._doc_len)
+            if n == 0:
+                return []
+            avg_len = self._total_len / n
+            scores: Dict[str, float] = defaultdict(float)
+
+            for term in dict.fromkeys(tokenize(query)):
+                # Best expansion per document, so one fuzzy term cannot score twice
+                best: Dict[str, float] = {}
+                for index_term, quality in self._expand(term):
+                    docs = self._postings[index_term]
+                    idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for doc_id, tf in docs.items():
+                        norm = tf + self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avg_len)
+                        score = quality * idf * tf * (self.k1 + 1) / norm
+                        if score > best.get(doc_id, 0.0):
+                            best[doc_id] = score
+                for doc_id, score in best.items():
+                    scores[doc_id] += score
+
+        ranked = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
+        return ranked[:limit]
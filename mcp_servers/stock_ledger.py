@@ -0,0 +1,511 @@
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# ── Stock ledger ──────────────────────────────────────────────────────────────
+# The single source of truth for stock. Every movement is an entry appended to
+# the ledger; the current position is kept as materialised counters, so
+# reserve / commit / release / sell are O(1) dictionary updates:
+#   stock     – units on hand (physically in the store)
+#   reserved  – units held by open reservations (unpaid checkouts)
+#   available = stock - reserved   (what the catalog shows and can be sold)
+# The catalog and inventory servers both read these counters.
+#
+# Persistence (optional, ADK_STOCK_LEDGER_DIR): entries go to an append-only
+# WAL (stock.wal, JSON lines). Every `snapshot_every` entries the counters and
+# open holds are written to stock.snapshot.json and the WAL is truncated, so a
+# restart loads one snapshot and replays at most that many entries.
+#
+# Locking: SKUs hash onto striped locks; multi-SKU entries take their stripes in
+# index order. Entries are applied under their stripes only; a short log lock
+# then numbers and writes them. Both happen before the stripes are released, so
+# the log order of any one SKU matches the order its counters changed.
+#
+# StockLedger lives in one process. SQLiteStockLedger (ADK_STOCK_LEDGER_DB) keeps
+# the same counters and holds in a SQLite file that every uvicorn worker opens:
+# each movement is one transaction whose conditional UPDATE (stock - reserved
+# >= quantity) is the availability check, so workers cannot oversell between
+# them. It also indexes holds by owner and expiry, which InventoryStore would
+# otherwise keep per process.
+# ──────────────────────────────────────────────────────────────────────────────
+
+SNAPSHOT_FILE = "stock.snapshot.json"
+WAL_FILE = "stock.wal"
+
+
+class StockLedger:
+    # Counters and holds are private to this process
+    shared = False
+
+    def __init__(self, path: Optional[str] = None, stripes: int = 64, snapshot_every: int = 10000):
+        self.path = path
+        self.snapshot_every = max(1, snapshot_every)
+        self._stock: Dict[str, int] = {}
+        self._reserved: Dict[str, int] = {}
+        self._holds: Dict[str, Dict[str, Any]] = {}   # reservation id -> {items, owner, expires_at}
+        self._locks = [threading.Lock() for _ in range(max(1, stripes))]
+        self._log_lock = threading.Lock()
+        self.seq = 0                                  # last entry applied
+        self._since_snapshot = 0
+        self._wal = None
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._recover()
+            self._wal = open(os.path.join(path, WAL_FILE), "a", encoding="utf-8")
+
+    @property
+    def version(self) -> int:
+        """Moves with every entry; readers use it to invalidate anything showing stock."""
+        return self.seq
+
+    # ── Locking ───────────────────────────────────────────────────────────────
+    def _stripe(self, product_id: str) -> int:
+        return hash(product_id) % len(self._locks)
+
+    def _acquire(self, product_ids: Iterable[str]) -> List[threading.Lock]:
+        locks = [self._locks[i] for i in sorted({self._stripe(pid) for pid in product_ids})]
+        for lock in locks:
+            lock.acquire()
+        return locks
+
+    @staticmethod
+    def _release_locks(locks: List[threading.Lock]) -> None:
+        for lock in reversed(locks):
+            lock.release()
+
+    # ── Entries ───────────────────────────────────────────────────────────────
+    def _apply(self, entry: Dict[str, Any]) -> None:
+        """Applies one entry to the counters; shared by live writes and WAL replay."""
+        op = entry["op"]
+        if op == "seed":
+            for product_id, quantity in entry["stock"].items():
+                self._stock.setdefault(product_id, quantity)
+                self._reserved.setdefault(product_id, 0)
+        elif op == "count":
+            self._stock[entry["product_id"]] = entry["quantity"]
+            self._reserved.setdefault(entry["product_id"], 0)
+        elif op == "sell":
+            self._stock[entry["product_id"]] -= entry["quantity"]
+        elif op == "reserve":
+            for product_id, quantity in entry["items"].items():
+                self._reserved[product_id] += quantity
+            self._holds[entry["ref"]] = {
+                "items": entry["items"], "owner": entry["owner"], "expires_at": entry["expires_at"]
+            }
+        elif op in ("release", "commit"):
+            hold = self._holds.pop(entry["ref"], None)
+            if hold is None:
+                return
+            for product_id, quantity in hold["items"].items():
+                self._reserved[product_id] -= quantity
+                if op == "commit":
+                    self._stock[product_id] -= quantity
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        """
+        Applies and logs an entry. Callers hold the stripes of every SKU it
+        touches, which is all applying needs; the log lock only orders the WAL.
+        """
+        self._apply(entry)
+        with self._log_lock:
+            self.seq += 1
+            entry["seq"] = self.seq
+            if self._wal is not None:
+                self._wal.write(json.dumps(entry, separators=(",", ":")) + "\n")
+                self._wal.flush()
+                self._since_snapshot += 1
+
+    def _maybe_checkpoint(self) -> None:
+        if self._wal is not None and self._since_snapshot >= self.snapshot_every:
+            self.checkpoint(min_entries=self.snapshot_every)
+
+    # ── Reads ─────────────────────────────────────────────────────────────────
+    def get(self, product_id: str) -> Optional[Dict[str, int]]:
+        """{"stock", "reserved"} for one SKU, or None if the ledger has never seen it."""
+        with self._locks[self._stripe(product_id)]:
+            if product_id not in self._stock:
+                return None
+            return {"stock": self._stock[product_id], "reserved": self._reserved[product_id]}
+
+    def available(self, product_id: str) -> int:
+        # Two dict reads; a torn read can only be off by one in-flight movement
+        return self._stock.get(product_id, 0) - self._reserved.get(product_id, 0)
+
+    def hold(self, reservation_id: str) -> Optional[Dict[str, Any]]:
+        return self._holds.get(reservation_id)
+
+    def holds(self) -> Dict[str, Dict[str, Any]]:
+        """A copy of every open hold (used to rebuild reservation indexes after a restart)."""
+        # list() snapshots the items atomically; holds may come and go meanwhile
+        return {rid: dict(hold) for rid, hold in list(self._holds.items())}
+
+    def totals(self) -> Dict[str, int]:
+        """Point-in-time sums across all SKUs, taking every stripe."""
+        locks = self._acquire(self._stock)
+        try:
+            return {"stock": sum(self._stock.values()), "reserved": sum(self._reserved.values())}
+        finally:
+            self._release_locks(locks)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "seq": self.seq,
+            "skus": len(self._stock),
+            "open_holds": len(self._holds),
+            "wal_entries": self._since_snapshot,
+            "persistent": self._wal is not None,
+        }
+
+    # ── Movements ─────────────────────────────────────────────────────────────
+    def seed(self, stock: Dict[str, int]) -> int:
+        """Opening counts for SKUs the ledger has not seen yet; known SKUs keep their position."""
+        # Two racing seeds of one SKU are harmless: applying a seed never overwrites
+        new = {pid: int(qty) for pid, qty in stock.items() if pid not in self._stock}
+        if new:
+            locks = self._acquire(new)
+            try:
+                self._append({"op": "seed", "stock": new})
+            finally:
+                self._release_locks(locks)
+            self._maybe_checkpoint()
+        return len(new)
+
+    def count(self, product_id: str, quantity: int) -> None:
+        """Stock-take: sets the units on hand (open holds are unaffected)."""
+        with self._locks[self._stripe(product_id)]:
+            self._append({"op": "count", "product_id": product_id, "quantity": int(quantity)})
+        self._maybe_checkpoint()
+
+    def sell(self, product_id: str, quantity: int) -> Tuple[bool, Any]:
+        """Sells from available stock. Returns (True, available_after) or (False, reason)."""
+        with self._locks[self._stripe(product_id)]:
+            if product_id not in self._stock:
+                return False, "Product ID not found."
+            if quantity <= 0:
+                return False, "Quantity must be positive."
+            if self._stock[product_id] - self._reserved[product_id] < quantity:
+                return False, "Insufficient stock."
+            self._append({"op": "sell", "product_id": product_id, "quantity": quantity})
+            remaining = self._stock[product_id] - self._reserved[product_id]
+        self._maybe_checkpoint()
+        return True, remaining
+
+    def reserve(self, reservation_id: str, items: Dict[str, int], owner: str,
+                expires_at: Optional[float]) -> Dict[str, str]:
+        """Holds every SKU in items or none of them. Returns {} or {product_id: reason}."""
+        locks = self._acquire(items)
+        try:
+            failures = {}
+            for product_id, quantity in items.items():
+                if product_id not in self._stock:
+                    failures[product_id] = "Item not found"
+                elif quantity <= 0:
+                    failures[product_id] = "Quantity must be positive"
+                elif self._stock[product_id] - self._reserved[product_id] < quantity:
+                    failures[product_id] = "Insufficient stock"
+            if failures:
+                return failures
+            self._append({
+                "op": "reserve", "ref": reservation_id, "items": dict(items),
+                "owner": owner, "expires_at": expires_at
+            })
+        finally:
+            self._release_locks(locks)
+        self._maybe_checkpoint()
+        return {}
+
+    def _settle(self, op: str, reservation_id: str) -> Optional[Dict[str, int]]:
+        hold = self._holds.get(reservation_id)
+        if hold is None:
+            return None
+        locks = self._acquire(hold["items"])
+        try:
+            # Re-check under the stripes: a concurrent release may have won
+            if reservation_id not in self._holds:
+                return None
+            self._append({"op": op, "ref": reservation_id})
+        finally:
+            self._release_locks(locks)
+        self._maybe_checkpoint()
+        return hold["items"]
+
+    def release(self, reservation_id: str) -> Optional[Dict[str, int]]:
+        """Puts a hold's units back on sale; returns its items, or None if it is gone."""
+        return self._settle("release", reservation_id)
+
+    def commit(self, reservation_id: str) -> Optional[Dict[str, int]]:
+        """Turns a hold into a sale: its units leave stock for good."""
+        return self._settle("commit", reservation_id)
+
+    # ── Persistence ───────────────────────────────────────────────────────────
+    def _recover(self) -> None:
+        snapshot_path = os.path.join(self.path, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            self.seq = snapshot["seq"]
+            self._stock = snapshot["stock"]
+            self._reserved = snapshot["reserved"]
+            self._holds = snapshot["holds"]
+
+        wal_path = os.path.join(self.path, WAL_FILE)
+        if os.path.exists(wal_path):
+            good = 0  # byte offset just past the last complete entry
+            with open(wal_path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("unterminated entry")
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # torn final write from a crash
+                    good += len(line)
+                    # Entries already folded into the snapshot are skipped
+                    if entry["seq"] > self.seq:
+                        self._apply(entry)
+                        self.seq = entry["seq"]
+                        self._since_snapshot += 1
+            # Cut the torn tail off, or new entries would be appended behind it
+            # and the next recovery would stop there and lose them
+            if good < os.path.getsize(wal_path):
+                print(f"[StockLedger] Truncating torn WAL tail at byte {good}")
+                with open(wal_path, "r+b") as f:
+                    f.truncate(good)
+                    f.flush()
+                    os.fsync(f.fileno())
+        print(f"[StockLedger] Recovered {len(self._stock)} SKUs at seq {self.seq} ({self._since_snapshot} WAL entries replayed)")
+
+    def checkpoint(self, min_entries: int = 0) -> None:
+        """Writes a snapshot of the counters and open holds, then truncates the WAL."""
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            with self._log_lock:
+                # Another thread may have checkpointed while we waited for the stripes
+                if self._wal is None or self._since_snapshot < min_entries:
+                    return
+                snapshot = {
+                    "seq": self.seq, "stock": self._stock,
+                    "reserved": self._reserved, "holds": self._holds
+                }
+                tmp = os.path.join(self.path, SNAPSHOT_FILE + ".tmp")
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(snapshot, f, separators=(",", ":"))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, os.path.join(self.path, SNAPSHOT_FILE))
+                self._wal.truncate(0)
+                self._since_snapshot = 0
+        finally:
+            self._release_locks(self._locks)
+
+    def close(self) -> None:
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+
+
+# ── SQLite (shared by workers) ────────────────────────────────────────────────
+_LEDGER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stock (
+    product_id TEXT PRIMARY KEY,
+    stock      INTEGER NOT NULL,
+    reserved   INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS holds (
+    ref        TEXT PRIMARY KEY,
+    owner      TEXT NOT NULL,
+    expires_at REAL,
+    items      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS holds_owner ON holds(owner);
+CREATE INDEX IF NOT EXISTS holds_expiry ON holds(expires_at) WHERE expires_at IS NOT NULL;
+CREATE TABLE IF NOT EXISTS ledger_seq (id INTEGER PRIMARY KEY CHECK (id = 0), seq INTEGER NOT NULL);
+INSERT OR IGNORE INTO ledger_seq (id, seq) VALUES (0, 0);
+"""
+_BUMP_SEQ = "UPDATE ledger_seq SET seq = seq + 1 WHERE id = 0"
+_RESERVE_LINE = "UPDATE stock SET reserved = reserved + ? WHERE product_id = ? AND stock - reserved >= ?"
+_SELL = "UPDATE stock SET stock = stock - ? WHERE product_id = ? AND stock - reserved >= ? RETURNING stock - reserved"
+
+
+class SQLiteStockLedger:
+    """
+    The StockLedger interface over one SQLite file shared by every worker.
+    Writes are BEGIN IMMEDIATE transactions, so SQLite's write lock orders them
+    across processes; busy_timeout queues writers instead of failing.
+    """
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, cached_statements=32)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute("PRAGMA busy_timeout = 5000")
+        self._conn.executescript(_LEDGER_SCHEMA)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        """One transaction, moving seq if it changed anything; rolled back if the body raises."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = self._conn.total_changes
+                yield self._conn
+                if self._conn.total_changes != before:
+                    self._conn.execute(_BUMP_SEQ)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @property
+    def version(self) -> int:
+        """Moves with every movement made by any worker."""
+        with self._lock:
+            return self._conn.execute("SELECT seq FROM ledger_seq WHERE id = 0").fetchone()[0]
+
+    # ── Reads ─────────────────────────────────────────────────────────────────
+    def get(self, product_id: str) -> Optional[Dict[str, int]]:
+        with self._lock:
+            row = self._conn.execute("SELECT stock, reserved FROM stock WHERE product_id = ?", (product_id,)).fetchone()
+        return {"stock": row[0], "reserved": row[1]} if row else None
+
+    def available(self, product_id: str) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT stock - reserved FROM stock WHERE product_id = ?", (product_id,)).fetchone()
+        return row[0] if row else 0
+
+    def hold(self, reservation_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT owner, expires_at, items FROM holds WHERE ref = ?",
+                                     (reservation_id,)).fetchone()
+        return {"owner": row[0], "expires_at": row[1], "items": json.loads(row[2])} if row else None
+
+    def holds(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT ref, owner, expires_at, items FROM holds").fetchall()
+        return {ref: {"owner": owner, "expires_at": expires_at, "items": json.loads(items)}
+                for ref, owner, expires_at, items in rows}
+
+    def owned_by(self, owner: str) -> List[str]:
+        """Ids of the holds an owner has open, whichever worker made them."""
+        with self._lock:
+            return [ref for (ref,) in self._conn.execute("SELECT ref FROM holds WHERE owner = ?", (owner,))]
+
+    def next_expiry(self) -> Optional[float]:
+        with self._lock:
+            return self._conn.execute("SELECT MIN(expires_at) FROM holds WHERE expires_at IS NOT NULL").fetchone()[0]
+
+    def due(self, now: float) -> List[str]:
+        """Ids of the holds whose expiry has passed."""
+        with self._lock:
+            return [ref for (ref,) in self._conn.execute(
+                "SELECT ref FROM holds WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))]
+
+    def totals(self) -> Dict[str, int]:
+        with self._lock:
+            stock, reserved = self._conn.execute(
+                "SELECT COALESCE(SUM(stock), 0), COALESCE(SUM(reserved), 0) FROM stock").fetchone()
+        return {"stock": stock, "reserved": reserved}
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            seq = self._conn.execute("SELECT seq FROM ledger_seq WHERE id = 0").fetchone()[0]
+            skus = self._conn.execute("SELECT COUNT(*) FROM stock").fetchone()[0]
+            open_holds = self._conn.execute("SELECT COUNT(*) FROM holds").fetchone()[0]
+        return {"seq": seq, "skus": skus, "open_holds": open_holds, "persistent": True, "shared": True}
+
+    # ── Movements ─────────────────────────────────────────────────────────────
+    def seed(self, stock: Dict[str, int]) -> int:
+        """Opening counts for SKUs the ledger has not seen yet; known SKUs keep their position."""
+        with self._write() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO stock (product_id, stock) VALUES (?, ?)",
+                             [(pid, int(qty)) for pid, qty in stock.items()])
+            return conn.total_changes - before
+
+    def count(self, product_id: str, quantity: int) -> None:
+        """Stock-take: sets the units on hand (open holds are unaffected)."""
+        with self._write() as conn:
+            conn.execute("INSERT INTO stock (product_id, stock) VALUES (?, ?) "
+                         "ON CONFLICT(product_id) DO UPDATE SET stock = excluded.stock", (product_id, int(quantity)))
+
+    def sell(self, product_id: str, quantity: int) -> Tuple[bool, Any]:
+        """Sells from available stock. Returns (True, available_after) or (False, reason)."""
+        if quantity <= 0:
+            return False, "Quantity must be positive."
+        with self._write() as conn:
+            row = conn.execute(_SELL, (quantity, product_id, quantity)).fetchone()
+            if row is not None:
+                return True, row[0]
+            exists = conn.execute("SELECT 1 FROM stock WHERE product_id = ?", (product_id,)).fetchone()
+        return False, "Insufficient stock." if exists else "Product ID not found."
+
+    def reserve(self, reservation_id: str, items: Dict[str, int], owner: str,
+                expires_at: Optional[float]) -> Dict[str, str]:
+        """Holds every SKU in items or none of them. Returns {} or {product_id: reason}."""
+        failures = {pid: "Quantity must be positive" for pid, quantity in items.items() if quantity <= 0}
+        if failures:
+            return failures
+        try:
+            with self._write() as conn:
+                for product_id, quantity in items.items():
+                    if conn.execute(_RESERVE_LINE, (quantity, product_id, quantity)).rowcount == 0:
+                        exists = conn.execute("SELECT 1 FROM stock WHERE product_id = ?", (product_id,)).fetchone()
+                        failures[product_id] = "Insufficient stock" if exists else "Item not found"
+                if failures:
+                    # Rolls back the lines that did fit
+                    raise _Unavailable()
+                conn.execute("INSERT INTO holds (ref, owner, expires_at, items) VALUES (?, ?, ?, ?)",
+                             (reservation_id, owner, expires_at, json.dumps(items)))
+        except _Unavailable:
+            return failures
+        return {}
+
+    def _settle(self, op: str, reservation_id: str) -> Optional[Dict[str, int]]:
+        with self._write() as conn:
+            row = conn.execute("DELETE FROM holds WHERE ref = ? RETURNING items", (reservation_id,)).fetchone()
+            if row is None:
+                return None
+            items = json.loads(row[0])
+            sold = 1 if op == "commit" else 0
+            conn.executemany("UPDATE stock SET reserved = reserved - ?, stock = stock - ? * ? WHERE product_id = ?",
+                             [(quantity, quantity, sold, pid) for pid, quantity in items.items()])
+        return items
+
+    def release(self, reservation_id: str) -> Optional[Dict[str, int]]:
+        """Puts a hold's units back on sale; returns its items, or None if it is gone."""
+        return self._settle("release", reservation_id)
+
+    def commit(self, reservation_id: str) -> Optional[Dict[str, int]]:
+        """Turns a hold into a sale: its units leave stock for good."""
+        return self._settle("commit", reservation_id)
+
+    # ── Lifecycle ─────────────────────────────────────────────────────────────
+    def checkpoint(self, min_entries: int = 0) -> None:
+        """Folds SQLite's own WAL back into the database file."""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class _Unavailable(Exception):
+    """Aborts a reservation transaction when a line cannot be held."""
+
+
+def open_stock_ledger(path: str, db: str = ""):
+    """
+    Ledger in the SQLite file db (shared by all workers), else persisted under
+    path, or in memory only when both are empty.
+    """
+    if db:
+        return SQLiteStockLedger(db)
+    return StockLedger(path or None)
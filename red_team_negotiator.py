@@ -1,6 +1,7 @@
 import asyncio
 import json
 from adk.engine import AgentState
+from adk.scheduler import background
 from agents.negotiator_agent import negotiator_agent
 from mcp_servers.catalog_server import CATALOG_DB
 
@@ -33,6 +34,11 @@ ATTACK_VECTORS = [
 ]
 
 async def run_red_team_tests():
+    # Red-team calls yield to interactive ones in the LLM scheduler they share
+    with background(session="red_team"):
+        await _run_attacks()
+
+async def _run_attacks():
     print("==================================================")
     print("      NEGOTIATOR AGENT RED TEAMING STARTING       ")
     print("==================================================")
@@ -56,13 +56,16 @@ export async function initCatalog() {
 
 async function fetchCatalog() {
     try {
-        const res = await fetch("/api/catalog");
-        const data = await res.json();
-
-        // API returns { products: [...] } — an array, use it directly
-        allProducts = Array.isArray(data.products)
-            ? data.products
-            : Object.values(data.products);
+        // API returns { products: [...], next_cursor } — follow the cursor to the last page
+        const products = [];
+        let cursor = null;
+        do {
+            const url = "/api/catalog?limit=500" + (cursor ? `&cursor=${encodeURIComponent(cursor)}` : "");
+            const data = await (await fetch(url)).json();
+            products.push(...data.products);
+            cursor = data.next_cursor;
+        } while (cursor);
+        allProducts = products;
 
         renderCategoryPills();
         renderCatalog(allProducts);
@@ -16,6 +16,7 @@ export function initChat() {
     const aiWidgetBadge = document.getElementById("aiWidgetBadge");
 
     let currentBotMessageDiv = null;
+    let currentBotText = "";
     let isChatOpen = false;
 
     // Toggle logic
@@ -152,19 +153,60 @@ export function initChat() {
             aiWidgetBadge.style.display = 'block';
         }
 
-        // Format markdown
-        let htmlContent = marked.parse(content);
-
         if (!currentBotMessageDiv) {
             // Create a new bubble if there isn't one active for this turn
-            currentBotMessageDiv = appendMessage(htmlContent, 'assistant', true);
+            currentBotText = content;
+            currentBotMessageDiv = appendMessage(marked.parse(currentBotText), 'assistant', true);
         } else {
-            // Append to existing bubble to prevent multi-popups
-            currentBotMessageDiv.innerHTML += htmlContent;
+            // Streamed deltas (and later replies in the same turn) grow the same bubble,
+            // re-rendering the whole text so partial markdown settles as it completes
+            currentBotText += content;
+            currentBotMessageDiv.innerHTML = marked.parse(currentBotText);
             scrollToBottom();
         }
     });
 
+    wsClient.on('chat_stream_end', () => {
+        // Separate the next reply in this bubble from the one that just finished
+        if (currentBotMessageDiv) currentBotText += "\n\n";
+    });
+
+    wsClient.on('error', (data) => {
+        removeTypingIndicator();
+        appendMessage(data.message || "Something went wrong. Please try again.", 'system');
+        currentBotMessageDiv = null;
+    });
+
+    wsClient.on('turn_complete', () => {
+        // Whatever happened in the turn, the agent is no longer working
+        removeTypingIndicator();
+        agentStatus.textContent = `Agent: ${state.currentAgent}`;
+        agentStatus.classList.remove('pulse');
+    });
+
+    wsClient.on('user_message', (data) => {
+        // Sent from another tab on the same session
+        appendMessage(data.content, 'user');
+        currentBotMessageDiv = null;
+    });
+
+    wsClient.on('message_queued', (data) => {
+        agentStatus.textContent = data.coalesced
+            ? `Agent: ${state.currentAgent} (Will answer together with your last message)`
+            : `Agent: ${state.currentAgent} (Queued — finishing the previous reply)`;
+    });
+
+    wsClient.on('overloaded', (data) => {
+        appendMessage(data.message || "Please wait for the current reply before sending more.", 'system');
+    });
+
+    wsClient.on('busy', (data) => {
+        // The server shed this turn; the message was not recorded
+        appendMessage(data.message || "We're very busy right now — please try again shortly.", 'system');
+        agentStatus.textContent = `Agent: ${state.currentAgent}`;
+        agentStatus.classList.remove('pulse');
+    });
+
     wsClient.on('agent_transition', (data) => {
         // System message removed
     });
@@ -4,11 +4,22 @@ class WSClient {
     constructor() {
         this.ws = null;
         this.eventHandlers = {};
+        // Identifies this tab so a resume skips messages it sent itself
+        this.clientId = Math.random().toString(36).substring(2, 10);
+        // Position in the session's event stream, sent back on reconnect
+        this.epoch = null;
+        this.lastSeq = 0;
     }
 
     connect() {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const url = `${protocol}//${window.location.host}/ws/chat/${state.sessionId}`;
+        // batch=1: events arrive as JSON arrays; tool outputs are not rendered here
+        const params = new URLSearchParams({ client: this.clientId, batch: '1', tool_output: 'none' });
+        if (this.epoch) {
+            params.set('epoch', this.epoch);
+            params.set('last_seq', this.lastSeq);
+        }
+        const url = `${protocol}//${window.location.host}/ws/chat/${state.sessionId}?${params}`;
 
         this.ws = new WebSocket(url);
 
@@ -20,7 +31,7 @@ class WSClient {
         this.ws.onmessage = (event) => {
             try {
                 const data = JSON.parse(event.data);
-                this.routeEvent(data);
+                (Array.isArray(data) ? data : [data]).forEach(e => this.routeEvent(e));
             } catch (e) {
                 console.error("Error parsing WS message", e);
             }
@@ -33,16 +44,24 @@ class WSClient {
     }
 
     routeEvent(data) {
-        const { type, payload, agent } = data;
+        const { type, payload, agent, seq } = data;
+        if (seq) this.lastSeq = seq;
 
         switch (type) {
             case 'sync_state':
+                if (payload.epoch) {
+                    this.epoch = payload.epoch;
+                    this.lastSeq = payload.seq;
+                }
                 state.hydrate(payload);
                 this.trigger('sync_state', payload);
                 break;
             case 'chat_stream':
                 this.trigger('chat_stream', { text: payload, agent });
                 break;
+            case 'chat_stream_end':
+                this.trigger('chat_stream_end', { agent });
+                break;
             case 'agent_transition':
                 state.setAgent(payload.to);
                 this.trigger('agent_transition', payload);
@@ -56,9 +75,27 @@ class WSClient {
             case 'tool_call':
                 this.trigger('tool_call', payload);
                 break;
+            case 'error':
+                this.trigger('error', payload);
+                break;
             case 'reset_ui':
                 this.trigger('reset_ui', payload);
                 break;
+            case 'turn_complete':
+                this.trigger('turn_complete', payload);
+                break;
+            case 'user_message':
+                this.trigger('user_message', payload);
+                break;
+            case 'message_queued':
+                this.trigger('message_queued', payload);
+                break;
+            case 'overloaded':
+                this.trigger('overloaded', payload);
+                break;
+            case 'busy':
+                this.trigger('busy', payload);
+                break;
             default:
                 console.warn('Unknown event type:', type);
         }
@@ -0,0 +1,259 @@
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from typing import Callable, Dict, List, Tuple
+
+from mcp_servers.inventory_store import InventoryStore
+from mcp_servers.stock_ledger import StockLedger, SQLiteStockLedger
+from mcp_servers.catalog_store import MemoryCatalogStore, SQLiteCatalogStore
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  Inventory concurrency stress check
+#
+#  Hammers one SKU from hundreds of threads released together by a barrier and
+#  checks that exactly the available units are handed out: reservations,
+#  overlapping all-or-nothing batches, catalog stock deduction on both catalog
+#  stores, stock ledger recovery from its snapshot + WAL, and the SQLite ledger
+#  shared by several worker processes. Exits non-zero on any oversell or lost
+#  update.
+#
+#    python stress_inventory.py                    # default: 500 threads x 20 rounds
+#    python stress_inventory.py --threads 1000 --rounds 50
+#    python stress_inventory.py --baseline         # also run the old unlocked code to show it oversells
+# ══════════════════════════════════════════════════════════════════════════════
+
+
+def hammer(threads: int, attempt: Callable[[int], bool]) -> int:
+    """Runs attempt(i) on `threads` threads started at the same instant; returns how many succeeded."""
+    barrier = threading.Barrier(threads)
+    wins: List[bool] = [False] * threads
+
+    def worker(i: int) -> None:
+        barrier.wait()
+        wins[i] = attempt(i)
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join(timeout=60)
+        if t.is_alive():
+            raise RuntimeError("worker did not finish — possible deadlock")
+    return sum(wins)
+
+
+def unlocked_reserve(records: Dict[str, Dict[str, int]], product_id: str, quantity: int) -> bool:
+    """The original read-check-increment, kept only as a baseline."""
+    item = records[product_id]
+    available = item["stock"] - item["reserved"]
+    # Yield between check and update, as any real lookup (DB, network) would
+    time.sleep(0)
+    if available >= quantity:
+        records[product_id]["reserved"] = item["reserved"] + quantity
+        return True
+    return False
+
+
+def inventory(stock: Dict[str, int], **ledger_options) -> InventoryStore:
+    ledger = StockLedger(**ledger_options)
+    ledger.seed(stock)
+    return InventoryStore(ledger)
+
+
+def check_single_sku(threads: int, rounds: int, units: int) -> Tuple[bool, str]:
+    for _ in range(rounds):
+        store = inventory({"hot": units})
+        won = hammer(threads, lambda i: bool(store.reserve("hot", 1)[0]))
+        reserved = store.get("hot")["reserved"]
+        if won != units or reserved != units:
+            return False, f"{won} reservations succeeded, reserved={reserved}, expected {units}"
+    return True, f"{rounds} rounds x {threads} threads, exactly {units} units reserved each time"
+
+
+def check_release(threads: int, rounds: int, units: int) -> Tuple[bool, str]:
+    """Every thread reserves and odd threads release at once; reserved must equal the units still held."""
+    for _ in range(rounds):
+        store = inventory({"hot": units})
+        held: List[bool] = [False] * threads
+
+        def attempt(i: int) -> bool:
+            reservation_id, _ = store.reserve("hot", 1)
+            if reservation_id and i % 2:
+                store.release(reservation_id)
+            held[i] = bool(reservation_id) and not i % 2
+            return bool(reservation_id)
+
+        hammer(threads, attempt)
+        reserved = store.get("hot")["reserved"]
+        if reserved != sum(held) or reserved > units:
+            return False, f"reserved={reserved}, threads still holding a unit={sum(held)}, stock={units}"
+    return True, f"{rounds} rounds of interleaved reserve/release, reserved always equals units held"
+
+
+def check_batches(threads: int, rounds: int, skus: int, seed: int) -> Tuple[bool, str]:
+    rng = random.Random(seed)
+    for _ in range(rounds):
+        stock = {f"p{i}": rng.randint(1, 20) for i in range(skus)}
+        store = inventory(stock, stripes=8)
+        batches = [
+            {pid: rng.randint(1, 3) for pid in rng.sample(sorted(stock), rng.randint(2, 5))}
+            for _ in range(threads)
+        ]
+        granted: List[Dict[str, int]] = []
+        lock = threading.Lock()
+
+        def attempt(i: int) -> bool:
+            reservation_id, _ = store.reserve_many(batches[i])
+            if reservation_id:
+                with lock:
+                    granted.append(batches[i])
+            return bool(reservation_id)
+
+        hammer(threads, attempt)
+        expected = {pid: 0 for pid in stock}
+        for batch in granted:
+            for pid, qty in batch.items():
+                expected[pid] += qty
+        for pid in stock:
+            reserved = store.get(pid)["reserved"]
+            if reserved != expected[pid] or reserved > stock[pid]:
+                return False, f"{pid}: reserved={reserved} granted={expected[pid]} stock={stock[pid]}"
+    return True, f"{rounds} rounds x {threads} overlapping batches on {skus} SKUs, no partial or over-reservation"
+
+
+def check_deduct(threads: int, rounds: int, units: int) -> Tuple[bool, str]:
+    def product(stock: int) -> Dict:
+        return {
+            "id": "hot", "name": "Hot Item", "mrp": 1.0, "price": 1.0, "cost_price": 0.5,
+            "stock": stock, "image_url": "", "category": "Test", "description": "", "key_features": []
+        }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for r in range(rounds):
+            sqlite_store = SQLiteCatalogStore(f"{tmp}/catalog_{r}.db")
+            sqlite_store.upsert(product(units))
+            ledger_store = MemoryCatalogStore([product(units)], StockLedger())
+            ledger_store.ledger.seed(ledger_store.stock_levels())
+            for store in (MemoryCatalogStore([product(units)]), sqlite_store, ledger_store):
+                won = hammer(threads, lambda i: store.deduct_stock("hot", 1)[0])
+                left = store.get("hot")["stock"]
+                if won != units or left != 0:
+                    return False, f"{type(store).__name__}: {won} deductions succeeded, stock left {left}, expected {units}/0"
+    return True, f"{rounds} rounds x {threads} threads on memory, SQLite and ledger-backed catalog stores, exactly {units} deducted"
+
+
+def check_expiry(threads: int, units: int) -> Tuple[bool, str]:
+    """Short-lived holds from many threads must all come back once the sweeper runs past their expiry."""
+    store = inventory({"hot": units})
+    won = hammer(threads, lambda i: bool(store.reserve("hot", 1, owner=f"s{i}", ttl=0.05)[0]))
+    time.sleep(0.1)
+    expired = len(store.expire_due())
+    item = store.get("hot")
+    if expired != won or item["reserved"] != 0 or store.metrics()["active_reservations"]:
+        return False, f"{won} holds, {expired} expired, reserved={item['reserved']} afterwards"
+    return True, f"all {won} short-lived holds expired and returned to sale"
+
+
+def check_ledger_recovery(threads: int, units: int) -> Tuple[bool, str]:
+    """Concurrent reserve / commit / release / sell across a checkpoint; a reopened ledger must match exactly."""
+    with tempfile.TemporaryDirectory() as tmp:
+        ledger = StockLedger(tmp, snapshot_every=max(1, threads // 3))
+        ledger.seed({"hot": units * 4, "cold": units})
+        store = InventoryStore(ledger)
+
+        def attempt(i: int) -> bool:
+            if i % 4 == 3:
+                return ledger.sell("cold", 1)[0]
+            reservation_id, _ = store.reserve_many({"hot": 1, "cold": 1} if i % 4 == 2 else {"hot": 2}, owner=f"s{i}")
+            if reservation_id and i % 4 == 1:
+                store.release(reservation_id)
+            elif reservation_id and i % 4 == 0:
+                store.commit(reservation_id)
+            return bool(reservation_id)
+
+        hammer(threads, attempt)
+        before = {pid: ledger.get(pid) for pid in ("hot", "cold")}
+        holds = ledger.holds()
+        ledger.close()
+        reopened = StockLedger(tmp)
+        after = {pid: reopened.get(pid) for pid in ("hot", "cold")}
+        reopened.close()
+        if after != before or len(reopened.holds()) != len(holds) or any(r["stock"] < r["reserved"] for r in after.values()):
+            return False, f"before restart {before}, after {after}"
+    return True, f"{threads} threads of mixed movements; snapshot + WAL replay restored {before}"
+
+
+def _worker_reserve(args: Tuple[str, int, int]) -> int:
+    """One "worker process": its own connection and InventoryStore, reserving one unit per thread."""
+    path, worker, threads = args
+    store = InventoryStore(SQLiteStockLedger(path))
+    return hammer(threads, lambda i: bool(store.reserve("hot", 1, owner=f"w{worker}")[0]))
+
+
+def check_shared_ledger(processes: int, threads: int, units: int) -> Tuple[bool, str]:
+    """Processes reserving from one SQLite ledger hand out exactly the units; any process can release the rest."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = f"{tmp}/stock.db"
+        SQLiteStockLedger(path).seed({"hot": units})
+        with multiprocessing.Pool(processes) as pool:
+            wins = pool.map(_worker_reserve, [(path, w, max(1, threads // processes)) for w in range(processes)])
+        store = InventoryStore(SQLiteStockLedger(path))
+        reserved = store.get("hot")["reserved"]
+        if sum(wins) != units or reserved != units:
+            return False, f"{sum(wins)} reservations succeeded across {processes} processes, reserved={reserved}, expected {units}"
+        released = store.release_owner("w0")
+        left = store.get("hot")["reserved"]
+        if released != wins[0] or left != units - wins[0]:
+            return False, f"released {released} of w0's {wins[0]} holds from another process, reserved={left}"
+    return True, f"{processes} processes x {threads // processes} threads, exactly {units} units reserved; holds released cross-process"
+
+
+def check_baseline(threads: int, rounds: int, units: int) -> Tuple[bool, str]:
+    oversold = 0
+    for _ in range(rounds):
+        records = {"hot": {"stock": units, "reserved": 0}}
+        won = hammer(threads, lambda i: unlocked_reserve(records, "hot", 1))
+        oversold += max(0, won - units)
+    return True, f"unlocked read-check-increment oversold {oversold} units over {rounds} rounds"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Concurrency stress check for inventory reservations and stock deduction")
+    parser.add_argument("--threads", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--units", type=int, default=37, help="units available on the hot SKU")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", action="store_true", help="also run the unlocked pre-store code")
+    args = parser.parse_args()
+
+    # Switch threads as often as possible so races surface quickly
+    sys.setswitchinterval(1e-6)
+
+    checks = {
+        "single_sku_reserve": lambda: check_single_sku(args.threads, args.rounds, args.units),
+        "reserve_release": lambda: check_release(args.threads, args.rounds, args.units),
+        "multi_sku_batches": lambda: check_batches(args.threads, args.rounds, 12, args.seed),
+        "reservation_expiry": lambda: check_expiry(args.threads, args.units),
+        "ledger_recovery": lambda: check_ledger_recovery(args.threads, args.units),
+        "catalog_deduct_stock": lambda: check_deduct(args.threads, max(1, args.rounds // 4), args.units),
+        "shared_ledger_processes": lambda: check_shared_ledger(4, args.threads, args.units),
+    }
+    if args.baseline:
+        checks["baseline_unlocked"] = lambda: check_baseline(args.threads, args.rounds, args.units)
+
+    report, failed = {}, False
+    for name, check in checks.items():
+        ok, detail = check()
+        report[name] = {"ok": ok, "detail": detail}
+        failed = failed or not ok
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 import json
-from adk.engine import AgentState
+from adk.engine import AgentState, TurnBudget
 from agents.discovery_agent import discovery_agent
 from agents.negotiator_agent import negotiator_agent
 from agents.inventory_agent import inventory_agent
@@ -19,9 +19,9 @@ def run_retail_workflow():
     print("=" * 60)
     
     # Pre-fetch the catalog to show automatically in the welcome prompt
-    from mcp_servers.catalog_server import CATALOG_DB
+    from mcp_servers.catalog_server import CATALOG_STORE
     print("\nOur Featured Catalog:")
-    for item in CATALOG_DB:
+    for item in CATALOG_STORE.list_products(limit=20):
         print(f"  • {item['name']} - Rs. {item['price']}")
     print("-" * 60)
         
@@ -34,6 +34,7 @@ def run_retail_workflow():
             break
             
         state.messages.append({"role": "user", "content": user_input})
+        budget = TurnBudget()
         
         break_to_user = False
         while state.current_agent in AGENTS and not break_to_user:
@@ -41,7 +42,7 @@ def run_retail_workflow():
             agent = AGENTS[current_name]
             
             print(f"\n--- {agent.name} is active ---")
-            state = agent.run(state)
+            state = agent.run(state, budget=budget)
             
             # Print the agent's last unprinted response
             import re